@@ -0,0 +1,154 @@
+# Tracker throughput benchmarks. Synthetic videos of different lengths and roi counts are made and for each one the
+# stages are timed: decoding only, building the background and tracking (with each blob backend, at the usual threshold
+# and at a threshold low enough to let the pixel noise through, as the component backends are only faster on such
+# noisy masks, see tracking/blobs.py). Each stage runs in its own process so the peak memory can be measured. Results
+# are compared to a stored baseline (yaml) so you can see if a change made things faster or slower.
+
+import os
+import sys
+import time
+import tempfile
+import multiprocessing
+
+import cv2.cv2 as cv2
+import yaml
+
+from cichlidanalysis.benchmarks.synthetic_video import make_synthetic_video
+from cichlidanalysis.tracking.backgrounds import background_vid
+from cichlidanalysis.tracking.offline_tracker import tracker
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.yaml")
+# changes in frames/sec smaller than this fraction are reported as unchanged
+TOLERANCE = 0.1
+# low enough to let the pixel noise of the synthetic videos through, giving masks with many noise blobs
+NOISY_THRESHOLD = 10
+
+
+def peak_memory_mb():
+    """ Peak resident memory of this process in MB, None where the resource module isn't available (Windows) """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kB on linux, bytes on mac
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+
+def stage_decode(video_path, background, rois):
+    cap = cv2.VideoCapture(video_path)
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    cap.release()
+
+
+def stage_background(video_path, background, rois, **kwargs):
+    background_vid(video_path, 10, 90, display=False, **kwargs)
+
+
+def stage_track(video_path, background, rois, threshold=35, **kwargs):
+    tracker(video_path, background, dict(rois), threshold=threshold, display=False, area_size=50, **kwargs)
+
+
+STAGES = {"decode": (stage_decode, {}),
+          "background": (stage_background, {"sampling": "grab"}),
+          "background_seek": (stage_background, {"sampling": "seek"}),
+          "track_contours": (stage_track, {"blob_backend": "contours"}),
+          "track_components": (stage_track, {"blob_backend": "components"}),
+          "track_label_map": (stage_track, {"blob_backend": "label_map"}),
+          "track_contours_noisy": (stage_track, {"blob_backend": "contours", "threshold": NOISY_THRESHOLD}),
+          "track_components_noisy": (stage_track, {"blob_backend": "components", "threshold": NOISY_THRESHOLD}),
+          "track_label_map_noisy": (stage_track, {"blob_backend": "label_map", "threshold": NOISY_THRESHOLD}),
+          "track_motion_gate": (stage_track, {"motion_gate": 10}),
+          "track_ffmpeg": (stage_track, {"video_reader": "ffmpeg"}),
+          "track_downscale_2": (stage_track, {"downscale": 2})}
+
+
+def _run_stage(stage, video_path, background, rois):
+    """ Runs in a new process: times the stage and measures how much the peak memory grew """
+    function, kwargs = STAGES[stage]
+    start_memory = peak_memory_mb()
+    start = time.perf_counter()
+    function(video_path, background, rois, **kwargs)
+    seconds = time.perf_counter() - start
+    end_memory = peak_memory_mb()
+    peak_increase = None if start_memory is None else round(end_memory - start_memory, 1)
+    return seconds, peak_increase
+
+
+def run_benchmarks(lengths=(300, 3000), roi_counts=(1, 4), stages=None, width=640, height=480):
+    """ Runs all stages for each video length and roi count.
+
+    :return: dictionary of "stage_Nframes_Nrois": {"fps", "seconds", "peak_mb"}
+    """
+    if stages is None:
+        stages = list(STAGES)
+    results = dict()
+    with tempfile.TemporaryDirectory() as folder:
+        for n_frames in lengths:
+            for n_rois in roi_counts:
+                video_path = os.path.join(folder, "bench_{}f_{}rois.mp4".format(n_frames, n_rois))
+                background, rois, _ = make_synthetic_video(video_path, n_frames, n_rois, width, height)
+                for stage in stages:
+                    with multiprocessing.get_context("spawn").Pool(1) as pool:
+                        seconds, peak_mb = pool.apply(_run_stage, (stage, video_path, background, rois))
+                    key = "{}_{}f_{}rois".format(stage, n_frames, n_rois)
+                    results[key] = {"fps": round(n_frames / seconds, 1), "seconds": round(seconds, 3),
+                                    "peak_mb": peak_mb}
+                    print("{}: {:.1f} frames/sec".format(key, results[key]["fps"]))
+    return results
+
+
+def compare_to_baseline(results, baseline):
+    """ Prints a table of the results with the change in frames/sec from the baseline.
+
+    :return: list of the keys which got slower by more than TOLERANCE
+    """
+    slower = []
+    print("{:<40}{:>10}{:>10}{:>9}{:>10}".format("benchmark", "fps", "baseline", "change", "peak MB"))
+    for key, result in results.items():
+        if key in baseline:
+            change = result["fps"] / baseline[key]["fps"] - 1
+            base_fps = "{:.1f}".format(baseline[key]["fps"])
+            change_str = "{:+.0%}".format(change)
+            if change < -TOLERANCE:
+                slower.append(key)
+                change_str += " !"
+        else:
+            base_fps, change_str = "-", "new"
+        print("{:<40}{:>10.1f}{:>10}{:>9}{:>10}".format(key, result["fps"], base_fps, change_str,
+                                                        str(result["peak_mb"])))
+    if slower:
+        print("slower than the baseline: {}".format(", ".join(slower)))
+    return slower
+
+
+def load_baseline(baseline_path=BASELINE_PATH):
+    if not os.path.isfile(baseline_path):
+        return {}
+    with open(baseline_path) as file:
+        return yaml.load(file, Loader=yaml.FullLoader)
+
+
+def save_baseline(results, baseline_path=BASELINE_PATH):
+    with open(baseline_path, "w") as file:
+        yaml.dump(results, file)
+    print("baseline saved to {}".format(baseline_path))
+
+
+if __name__ == '__main__':
+    results = run_benchmarks()
+    baseline = load_baseline()
+    if baseline:
+        compare_to_baseline(results, baseline)
+    else:
+        print("no baseline found")
+
+    save_new = 'm'
+    while save_new not in {'y', 'n'}:
+        save_new = input("Save these results as the baseline? y/n: \n")
+    if save_new == 'y':
+        save_baseline(results)
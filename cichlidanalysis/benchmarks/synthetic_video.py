@@ -0,0 +1,90 @@
+# Makes synthetic recordings for testing and benchmarking the tracking: a static textured (sand like) background split
+# into rois, with one dark fish-like ellipse per roi which swims around and rests, pixel noise and a slow drift of the
+# lighting. The true fish positions are returned so tracking accuracy can be checked.
+
+import cv2.cv2 as cv2
+import numpy as np
+
+
+def make_background(width, height, rng, base_level=170):
+    """ Textured background: blurred noise around base_level """
+    texture = rng.normal(0, 25, (height, width)).astype(np.float32)
+    texture = cv2.GaussianBlur(texture, (0, 0), 3)
+    return np.clip(base_level + texture, 0, 255).astype(np.uint8)
+
+
+def make_rois(width, height, n_rois, gap=4):
+    """ Splits the frame into n_rois side by side rois (with a gap between them) in the roi_file format """
+    rois = {"cam_ID": "synthetic"}
+    roi_width = width // n_rois
+    for roi in range(n_rois):
+        rois["roi_" + str(roi)] = (roi * roi_width, 0, roi_width - gap, height)
+    return rois
+
+
+def swim_paths(n_frames, rois, rng, fish_length, speed=3.0, rest_prob=0.01, wake_prob=0.02):
+    """ Random swimming with rests for one fish per roi. Returns an array (n_rois, n_frames, 3) of x, y (in roi
+    coordinates) and heading angle in degrees"""
+    roi_nums = sorted(int(key.split("_")[1]) for key in rois if key.startswith("roi_"))
+    paths = np.zeros([len(roi_nums), n_frames, 3])
+    margin = fish_length
+    for i, roi in enumerate(roi_nums):
+        _, _, w, h = rois["roi_" + str(roi)]
+        pos = np.array([rng.uniform(margin, w - margin), rng.uniform(margin, h - margin)])
+        heading = rng.uniform(0, 2 * np.pi)
+        resting = False
+        for frame_n in range(n_frames):
+            if resting:
+                resting = rng.random() > wake_prob
+            else:
+                resting = rng.random() < rest_prob
+                heading += rng.normal(0, 0.2)
+                pos = pos + speed * np.array([np.cos(heading), np.sin(heading)])
+                # turn around at the walls
+                if not margin < pos[0] < w - margin:
+                    heading = np.pi - heading
+                    pos[0] = np.clip(pos[0], margin, w - margin)
+                if not margin < pos[1] < h - margin:
+                    heading = -heading
+                    pos[1] = np.clip(pos[1], margin, h - margin)
+            paths[i, frame_n] = (pos[0], pos[1], np.degrees(heading))
+    return paths
+
+
+def make_synthetic_video(video_path, n_frames=300, n_rois=1, width=320, height=240, fps=10, fish_length=24,
+                         noise=4.0, drift=10.0, seed=0):
+    """ Writes a synthetic recording (mp4v codec, use .mp4 or .avi) and returns the background (without noise or
+    drift), the rois and the true fish centroids as an array of (n_rois, n_frames, 2) in roi coordinates.
+
+    :param video_path: where to save the video
+    :param n_frames: length of the video
+    :param n_rois: number of rois (one fish each)
+    :param width: frame width
+    :param height: frame height
+    :param fps: frame rate
+    :param fish_length: length of the fish ellipse in pixels
+    :param noise: standard deviation of the pixel noise added to every frame
+    :param drift: amplitude of the lighting drift over the video (grey levels)
+    :param seed: random seed
+    :return: background, rois, positions
+    """
+    rng = np.random.default_rng(seed)
+    background = make_background(width, height, rng)
+    rois = make_rois(width, height, n_rois)
+    paths = swim_paths(n_frames, rois, rng, fish_length)
+
+    writer = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+    for frame_n in range(n_frames):
+        frame = background.astype(np.float32)
+        for i in range(n_rois):
+            x0, y0, _, _ = rois["roi_" + str(i)]
+            x, y, angle = paths[i, frame_n]
+            cv2.ellipse(frame, (int(round(x0 + x)), int(round(y0 + y))), (fish_length // 2, fish_length // 6), angle, 0,
+                        360, 60, -1)
+        frame += drift * np.sin(2 * np.pi * frame_n / max(n_frames, 1))
+        frame += rng.normal(0, noise, frame.shape).astype(np.float32)
+        frame = np.clip(frame, 0, 255).astype(np.uint8)
+        writer.write(cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR))
+    writer.release()
+
+    return background, rois, np.round(paths[:, :, 0:2])
@@ -0,0 +1,178 @@
+# Frame reader which has a local ffmpeg binary decode the video, convert it to grayscale and crop it, and pipes the raw
+# frames straight into numpy buffers. Compared to cv2.VideoCapture + cvtColor only a third (gray instead of BGR) of the
+# cropped frame goes through the pipe and Python never sees the colour frame. FFmpegCapture has the methods of
+# cv2.VideoCapture which are used in this package (read, grab, isOpened, release, get and set of the frame position) so
+# it can be used in its place, but read() returns 2D grayscale frames.
+
+import shutil
+import subprocess
+
+import cv2.cv2 as cv2
+import numpy as np
+
+VIDEO_READERS = ("opencv", "ffmpeg", "store")
+
+
+def ffmpeg_available():
+    return shutil.which("ffmpeg") is not None
+
+
+def rois_bounding_box(rois, roi_nums):
+    """ (x, y, w, h) of the smallest rectangle containing all the given rois
+    >>> rois_bounding_box({'roi_0': (10, 5, 20, 20), 'roi_1': (40, 0, 10, 10)}, [0, 1])
+    (10, 0, 40, 25)
+    """
+    corners = np.array([rois["roi_" + str(roi)] for roi in roi_nums])
+    x0, y0 = corners[:, 0].min(), corners[:, 1].min()
+    x1, y1 = (corners[:, 0] + corners[:, 2]).max(), (corners[:, 1] + corners[:, 3]).max()
+    return int(x0), int(y0), int(x1 - x0), int(y1 - y0)
+
+
+def crop_rois(rois, crop):
+    """ Copy of the rois dictionary with the roi coordinates relative to the crop (x, y, w, h) """
+    cropped = dict()
+    for key, value in rois.items():
+        if key.startswith("roi_"):
+            cropped[key] = (value[0] - crop[0], value[1] - crop[1], value[2], value[3])
+        else:
+            cropped[key] = value
+    return cropped
+
+
+class FFmpegCapture:
+    """ cv2.VideoCapture replacement reading grayscale (and optionally cropped to crop=(x, y, w, h)) frames from an
+    ffmpeg pipe """
+    # set(CAP_PROP_POS_FRAMES) always lands on the requested frame (see io.movies.seek_to_frame)
+    exact_seek = True
+
+    def __init__(self, video_path, crop=None, ffmpeg_path="ffmpeg"):
+        self.video_path = video_path
+        self.ffmpeg_path = ffmpeg_path
+        # the container metadata is read with OpenCV so no ffprobe is needed
+        cap = cv2.VideoCapture(video_path)
+        self.opened = cap.isOpened()
+        self.fps = cap.get(cv2.CAP_PROP_FPS)
+        self.frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.full_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.full_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        cap.release()
+
+        self.crop = crop
+        if crop is None:
+            self.width, self.height = self.full_width, self.full_height
+        else:
+            self.width, self.height = crop[2], crop[3]
+        self.frame_size = self.width * self.height
+        self.position = 0
+        self.process = None
+        # frames which are grabbed (skipped) are read into this buffer
+        self.scratch = np.empty((self.height, self.width), dtype=np.uint8)
+        if self.opened:
+            self._start(0)
+
+    def _start(self, frame_n):
+        """ (Re)starts ffmpeg so the next frame out of the pipe is frame_n """
+        self._stop()
+        command = [self.ffmpeg_path, "-v", "error", "-nostdin"]
+        if frame_n > 0:
+            # -ss before -i seeks to the keyframe before and decodes up to the time, which is frame accurate
+            command += ["-ss", "{:.6f}".format(frame_n / self.fps)]
+        command += ["-i", self.video_path, "-map", "0:v:0"]
+        if self.crop is not None:
+            # convert to gray first, otherwise the crop is rounded to the chroma subsampling (even x, y)
+            command += ["-vf", "format=gray,crop={2}:{3}:{0}:{1}".format(*self.crop)]
+        command += ["-f", "rawvideo", "-pix_fmt", "gray", "-"]
+        self.process = subprocess.Popen(command, stdout=subprocess.PIPE, bufsize=self.frame_size * 4)
+        self.position = frame_n
+
+    def _stop(self):
+        if self.process is not None:
+            # kill before closing the pipe so ffmpeg doesn't complain about the broken pipe
+            self.process.kill()
+            self.process.stdout.close()
+            self.process.wait()
+            self.process = None
+
+    def _read_into(self, frame):
+        """ Fills frame from the pipe, returns False at the end of the video """
+        if self.process is None:
+            return False
+        buffer = memoryview(frame).cast("B")
+        n_read = 0
+        while n_read < self.frame_size:
+            n = self.process.stdout.readinto(buffer[n_read:])
+            if not n:
+                self._stop()
+                return False
+            n_read += n
+        self.position += 1
+        return True
+
+    def isOpened(self):
+        return self.process is not None
+
+    def read(self):
+        frame = np.empty((self.height, self.width), dtype=np.uint8)
+        if self._read_into(frame):
+            return True, frame
+        return False, None
+
+    def grab(self):
+        return self._read_into(self.scratch)
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            return float(self.position)
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return float(self.frame_count)
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return float(self.width)
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return float(self.height)
+        return 0.0
+
+    def set(self, prop, value):
+        if prop == cv2.CAP_PROP_POS_FRAMES and self.opened:
+            self._start(int(value))
+            return True
+        return False
+
+    def release(self):
+        self._stop()
+
+
+def open_video(video_path, video_reader="opencv", crop=None):
+    """ Opens a video with cv2.VideoCapture ("opencv") or FFmpegCapture ("ffmpeg", grayscale frames, optionally cropped
+    to crop=(x, y, w, h)). Falls back to OpenCV if there is no ffmpeg binary. "store" reads the decoded-frame store of
+    the video (grayscale frames, cropped to the crop of the store, see io/frame_store.py) if it covers crop and falls
+    back to OpenCV otherwise"""
+    if video_reader not in VIDEO_READERS:
+        raise ValueError("video_reader must be one of {}".format(VIDEO_READERS))
+    if video_reader == "store":
+        # imported here as frame_store builds on this module
+        from cichlidanalysis.io.frame_store import open_frame_store
+        store = open_frame_store(video_path, crop)
+        if store is not None:
+            return store
+        print("no frame store for {}, decoding the video".format(video_path))
+    if video_reader == "ffmpeg":
+        if ffmpeg_available():
+            return FFmpegCapture(video_path, crop)
+        print("ffmpeg not found, reading the video with OpenCV")
+    return cv2.VideoCapture(video_path)
+
+
+def gray_frame(frame):
+    """ Grayscale version of a frame from either reader (FFmpegCapture frames already are) """
+    if frame.ndim == 2:
+        return frame
+    return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+
+def bgr_frame(frame):
+    """ BGR version of a frame from any reader, for displaying and drawing in colour """
+    if frame is None or frame.ndim == 3:
+        return frame
+    return cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
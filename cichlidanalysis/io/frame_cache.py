@@ -0,0 +1,69 @@
+# Decoded grayscale frames kept in a memory mapped file (uint8, frames x height x width), so a video which was decoded
+# once can be read again without decoding. FrameCacheCapture reads such a file with the cv2.VideoCapture methods used in
+# this package (read, grab, isOpened, release, get and set of the frame position), with O(1) seeking. Like
+# FFmpegCapture frames are 2D grayscale and can be cropped (crop = (x, y, w, h) of the cached part of the full frame).
+# A cache can also hold only part of a video, start is then the frame number of its first frame.
+
+import numpy as np
+import cv2.cv2 as cv2
+
+
+def open_frame_cache(cache_path, n_frames, height, width, mode="r"):
+    """ Memory map of a frame cache file, mode "w+" creates a new one """
+    return np.memmap(cache_path, dtype=np.uint8, mode=mode, shape=(n_frames, height, width))
+
+
+class FrameCacheCapture:
+    """ cv2.VideoCapture replacement reading frames from a frame cache (an array or memmap of frames x height x width).
+    Like cv2.VideoCapture it stays opened until release(), read() and grab() fail past the last frame and set() clamps
+    the position to the frames of the cache
+    """
+    # set(CAP_PROP_POS_FRAMES) always lands on the requested frame (see io.movies.seek_to_frame)
+    exact_seek = True
+
+    def __init__(self, frames, crop=None, fps=0.0, start=0):
+        self.frames = frames
+        self.crop = crop
+        self.fps = fps
+        self.start = start
+        self.position = start
+        self.opened = True
+
+    def isOpened(self):
+        return self.opened
+
+    def read(self):
+        if not self.opened or self.position >= self.start + len(self.frames):
+            return False, None
+        # copy, so the frame stays valid after the cache is closed
+        frame = np.array(self.frames[self.position - self.start])
+        self.position += 1
+        return True, frame
+
+    def grab(self):
+        if not self.opened or self.position >= self.start + len(self.frames):
+            return False
+        self.position += 1
+        return True
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            return float(self.position)
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return float(self.start + len(self.frames))
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return float(self.frames.shape[2])
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return float(self.frames.shape[1])
+        return 0.0
+
+    def set(self, prop, value):
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            self.position = min(max(int(value), self.start), self.start + len(self.frames))
+            return True
+        return False
+
+    def release(self):
+        self.opened = False
@@ -0,0 +1,115 @@
+# Decoded-frame store: a video converted once into grayscale uint8 frames in a memory mapped frame cache next to it
+# ({video}_frames.u8, see io/frame_cache.py), optionally cropped to the bounding box of its rois. The shape, crop and
+# fps are kept in {video}_frames.yaml, which is written last so an interrupted conversion is never used. Tools then
+# read the store instead of decoding the video again, with O(1) access to any frame: open_video(video_path, "store")
+# returns a FrameCacheCapture of the store if there is one which covers the requested crop (the full frame when no crop
+# is given) and decodes the video otherwise. The store needs frames x height x width bytes of disk space.
+
+import os
+
+import cv2.cv2 as cv2
+import yaml
+
+from cichlidanalysis.io.ffmpeg_capture import rois_bounding_box, gray_frame
+from cichlidanalysis.io.frame_cache import open_frame_cache, FrameCacheCapture
+from cichlidanalysis.io.movies import get_movie_paths
+
+
+def frame_store_name(video_path):
+    return video_path[0:-4] + "_frames.u8"
+
+
+def frame_store_meta_name(video_path):
+    return video_path[0:-4] + "_frames.yaml"
+
+
+def build_frame_store(video_path, rois=None, roi_nums=None):
+    """ Decodes the video once into its frame store. With rois the frames are cropped to the bounding box of roi_nums
+    (default all rois), otherwise the full frames are kept. Returns the store metadata """
+    cap = cv2.VideoCapture(video_path)
+    n_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    full_width, full_height = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    crop = None
+    if rois:
+        if roi_nums is None:
+            roi_nums = [int(key.split("_")[1]) for key in rois if key.startswith("roi_")]
+        crop = rois_bounding_box(rois, roi_nums)
+    x, y, width, height = crop if crop is not None else (0, 0, full_width, full_height)
+
+    store_path = frame_store_name(video_path)
+    if os.path.isfile(frame_store_meta_name(video_path)):
+        os.remove(frame_store_meta_name(video_path))
+    print("converting {} into a frame store of {} frames of {}x{}".format(video_path, n_frames, width, height))
+    frames = open_frame_cache(store_path, n_frames, height, width, mode="w+")
+    frame_n = 0
+    while frame_n < n_frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames[frame_n] = gray_frame(frame)[y:y + height, x:x + width]
+        frame_n += 1
+        if frame_n % 5000 == 0:
+            print("Frame {}".format(frame_n))
+    meta = {"n_frames": frame_n, "height": height, "width": width, "full_height": full_height,
+            "full_width": full_width, "crop": list(crop) if crop is not None else None,
+            "fps": float(cap.get(cv2.CAP_PROP_FPS)), "video_size": os.path.getsize(video_path)}
+    cap.release()
+    frames.flush()
+    del frames
+    if frame_n < n_frames:
+        # the frame count of the container was too high, drop the frames which weren't decoded
+        os.truncate(store_path, frame_n * height * width)
+
+    with open(frame_store_meta_name(video_path), "w") as file:
+        yaml.dump(meta, file)
+    return meta
+
+
+def load_frame_store_meta(video_path):
+    """ Metadata of the frame store of the video, {} if there is no (finished) store """
+    if not os.path.isfile(frame_store_meta_name(video_path)):
+        return {}
+    with open(frame_store_meta_name(video_path)) as file:
+        return yaml.load(file, Loader=yaml.FullLoader)
+
+
+def store_covers(meta, crop=None):
+    """ True if the store holds the crop (x, y, w, h) of the frames, crop None is the full frame
+    >>> meta = {"crop": [10, 0, 40, 25], "full_width": 80, "full_height": 60}
+    >>> store_covers(meta, (20, 5, 10, 10)), store_covers(meta, (0, 0, 20, 20)), store_covers(meta)
+    (True, False, False)
+    """
+    full = (0, 0, meta["full_width"], meta["full_height"])
+    store_crop = meta["crop"] if meta["crop"] is not None else full
+    crop = crop if crop is not None else full
+    return store_crop[0] <= crop[0] and store_crop[1] <= crop[1] and \
+        crop[0] + crop[2] <= store_crop[0] + store_crop[2] and crop[1] + crop[3] <= store_crop[1] + store_crop[3]
+
+
+def open_frame_store(video_path, crop=None):
+    """ FrameCacheCapture reading the frame store of the video (its crop attribute is the crop of the store, None for
+    full frames), or None if there is no store, it is out of date or it doesn't cover crop """
+    meta = load_frame_store_meta(video_path)
+    if not meta or meta["n_frames"] == 0:
+        return None
+    if os.path.isfile(video_path) and os.path.getsize(video_path) != meta["video_size"]:
+        print("the frame store of {} is from a different version of the video, not using it".format(video_path))
+        return None
+    if not store_covers(meta, crop):
+        print("the frame store of {} doesn't cover the crop {}, not using it".format(video_path, crop))
+        return None
+    frames = open_frame_cache(frame_store_name(video_path), meta["n_frames"], meta["height"], meta["width"])
+    return FrameCacheCapture(frames, tuple(meta["crop"]) if meta["crop"] is not None else None, meta["fps"])
+
+
+def remove_frame_store(video_path):
+    for path in [frame_store_meta_name(video_path), frame_store_name(video_path)]:
+        if os.path.isfile(path):
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    # full frame stores, so that they can be used by every tool
+    video_paths, _, _ = get_movie_paths()
+    for video_path in video_paths:
+        build_frame_store(video_path)
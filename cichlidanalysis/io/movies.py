@@ -1,7 +1,17 @@
+import sys
 from tkinter.filedialog import askopenfilename, askdirectory
 from tkinter import Tk
 
+import cv2.cv2 as cv2
+import numpy as np
+
 from cichlidanalysis.io.tracks import get_file_paths_from_nums
+from cichlidanalysis.io.ffmpeg_capture import gray_frame
+
+SAMPLING_MODES = ("auto", "grab", "seek", "stratified")
+# with "auto" sampling, frames are seeked to when they are at least this far apart (seeking decodes from the keyframe
+# before the frame so for close frames grabbing is cheaper)
+SEEK_MIN_STEP = 25
 
 
 def get_movie_paths():
@@ -14,3 +24,98 @@ def get_movie_paths():
     videos_path = get_file_paths_from_nums(rootdir, video_nums, file_format='*.mp4')
 
     return videos_path, rootdir, video_nums
+
+
+def frame_time_matches(cap, frame_n):
+    """ True if the frame just read from cap is frame frame_n according to its timestamp (within half a frame).
+    cv2.VideoCapture reports back the CAP_PROP_POS_FRAMES it was set to even when the seek landed on another frame, so
+    only the timestamp of a decoded frame tells if a seek worked. Readers with exact_seek (io/ffmpeg_capture.py,
+    io/frame_cache.py) always land on the requested frame """
+    if getattr(cap, "exact_seek", False):
+        return True
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    if fps <= 0:
+        return False
+    return abs(cap.get(cv2.CAP_PROP_POS_MSEC) - 1000 * frame_n / fps) < 500 / fps
+
+
+def seek_to_frame(cap, frame_n, exact=False):
+    """ Moves an opened video so that the next read() returns frame frame_n. Seeks directly when the container allows
+    it: the video is set to the frame before frame_n, which is read to check its timestamp (see frame_time_matches).
+    Otherwise (or with exact=True) it restarts and grabs frames up to frame_n. grab() decodes without
+    retrieving/converting the image so is still cheaper than reading. Returns False if the video is shorter than
+    frame_n"""
+    if frame_n <= 0:
+        return True
+
+    if not exact and getattr(cap, "exact_seek", False):
+        cap.set(cv2.CAP_PROP_POS_FRAMES, frame_n)
+        return int(cap.get(cv2.CAP_PROP_POS_FRAMES)) == frame_n
+    if not exact:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, frame_n - 1)
+        ret, _ = cap.read()
+        if ret and frame_time_matches(cap, frame_n - 1):
+            return True
+        print("seeking isn't frame accurate for this video, grabbing up to frame {}".format(frame_n))
+
+    cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+    for _ in range(frame_n):
+        if not cap.grab():
+            return False
+    return True
+
+
+def sample_frame_numbers(start, end, nth_frame, stratified=False, seed=0):
+    """ Frame numbers to sample from [start, end). Regular sampling takes the multiples of nth_frame, stratified
+    sampling takes one random frame from each block of nth_frame frames (so the samples don't line up with anything
+    periodic in the video)
+    >>> list(sample_frame_numbers(5, 30, 10))
+    [10, 20]
+    """
+    if not stratified:
+        first = -(-start // nth_frame) * nth_frame
+        return range(first, end, nth_frame)
+    rng = np.random.default_rng(seed)
+    return [int(rng.integers(block, min(block + nth_frame, end))) for block in range(start, end, nth_frame)]
+
+
+def sampled_frames(cap, nth_frame, start=0, end=None, sampling="auto", seed=0):
+    """ Generator of (frame #, grayscale frame) of every nth_frame frame of an opened video from frame start until end
+    (not included, default the end of the video). Frames in between are never retrieved: with sampling "grab" they are
+    grabbed (decoded only), with "seek" the video jumps straight to each sampled frame, "stratified" seeks to one random
+    frame in each block of nth_frame frames and "auto" seeks if nth_frame >= SEEK_MIN_STEP. Falls back to grabbing if
+    a seeked frame has the wrong timestamp (see frame_time_matches)"""
+    if sampling not in SAMPLING_MODES:
+        raise ValueError("sampling must be one of {}".format(SAMPLING_MODES))
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    if frame_count <= 0:
+        # unknown length, read on until the video ends
+        print("video length unknown, sampling by grabbing frames")
+        frame_count = sys.maxsize
+        sampling = "grab"
+    if end is None or end > frame_count:
+        end = frame_count
+    if sampling == "auto":
+        sampling = "seek" if nth_frame >= SEEK_MIN_STEP else "grab"
+
+    position = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
+    for frame_n in sample_frame_numbers(start, end, nth_frame, sampling == "stratified", seed):
+        seeked = sampling != "grab" and frame_n != position
+        if seeked:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, frame_n)
+            position = frame_n
+        while position < frame_n:
+            if not cap.grab():
+                return
+            position += 1
+        ret, frame = cap.read()
+        if seeked and ret and not frame_time_matches(cap, frame_n):
+            print("seeking isn't frame accurate for this video, grabbing frames instead")
+            sampling = "grab"
+            if not seek_to_frame(cap, frame_n, exact=True):
+                return
+            ret, frame = cap.read()
+        if not ret:
+            return
+        position += 1
+        yield frame_n, gray_frame(frame)
@@ -7,10 +7,129 @@ import numpy as np
 import pandas as pd
 
 
+# Tracks can be saved as text (.csv) or in a compressed binary format (.trk) with typed columns. A .trk file is a
+# compressed numpy zip with the columns: frame (int32), x, y (int16), area (int32, rounded) and ts_ns (int64). Missing
+# values (NaN in the csv) are stored as the minimum of the type. Both formats load into the same 4 column array of
+# [frame # or timestamp ns, x, y, area]. The extension has 4 characters like .csv so file name slicing still works
+TRACK_EXTENSIONS = (".csv", ".trk")
+TRACK_DTYPE = np.dtype([("frame", "<i4"), ("x", "<i2"), ("y", "<i2"), ("area", "<i4"), ("ts_ns", "<i8")])
+
+
+def _to_column(values, dtype):
+    """ Float values to an integer column, NaNs become the minimum of the type """
+    missing = np.iinfo(dtype).min
+    return np.where(np.isnan(values), missing, np.round(np.nan_to_num(values, nan=missing))).astype(dtype)
+
+
+def _from_column(values):
+    """ Integer column back to floats with NaNs """
+    column = values.astype(np.float64)
+    column[values == np.iinfo(values.dtype).min] = np.nan
+    return column
+
+
+def track_to_records(track, timestamps=None):
+    """ Converts a 4 column track array into TRACK_DTYPE records. The first column goes into ts_ns if it has timestamps
+    (by default guessed from values larger than an int32 can hold) otherwise into frame"""
+    track = np.asarray(track, dtype=np.float64).reshape(-1, 4)
+    if timestamps is None:
+        timestamps = track.shape[0] > 0 and np.nanmax(np.abs(track[:, 0])) > np.iinfo(np.int32).max
+    records = np.empty(track.shape[0], dtype=TRACK_DTYPE)
+    if timestamps:
+        records["frame"] = np.iinfo(np.int32).min
+        records["ts_ns"] = _to_column(track[:, 0], np.int64)
+    else:
+        records["frame"] = _to_column(track[:, 0], np.int32)
+        records["ts_ns"] = np.iinfo(np.int64).min
+    records["x"] = _to_column(track[:, 1], np.int16)
+    records["y"] = _to_column(track[:, 2], np.int16)
+    records["area"] = _to_column(track[:, 3], np.int32)
+    return records
+
+
+def records_to_track(records):
+    """ Converts TRACK_DTYPE records into the 4 column track array, the first column is the timestamp where there is
+    one and the frame # otherwise"""
+    track = np.empty([records.shape[0], 4])
+    track[:, 0] = np.where(records["ts_ns"] != np.iinfo(np.int64).min, records["ts_ns"].astype(np.float64),
+                           _from_column(records["frame"]))
+    track[:, 1] = _from_column(records["x"])
+    track[:, 2] = _from_column(records["y"])
+    track[:, 3] = _from_column(records["area"])
+    return track
+
+
+def save_track(track_path, track, timestamps=None):
+    """ Saves a 4 column track array as csv or .trk depending on the extension of track_path """
+    if track_path.endswith(".trk"):
+        records = track_to_records(track, timestamps)
+        with open(track_path, "wb") as file:
+            np.savez_compressed(file, **{name: records[name] for name in TRACK_DTYPE.names})
+    else:
+        np.savetxt(track_path, track, delimiter=",")
+
+
+def read_track(track_path):
+    """ Reads a .trk or csv track into the 4 column track array """
+    if track_path.endswith(".trk"):
+        with np.load(track_path) as columns:
+            records = np.empty(columns["frame"].shape[0], dtype=TRACK_DTYPE)
+            for name in TRACK_DTYPE.names:
+                records[name] = columns[name]
+        return records_to_track(records)
+    return np.genfromtxt(track_path, delimiter=',')
+
+
+def track_write_path(track_path):
+    """ While tracking, binary tracks are appended as raw records to a .part file, which is compressed into the .trk
+    file once tracking is finished. Csv tracks are appended to directly"""
+    if track_path.endswith(".trk"):
+        return track_path + ".part"
+    return track_path
+
+
+def append_track_chunk(track_path, chunk):
+    """ Appends rows of a track to the file being written (see track_write_path) """
+    with open(track_write_path(track_path), "ab") as file:
+        if track_path.endswith(".trk"):
+            track_to_records(chunk, timestamps=False).tofile(file)
+        else:
+            np.savetxt(file, chunk, delimiter=",")
+        file.flush()
+        os.fsync(file.fileno())
+
+
+def finish_track(track_path):
+    """ Compresses the .part file of a binary track into the .trk file """
+    if track_path.endswith(".trk"):
+        part_path = track_write_path(track_path)
+        records = np.fromfile(part_path, dtype=TRACK_DTYPE)
+        with open(track_path, "wb") as file:
+            np.savez_compressed(file, **{name: records[name] for name in TRACK_DTYPE.names})
+        os.remove(part_path)
+
+
+def csv_to_trk(csv_path, remove_csv=False):
+    """ Converts a csv track to the .trk format (same name, new extension), returns the new path """
+    trk_path = csv_path[0:-4] + ".trk"
+    save_track(trk_path, np.genfromtxt(csv_path, delimiter=','))
+    if remove_csv:
+        os.remove(csv_path)
+    return trk_path
+
+
+def glob_tracks(pattern):
+    """ glob for track files in either format, pattern is given without the extension. If a track exists in both
+    formats (e.g. converted with csv_to_trk) only the .trk file is returned"""
+    files = glob.glob(pattern + ".csv") + glob.glob(pattern + ".trk")
+    binary = set(file[0:-4] for file in files if file.endswith(".trk"))
+    return [file for file in files if not (file.endswith(".csv") and file[0:-4] in binary)]
+
+
 def load_track(csv_file_path):
-    """Takes file path, loads the csv track, computes speed from this, returns both
+    """Takes file path, loads the track (csv or .trk), computes speed from this, returns both
     """
-    track_internal = np.genfromtxt(csv_file_path, delimiter=',')
+    track_internal = read_track(csv_file_path)
 
     if track_internal.size == 0:
         # if empty return empty
@@ -52,13 +171,13 @@ def remove_tags(input_files, remove=["exclude", "meta.csv", "als.csv"]):
 
 def get_latest_tracks(folder_path, file_pattern):
     os.chdir(folder_path)
-    all_files = glob.glob("*{}*.csv".format(file_pattern))
+    all_files = glob_tracks("*{}*".format(file_pattern))
 
     # remove files with  certain tags
     files = remove_tags(all_files, ["exclude", "meta.csv", "als.csv"])
 
     # prioritise cleaned version of these files
-    file_clean = glob.glob("*{}_cleaned.csv".format(file_pattern))
+    file_clean = glob_tracks("*{}_cleaned".format(file_pattern))
     file_clean.sort()
 
     for file_clean in file_clean:
@@ -72,7 +191,7 @@ def get_latest_tracks(folder_path, file_pattern):
 
 
 def extract_tracks_from_fld(folder, file_ending):
-    """Asks you for a folder path which is the fish roi, find all csv files in the folder which have the
+    """Asks you for a folder path which is the fish roi, find all track files (csv or .trk) in the folder which have the
     "file_ending". Will exclude all files with "exclude". Replaces tracks with "Range" and "Cleaned"
     Returns appended tracks and speed for that fish, Timestamp in nS
     """
@@ -81,7 +200,7 @@ def extract_tracks_from_fld(folder, file_ending):
     file_cleaned, files = get_latest_tracks(folder, file_ending)
 
     # prioritise range version of these files (retracked)
-    files_split = glob.glob("*Range*_.csv")
+    files_split = glob_tracks("*Range*_")
     files_split.sort()
 
     movie_nums = []
@@ -90,7 +209,7 @@ def extract_tracks_from_fld(folder, file_ending):
             movie_nums.append(file_split.split("_")[1])
 
     # get all files and their movie numbers
-    all_files = glob.glob("*.csv")
+    all_files = glob_tracks("*")
     all_files_df = pd.DataFrame(all_files, columns=['file_name'])
     all_files_df.file_name.str.split('_',  expand=True)
     all_files_df["movie_n"] = all_files_df.file_name.str.split('_',  expand=True).iloc[:, 1]
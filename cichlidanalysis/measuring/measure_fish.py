@@ -12,6 +12,7 @@ import yaml
 
 from cichlidanalysis.io.meta import load_yaml, add_sex
 from cichlidanalysis.measuring.measure_units import measuring
+from cichlidanalysis.io.ffmpeg_capture import open_video, bgr_frame
 
 
 def getFrame(frame_nr):
@@ -53,9 +54,9 @@ def main():
         print("No mm_per_pixel, use script: Measure_Units")
         return
 
-    # load video
+    # load video, from its decoded-frame store if it has one (see io/frame_store.py)
     global video
-    video = cv2.VideoCapture(filepath)
+    video = open_video(filepath, "store")
     nr_of_frames = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
 
     # set up image display and trackbar for
@@ -68,9 +69,12 @@ def main():
         # Get the next videoframe
         if playing:
             ret, frame = video.read()
+            frame = bgr_frame(frame)
             cv2.putText(frame, "Press enter to select frame, press space bar to pause", (5, 15),
                         cv2.FONT_HERSHEY_SIMPLEX, 0.5, (10, 10, 200), 2)
 
+        # frames read by stepping with a and d
+        frame = bgr_frame(frame)
         cv2.imshow("Measuring fish length", frame)
         k = cv2.waitKey(100) & 0xff
 
@@ -6,20 +6,22 @@ from tkinter.filedialog import askopenfilename
 import matplotlib.pyplot as plt
 import cv2.cv2 as cv2
 
-from cichlidanalysis.tracking.backgrounds import background_vid
+from cichlidanalysis.tracking.backgrounds import background_vid_percentiles
+from cichlidanalysis.io.ffmpeg_capture import open_video, gray_frame
 
 
-def compare_backgrounds(video_path, frame_n):
-    background_50 = background_vid(video_path, 200, 50)
-    background_90 = background_vid(video_path, 200, 90)
-    background_95 = background_vid(video_path, 200, 95)
+def compare_backgrounds(video_path, frame_n, video_reader="opencv"):
+    # all three backgrounds from one pass through the video
+    background_50, background_90, background_95 = background_vid_percentiles(video_path, 200, [50, 90, 95],
+                                                                             video_reader=video_reader)
 
-    cap = cv2.VideoCapture(video_path)
+    cap = open_video(video_path, video_reader)
 
     for i in range(frame_n):
         ret, frame = cap.read()
+    cap.release()
 
-    image = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    image = gray_frame(frame)
 
     fig, axs = plt.subplots(3, 3)
     axs[0, 0].imshow(background_50)
@@ -1,20 +1,23 @@
 # this script will ask for a movie file and a time frame to sub divide. It will then create backgrounds and track
-# each epoque
+# each epoque. The video can also be divided where the scene changes (see scene_changes.py)
 
 import os
 import glob
 import datetime
 
+import cv2.cv2 as cv2
 import numpy as np
 
 from cichlidanalysis.io.meta import load_yaml, extract_meta
 from cichlidanalysis.io.tracks import load_track, get_latest_tracks
 from cichlidanalysis.io.movies import get_movie_paths
-from cichlidanalysis.quality_control.video_tools import background_vid_split
-from cichlidanalysis.tracking.offline_tracker import tracker
+from cichlidanalysis.tracking.fused_tracking import divided_retrack
+from cichlidanalysis.quality_control.scene_changes import detect_scene_changes, change_split_ranges
 
 
-def divide_video(video_path, chunk_size=20, fps=10):
+def divide_video(video_path, chunk_size=20, fps=10, split_ranges=None):
+    """ Remakes the backgrounds and retracks the video in chunks of chunk_size minutes, or in the given split_ranges
+    ([start, end) frames, e.g. from scene_changes.change_split_ranges) """
 
     vid_folder_path = os.path.split(video_path)[0]
     cam_folder_path = os.path.split(vid_folder_path)[0]
@@ -48,19 +51,24 @@ def divide_video(video_path, chunk_size=20, fps=10):
     area_s = 100
     thresh = 35
 
-    print("remaking backgrounds and retracking")
-    for chunk_n in np.arange(0, len(chunks)-1):
-        split_ends = [chunks[chunk_n], chunks[chunk_n+1]]
-        background = background_vid_split(video_path, 100, 90, split_ends)
-
-        # in case a new ROI has been used for tracking, use this.
-        crop_vid_rois = load_yaml(vid_folder_path, "roi_file")
-        if crop_vid_rois:
-            vid_rois = crop_vid_rois
-            print("tracking with new roi")
-        tracker(video_path, background, vid_rois, threshold=thresh, display=False, area_size=area_s,
-                split_range=split_ends)
+    # in case a new ROI has been used for tracking, use this.
+    crop_vid_rois = load_yaml(vid_folder_path, "roi_file")
+    if crop_vid_rois:
+        vid_rois = crop_vid_rois
+        print("tracking with new roi")
 
+    # the background of each chunk is remade from its sampled frames and the chunk is retracked with it
+    print("remaking backgrounds and retracking")
+    if split_ranges is None:
+        ranges = [[chunks[chunk_n], chunks[chunk_n + 1]] for chunk_n in np.arange(0, len(chunks) - 1)]
+    else:
+        ranges = [[int(start), int(min(end, track_single_orig.shape[0]))] for start, end in split_ranges]
+    backgrounds = divided_retrack(video_path, vid_rois, ranges, nth_frame=100, percentile=90, threshold=thresh,
+                                  area_size=area_s)
+
+    for split_ends, background in zip(ranges, backgrounds):
+        if len(background) == 0:
+            continue
         # add in the right timepoints (of a primary track - not a full retrack)
         # load the newly tracked csv
         date = datetime.datetime.now().strftime("%Y%m%d")
@@ -82,9 +90,23 @@ if __name__ == '__main__':
     # Allows a user to select file
     videos_path, _, _ = get_movie_paths()
 
+    divide_at = 'm'
+    while divide_at not in {'c', 's'}:
+        divide_at = input("Divide the movies in chunks of equal length (c) or where the scene changes (s)?: \n")
+
     chunk_size = '11'
-    while 60 % int(chunk_size) != 0:
+    while divide_at == 'c' and 60 % int(chunk_size) != 0:
         chunk_size = input("Retrack the movie in smaller chunks? \nChunk size in min (60 needs to be divisible by it)?:")
 
     for video_path in videos_path:
-        divide_video(video_path, chunk_size)
+        if divide_at == 's':
+            changes = detect_scene_changes(video_path)
+            if not changes:
+                print("no scene changes found in {}, not retracking it".format(video_path))
+                continue
+            cap = cv2.VideoCapture(video_path)
+            n_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            cap.release()
+            divide_video(video_path, split_ranges=change_split_ranges(changes, n_frames))
+        else:
+            divide_video(video_path, chunk_size)
@@ -0,0 +1,165 @@
+# Retracks only the bad stretches of a track instead of the whole video. Frames which need redoing are the ones without
+# a position (NaN), the ones marked as excluded (-1, from split_tracking) and the ones on either side of a speed jump
+# (the jumps which processing.remove_high_spd_xy smooths over). Each stretch (plus a margin) is tracked again with a
+# background made from the frames around it, and the new positions of the bad frames are merged into the track file.
+# Stretches close together share one background made from the frames around all of them, so that a track with many
+# short gaps doesn't decode the same frames for every gap. The original track is kept with an "exclude" tag.
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import cv2.cv2 as cv2
+
+from cichlidanalysis.io.meta import load_yaml, extract_meta
+from cichlidanalysis.io.tracks import read_track, save_track, get_latest_tracks, glob_tracks
+from cichlidanalysis.io.movies import get_movie_paths, seek_to_frame, sampled_frames
+from cichlidanalysis.tracking.offline_tracker import tracker
+from cichlidanalysis.tracking.streaming_percentile import new_percentile_estimator, add_frame, estimator_percentile
+
+# same threshold as processing.remove_high_spd_xy (pixels per frame)
+SPEED_THRESHOLD = 200
+
+
+def frames_to_retrack(track, speed_threshold=SPEED_THRESHOLD):
+    """ Boolean array of the track rows (frames) which have no position, are marked as excluded (-1) or are on either
+    side of a jump faster than speed_threshold
+    >>> frames_to_retrack(np.array([[0, 10, 10, 50], [1, np.nan, np.nan, np.nan], [2, 10, 10, 50], [3, 400, 10, 50],
+    ...                             [4, -1, -1, -1], [5, 11, 10, 50]])).tolist()
+    [False, True, True, True, True, False]
+    """
+    bad = np.isnan(track[:, 1]) | (track[:, 1] == -1)
+    # no speed to or from the bad frames
+    x, y = np.where(bad, np.nan, track[:, 1]), np.where(bad, np.nan, track[:, 2])
+    speed = np.hypot(np.diff(x), np.diff(y))
+    jumps = np.zeros(track.shape[0], dtype=bool)
+    jumps[:-1] |= speed > speed_threshold
+    jumps[1:] |= speed > speed_threshold
+    return bad | jumps
+
+
+def gap_segments(bad_frames, margin=50):
+    """ [start, end) segments covering the bad frames plus margin frames on each side, overlapping segments are joined
+    >>> gap_segments(np.array([False, True, True, False, False, False, False, True, False, False]), margin=1)
+    [[0, 4], [6, 9]]
+    """
+    n_frames = bad_frames.shape[0]
+    segments = []
+    for frame in np.flatnonzero(bad_frames):
+        start, end = max(frame - margin, 0), min(frame + margin + 1, n_frames)
+        if segments and start <= segments[-1][1]:
+            segments[-1][1] = max(segments[-1][1], end)
+        else:
+            segments.append([int(start), int(end)])
+    return segments
+
+
+def background_groups(segments, background_margin=1000, max_window=None):
+    """ Groups consecutive segments whose background windows (the segment and background_margin frames on either side)
+    overlap, each group gets one background from the frames around all its segments. A group is closed when its window
+    would get longer than max_window frames (default 4 * background_margin), so that the background stays local
+    >>> background_groups([[0, 10], [50, 60], [100, 110], [500, 510]], background_margin=30)
+    [[[0, 10], [50, 60]], [[100, 110]], [[500, 510]]]
+    """
+    if max_window is None:
+        max_window = 4 * background_margin
+    groups = []
+    for segment in segments:
+        if groups and segment[0] - background_margin <= groups[-1][-1][1] + background_margin and \
+                segment[1] - groups[-1][0][0] + 2 * background_margin <= max_window:
+            groups[-1].append(segment)
+        else:
+            groups.append([segment])
+    return groups
+
+
+def local_background(video_path, segment, nth_frame=20, percentile=90, background_margin=1000):
+    """ Background from every nth_frame frame of the segment and background_margin frames on either side. Returns []
+    if there are less than 5 frames, like video_tools.background_vid_split"""
+    start = max(segment[0] - background_margin, 0)
+    cap = cv2.VideoCapture(video_path)
+    gathered_frames = new_percentile_estimator()
+    if seek_to_frame(cap, start):
+        for _, gray in sampled_frames(cap, nth_frame, start, segment[1] + background_margin):
+            add_frame(gathered_frames, gray)
+    cap.release()
+    if gathered_frames["n"] < 5:
+        return []
+    return estimator_percentile(gathered_frames, int(percentile))
+
+
+def retrack_gaps(video_path, track_path, rois, roi_num=0, threshold=35, area_size=100, margin=50, nth_frame=20,
+                 percentile=90, background_margin=1000, speed_threshold=SPEED_THRESHOLD, max_window=None):
+    """ Retracks the bad frames (see frames_to_retrack) of the track of roi_num at track_path (rows are frames of the
+    video) and merges the new positions into the track file. Bad frames which still aren't found stay as they were.
+    Segments close together share a background (see background_groups). The original track is kept as a copy with an
+    "_exclude" tag.
+
+    :return: (number of bad frames, number of frames which were fixed)
+    """
+    track = read_track(track_path)
+    bad_frames = frames_to_retrack(track, speed_threshold)
+    segments = gap_segments(bad_frames, margin)
+    groups = background_groups(segments, background_margin, max_window)
+    print("retracking {} bad frames in {} segments with {} backgrounds ({:.1f}% of the video)".format(
+        int(bad_frames.sum()), len(segments), len(groups),
+        100 * sum(end - start for start, end in segments) / track.shape[0]))
+
+    # the retracked segments are written as Range tracks into a temporary folder
+    temp_dir = tempfile.mkdtemp()
+    temp_video_path = os.path.join(temp_dir, os.path.split(video_path)[1])
+    merged = track.copy()
+    fixed = 0
+    try:
+        for group in groups:
+            background = local_background(video_path, [group[0][0], group[-1][1]], nth_frame, percentile,
+                                          background_margin)
+            if len(background) == 0:
+                print("couldn't make a background for frames {}-{}, not retracking them".format(group[0][0],
+                                                                                              group[-1][1]))
+                continue
+            for segment in group:
+                tracker(temp_video_path, background, dict(rois), threshold=threshold, display=False,
+                        area_size=area_size, split_range=segment, roi_nums=[roi_num],
+                        video=cv2.VideoCapture(video_path))
+                retracked = read_track(glob_tracks(temp_video_path[0:-4] + "_tracks_*_Range{:05}-*".format(
+                    segment[0]))[0])
+                retracked = retracked.reshape(-1, 4)
+
+                rows = np.arange(segment[0], segment[0] + retracked.shape[0])
+                found = ~np.isnan(retracked[:, 1]) & bad_frames[rows]
+                merged[rows[found], 1:4] = retracked[found, 1:4]
+                fixed += int(found.sum())
+    finally:
+        shutil.rmtree(temp_dir)
+
+    if fixed > 0:
+        shutil.copy(track_path, track_path[0:-4] + "_exclude" + track_path[-4:])
+        save_track(track_path, merged)
+    print("fixed {} of {} bad frames".format(fixed, int(bad_frames.sum())))
+    return int(bad_frames.sum()), fixed
+
+
+if __name__ == '__main__':
+    videos_path, _, _ = get_movie_paths()
+
+    for video_path in videos_path:
+        vid_folder_path = os.path.split(video_path)[0]
+        cam_folder_path = os.path.split(vid_folder_path)[0]
+        video_name = os.path.split(video_path)[1]
+
+        _, latest_files = get_latest_tracks(vid_folder_path, video_name[0:-4])
+        latest_files = [file for file in latest_files if "Range" not in file]
+        if len(latest_files) != 1:
+            print("need exactly one track for {}, found {}".format(video_name, latest_files))
+            continue
+
+        # rois like divide_tracking: the new roi of the video if there is one, otherwise the whole video
+        vid_rois = load_yaml(vid_folder_path, "roi_file")
+        if not vid_rois:
+            rois = load_yaml(cam_folder_path, "roi_file")
+            fish_data = extract_meta(os.path.split(vid_folder_path)[1])
+            width_trim, height_trim = rois['roi_{}'.format(fish_data['roi'][-1])][2:4]
+            vid_rois = {'roi_0': (0, 0, width_trim, height_trim)}
+        retrack_gaps(video_path, os.path.join(vid_folder_path, latest_files[0]), vid_rois)
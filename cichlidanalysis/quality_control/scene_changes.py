@@ -0,0 +1,89 @@
+# Finds where the scene of a video changes (camera bumped, water refilled, lights changed) from sparsely sampled frames,
+# instead of scrubbing through the video by hand with split_tracking.split_select. Each sampled frame is downsampled and
+# compared to the median of the samples before it (since the last change) with three statistics:
+# shift: image registration shift (phase correlation) in full resolution pixels, for a moved camera. It only counts if
+# aligning the frames by it halves their difference, otherwise it's the fish which moved
+# mad: mean absolute difference in grey levels, for changes of the scene or lighting
+# hist: Bhattacharyya distance between the grey level histograms, for lighting/exposure changes
+# A sample is a change if any statistic is above its threshold. The changes give split ranges which can be used by
+# divide_tracking.divide_video (split_ranges) and split_tracking (split_s, split_e).
+
+import cv2.cv2 as cv2
+import numpy as np
+
+from cichlidanalysis.io.ffmpeg_capture import open_video
+from cichlidanalysis.io.movies import sampled_frames
+from cichlidanalysis.tracking.downscale import downsample
+
+SHIFT_THRESHOLD = 2.0
+MAD_THRESHOLD = 10.0
+HIST_THRESHOLD = 0.15
+
+
+def frame_change_stats(reference, gray, scale=1):
+    """ Change statistics between two (downsampled) grayscale images, shift is multiplied by scale to give it in full
+    resolution pixels """
+    (dx, dy), _ = cv2.phaseCorrelate(reference.astype(np.float32), gray.astype(np.float32))
+    mad = float(np.mean(cv2.absdiff(reference, gray)))
+
+    shift = 0.0
+    margin = int(np.ceil(max(abs(dx), abs(dy)))) + 1
+    if 2 * margin < min(gray.shape):
+        aligned = cv2.warpAffine(gray, np.float32([[1, 0, dx], [0, 1, dy]]), (gray.shape[1], gray.shape[0]),
+                                 flags=cv2.INTER_LINEAR + cv2.WARP_INVERSE_MAP)
+        inside = (slice(margin, -margin), slice(margin, -margin))
+        if np.mean(cv2.absdiff(reference[inside], aligned[inside])) < \
+                0.5 * np.mean(cv2.absdiff(reference[inside], gray[inside])):
+            shift = float(np.hypot(dx, dy)) * scale
+
+    ref_hist = cv2.calcHist([reference], [0], None, [64], [0, 256])
+    gray_hist = cv2.calcHist([gray], [0], None, [64], [0, 256])
+    hist = cv2.compareHist(ref_hist, gray_hist, cv2.HISTCMP_BHATTACHARYYA)
+    return {"shift": shift, "mad": mad, "hist": float(hist)}
+
+
+def detect_scene_changes(video_path, nth_frame=100, shift_threshold=SHIFT_THRESHOLD, mad_threshold=MAD_THRESHOLD,
+                         hist_threshold=HIST_THRESHOLD, reference_n=5, scale=4, video_reader="opencv",
+                         sampling="auto"):
+    """ Samples every nth_frame frame and compares it (downsampled by scale) to the median of the last reference_n
+    samples since the last change. The median keeps the fish out of the reference and slow drift is followed.
+
+    :return: list of changes, dicts with "before" (last sampled frame before the change), "after" (first sampled frame
+    after it) and the statistics of the "after" frame
+    """
+    cap = open_video(video_path, video_reader)
+    changes = []
+    reference_frames = []
+    previous_n = 0
+    for frame_n, gray in sampled_frames(cap, nth_frame, sampling=sampling):
+        small = downsample(gray, scale) if scale > 1 else gray
+        if reference_frames:
+            reference = np.median(np.stack(reference_frames), axis=0).astype(np.uint8)
+            stats = frame_change_stats(reference, small, scale)
+            if stats["shift"] > shift_threshold or stats["mad"] > mad_threshold or stats["hist"] > hist_threshold:
+                print("scene change between frame {} and {}: shift {:.1f} px, mad {:.1f}, hist {:.2f}".format(
+                    previous_n, frame_n, stats["shift"], stats["mad"], stats["hist"]))
+                changes.append(dict(stats, before=previous_n, after=frame_n))
+                reference_frames = []
+        reference_frames = (reference_frames + [small])[-reference_n:]
+        previous_n = frame_n
+    cap.release()
+    return changes
+
+
+def change_split_ranges(changes, n_frames, gaps=False):
+    """ [start, end) ranges of the video between the changes. Without gaps the ranges meet at the first sampled frame
+    after each change, with gaps the frames between the samples around a change (where it isn't known if the change
+    happened yet) are left out, which is how split_tracking splits a video
+    >>> change_split_ranges([{"before": 100, "after": 200}], 500)
+    [[0, 200], [200, 500]]
+    >>> change_split_ranges([{"before": 100, "after": 200}], 500, gaps=True)
+    [[0, 101], [200, 500]]
+    """
+    ranges = []
+    start = 0
+    for change in changes:
+        ranges.append([start, change["before"] + 1 if gaps else change["after"]])
+        start = change["after"]
+    ranges.append([start, n_frames])
+    return ranges
@@ -18,7 +18,10 @@ from cichlidanalysis.io.meta import load_yaml, extract_meta
 from cichlidanalysis.io.tracks import load_track, get_latest_tracks
 from cichlidanalysis.tracking.offline_tracker import tracker
 from cichlidanalysis.quality_control.divide_tracking import divide_video
-from cichlidanalysis.quality_control.video_tools import background_vid_split
+from cichlidanalysis.tracking.background_cache import get_background
+from cichlidanalysis.io.ffmpeg_capture import open_video, gray_frame
+from cichlidanalysis.quality_control.scene_changes import detect_scene_changes, change_split_ranges, SHIFT_THRESHOLD, \
+    MAD_THRESHOLD, HIST_THRESHOLD
 
 
 def getFrame(frame_nr):
@@ -26,14 +29,15 @@ def getFrame(frame_nr):
     video.set(cv2.CAP_PROP_POS_FRAMES, frame_nr)
 
 
-def split_select(video_path, background_cropped):
+def split_select(video_path, background_cropped, video_reader="store"):
     """ Function that takes a video path, a median file, and rois. It then uses background subtraction and centroid
     tracking to find the XZ coordinates of the largest contour. This script has a threshold bar which allows you to try
-    different levels. Once desired threshold level is found. Press 'q' to quit and the selected value will be used """
+    different levels. Once desired threshold level is found. Press 'q' to quit and the selected value will be used.
+    By default the frames are read from the decoded-frame store of the video if it has one (see io/frame_store.py) """
     split_start, split_end = [], []
     # load video
     global video
-    video = cv2.VideoCapture(video_path)
+    video = open_video(video_path, video_reader)
     nr_of_frames = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
 
     # set up image display and trackbar for
@@ -43,7 +47,7 @@ def split_select(video_path, background_cropped):
 
     playing = 1
     ret, frame = video.read()
-    frame_bw = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    frame_bw = gray_frame(frame)
     if frame.shape != background_cropped.shape:
         # add padding to the median
         if frame_bw.shape[0] != background_cropped.shape[0] and frame_bw.shape[1] == background_cropped.shape[1]:
@@ -59,7 +63,7 @@ def split_select(video_path, background_cropped):
             ret, frame = video.read()
             if ret:
                 frame_nr = video.get(cv2.CAP_PROP_POS_FRAMES)
-                frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                frame = gray_frame(frame)
                 frameDelta = cv2.absdiff(frame, background_cropped)
                 cv2.putText(frameDelta, "Select the start and end of the section to make NaNs", (5, 20),
                             cv2.FONT_HERSHEY_SIMPLEX, 0.5, (200, 200, 200), 1)
@@ -89,13 +93,13 @@ def split_select(video_path, background_cropped):
             frame_nr = video.get(cv2.CAP_PROP_POS_FRAMES)
             video.set(cv2.CAP_PROP_POS_FRAMES, frame_nr - 2)
             ret, frame = video.read()
-            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            frame = gray_frame(frame)
 
         elif k == ord("d"):
             frame_nr = video.get(cv2.CAP_PROP_POS_FRAMES)
             video.set(cv2.CAP_PROP_POS_FRAMES, frame_nr)
             ret, frame = video.read()
-            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            frame = gray_frame(frame)
 
         elif k == ord("s"):
             split_start = video.get(cv2.CAP_PROP_POS_FRAMES)
@@ -176,12 +180,26 @@ if __name__ == '__main__':
     roi_n = rois["roi_" + fish_data['roi'][1]]
     background = background_full[roi_n[1]:roi_n[1] + roi_n[3], roi_n[0]:roi_n[0] + roi_n[2]]
 
-    split_s, split_e = split_select(video_path, background)
-
-    while split_e < split_s:
-        print("Split start must be smaller than split end, retry")
+    find_split = 'm'
+    while find_split not in {'a', 'h'}:
+        find_split = input("Find the split automatically from scene changes (a) or by hand (h)?: \n")
+
+    changes = detect_scene_changes(video_path) if find_split == 'a' else []
+    if changes:
+        # split at the largest change, leaving out the frames where it isn't known if it has happened yet
+        change = max(changes, key=lambda change: max(change["shift"] / SHIFT_THRESHOLD, change["mad"] / MAD_THRESHOLD,
+                                                     change["hist"] / HIST_THRESHOLD))
+        split_s, split_e = change_split_ranges([change], track_single.shape[0], gaps=True)[0][1], change["after"]
+        print("Splitting video between frame {} and frame {}".format(split_s, split_e))
+    else:
+        if find_split == 'a':
+            print("no scene change found, select the split by hand")
         split_s, split_e = split_select(video_path, background)
 
+        while split_e < split_s:
+            print("Split start must be smaller than split end, retry")
+            split_s, split_e = split_select(video_path, background)
+
     retrack = 'm'
     while retrack not in {'y', 'n'}:
         retrack = input("Retrack the split movie? y/n: \n")
@@ -200,7 +218,7 @@ if __name__ == '__main__':
         split_range = ([0, split_s], [split_e, track_single_orig.shape[0]])
         backgrounds = []
         for part in split_range:
-            backgrounds.append(background_vid_split(video_path, 100, 90, part))
+            backgrounds.append(get_background(video_path, 100, 90, part, display=True))
 
         # for cases where there wasn't a background made for the post split, don't track second movie and add NaNs
         # until end of movie
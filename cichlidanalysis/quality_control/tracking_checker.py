@@ -18,6 +18,8 @@ import matplotlib.pyplot as plt
 from cichlidanalysis.io.meta import load_yaml, extract_meta
 from cichlidanalysis.io.tracks import extract_tracks_from_fld, get_file_paths_from_nums
 from cichlidanalysis.analysis.processing import interpolate_nan_streches, remove_high_spd_xy, smooth_speed
+from cichlidanalysis.tracking.background_cache import cached_background_records
+from cichlidanalysis.io.ffmpeg_capture import open_video, gray_frame, bgr_frame
 
 
 def tracker_checker_inputs(video_path_i):
@@ -43,8 +45,11 @@ def tracker_checker_inputs(video_path_i):
 
     # This if statement checks if there is a new background associated with the video and loads it instead
     # Also needs to be able to deal with multiple background files (if the video was split by divide_tracking.py)
+    # Backgrounds in the background cache are used first (in frame range order), otherwise found by their file names
     os.chdir(vid_folder_path)
-    video_folder_files = glob.glob(vid_timestamp + "*background.png")
+    video_folder_files = [record["background_path"] for record in cached_background_records(video_path_i)]
+    if len(video_folder_files) == 0:
+        video_folder_files = glob.glob(vid_timestamp + "*background.png")
     if len(video_folder_files) > 0:
         print('using background made from video')
         if os.path.isfile(os.path.join(vid_folder_path, video_folder_files[0])):
@@ -157,9 +162,10 @@ def get_frame(frame_nr, video):
 
 
 def track_checker_gui(video_path_j, bgd, pmn, spd_sm, spd_sm_mm_ps, thresh, displacement_i_mm_s,
-                      vid_name, track_single_i, start_point, end_point, x_nt, y_nt):
+                      vid_name, track_single_i, start_point, end_point, x_nt, y_nt, video_reader="store"):
     """ this script loads a video and it's corresponding track, it plots the centroid over the video and allows you to
-    scroll through the video. Prints the ROI if it is in the video folder (indidcating a new ROI).
+    scroll through the video. Prints the ROI if it is in the video folder (indidcating a new ROI). By default the
+    frames are read from the decoded-frame store of the video if it has one (see io/frame_store.py).
 
     :param video_path_j:
     :param bgd:
@@ -174,10 +180,11 @@ def track_checker_gui(video_path_j, bgd, pmn, spd_sm, spd_sm_mm_ps, thresh, disp
     :param end_point:
     :param x_nt:
     :param y_nt:
+    :param video_reader: "store", "opencv" or "ffmpeg" (see io.ffmpeg_capture.open_video)
     :return:
     """
     # open video
-    video = cv2.VideoCapture(video_path_j)
+    video = open_video(video_path_j, video_reader)
 
     # get total number of frames
     nr_of_frames = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
@@ -191,7 +198,7 @@ def track_checker_gui(video_path_j, bgd, pmn, spd_sm, spd_sm_mm_ps, thresh, disp
 
     ret, frame = video.read()
     # height, width = frame.shape[:2]
-    frame_bw = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    frame_bw = gray_frame(frame)
     if isinstance(bgd, list):
       if frame_bw.shape != bgd[0].shape:
           for file in bgd:
@@ -226,6 +233,8 @@ def track_checker_gui(video_path_j, bgd, pmn, spd_sm, spd_sm_mm_ps, thresh, disp
         curr_frame = video.get(cv2.CAP_PROP_POS_FRAMES) - 1
 
         if ret:
+            # frames from the store are grayscale, the track is drawn in colour
+            frame = bgr_frame(frame)
             try:
                 cX, cY = (int(track_single_i[int(curr_frame), 1]), int(track_single_i[int(curr_frame), 2]))
                 cv2.circle(frame, (int(x_nt[int(curr_frame)]), int(y_nt[int(curr_frame)])), 4, (0, 255, 255), 4)
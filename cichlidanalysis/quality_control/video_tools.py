@@ -1,31 +1,35 @@
 import cv2.cv2 as cv2
-import numpy as np
 
+from cichlidanalysis.io.movies import seek_to_frame, sampled_frames
+from cichlidanalysis.io.ffmpeg_capture import open_video
+from cichlidanalysis.tracking.streaming_percentile import new_percentile_estimator, add_frame, estimator_percentile
 
-def background_vid_split(videofilepath, nth_frame, percentile, split_range):
-    """ (str, int, int, list)
-     This function will create a median image of the defined area"""
+
+def background_vid_split(videofilepath, nth_frame, percentile, split_range, seek=True, display=True,
+                         video_reader="opencv", sampling="auto"):
+    """ (str, int, int, list, bool, bool, str, str)
+     This function will create a median image of the defined area. Only the split_range is decoded (seeking to the
+     start of it) and frames which aren't used are grabbed without being retrieved. video_reader "ffmpeg" decodes
+     straight to grayscale with an ffmpeg pipe (see io/ffmpeg_capture.py). The sampled frames are kept in a streaming
+     percentile estimator so memory doesn't grow without limit for long ranges. sampling "seek" also jumps straight to
+     each sampled frame, "stratified" takes a random frame out of every nth_frame frames (see
+     io.movies.sampled_frames), with seek=False frames are always grabbed"""
     try:
-        cap = cv2.VideoCapture(videofilepath)
+        cap = open_video(videofilepath, video_reader)
     except:
         print("problem reading video file, check path")
         return
 
-    counter = 0
-    gatheredFramess = []
-    while cap.isOpened() and (counter < split_range[1]):
-        ret, frame = cap.read()
-        if frame is None:
-            break
-        if counter % nth_frame == 0 and counter in np.arange(split_range[0], split_range[1]):
+    gatheredFramess = new_percentile_estimator()
+    if seek_to_frame(cap, split_range[0], exact=not seek):
+        for counter, image in sampled_frames(cap, nth_frame, split_range[0], split_range[1],
+                                             sampling if seek else "grab"):
             print("Frame {}".format(counter))
-            image = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            # settings with Blur settings for the video loop
-            gatheredFramess.append(image)
-        counter += 1
-    if np.shape(gatheredFramess)[0] > 4:
-        background = np.percentile(gatheredFramess, int(percentile), axis=0).astype(dtype=np.uint8)
-        cv2.imshow('Calculated Background from {} percentile'.format(percentile), background)
+            add_frame(gatheredFramess, image)
+    if gatheredFramess["n"] > 4:
+        background = estimator_percentile(gatheredFramess, int(percentile))
+        if display:
+            cv2.imshow('Calculated Background from {} percentile'.format(percentile), background)
         vid_name = videofilepath[0:-4]
         print("saving background")
         range_s = str(split_range[0]).zfill(5)
@@ -36,5 +40,6 @@ def background_vid_split(videofilepath, nth_frame, percentile, split_range):
         background = []
 
     cap.release()
-    cv2.destroyAllWindows()
+    if display:
+        cv2.destroyAllWindows()
     return background
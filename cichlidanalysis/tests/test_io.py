@@ -5,6 +5,7 @@ import pandas as pd
 import pytest
 
 from cichlidanalysis.io.als_files import load_als_files
+from cichlidanalysis.io.tracks import save_track, load_track, csv_to_trk, get_latest_tracks
 
 
 @pytest.mark.parametrize('test_data_file, expected', [
@@ -18,3 +19,22 @@ def test_load_als_files(test_data_file, expected):
     fish_tracks = load_als_files(test_data_dir)
     assert fish_tracks.equals(expected)
 
+
+@pytest.mark.parametrize("track", [
+    np.array([[0, 10, 20, 150], [1, np.nan, np.nan, np.nan], [2, -1, -1, -1], [3, 1279, 959, 2000000]]),
+    np.array([[1.6e18, 10, 20, 150], [1.6e18 + 1e8, np.nan, np.nan, np.nan]])])
+def test_trk_round_trip(tmp_path, track):
+    csv_path = os.path.join(str(tmp_path), "track.csv")
+    save_track(csv_path, track)
+    trk_path = csv_to_trk(csv_path)
+    _, loaded = load_track(trk_path)
+    assert np.array_equal(loaded, track, equal_nan=True)
+    assert os.path.getsize(trk_path) > 0
+
+
+def test_get_latest_tracks_prefers_trk(tmp_path):
+    track = np.array([[0, 10, 20, 150], [1, 11, 21, 150]])
+    for name in ["FISH_001_roi-0_tracks.csv", "FISH_001_roi-0_tracks.trk", "FISH_002_roi-0_tracks.csv"]:
+        save_track(os.path.join(str(tmp_path), name), track)
+    _, files = get_latest_tracks(str(tmp_path), "roi-0")
+    assert sorted(files) == ["FISH_001_roi-0_tracks.trk", "FISH_002_roi-0_tracks.csv"]
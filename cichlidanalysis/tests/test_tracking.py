@@ -0,0 +1,768 @@
+import os
+import glob
+
+import cv2.cv2 as cv2
+import numpy as np
+import pytest
+import yaml
+
+from cichlidanalysis.tracking.batch_tracking import make_track_jobs, track_videos_parallel, job_key
+from cichlidanalysis.tracking.offline_tracker import tracker, track_file_names, checkpoint_file_name, \
+    save_checkpoint, checkpoint_params
+from cichlidanalysis.quality_control.video_tools import background_vid_split
+from cichlidanalysis.io.tracks import load_track
+from cichlidanalysis.tracking.backgrounds import background_vid, background_vid_percentiles
+from cichlidanalysis.io.movies import sampled_frames, seek_to_frame
+from cichlidanalysis.benchmarks.synthetic_video import make_synthetic_video
+from cichlidanalysis.io.ffmpeg_capture import FFmpegCapture, ffmpeg_available
+from cichlidanalysis.tracking.downscale import compare_downscale
+from cichlidanalysis.tracking.track_log import new_track_log
+from cichlidanalysis.tracking.streaming_percentile import new_percentile_estimator, add_frame, \
+    estimator_percentile
+from cichlidanalysis.tracking.motion_gate import gated_file_name, load_gated_frames, compare_motion_gate
+from cichlidanalysis.tracking.fused_tracking import background_and_track, divided_retrack
+from cichlidanalysis.tracking.background_cache import get_background, cached_background, cached_background_records
+from cichlidanalysis.tracking.background_bank import build_background_bank, get_background_bank
+from cichlidanalysis.quality_control.scene_changes import detect_scene_changes, change_split_ranges
+from cichlidanalysis.quality_control.gap_retracking import retrack_gaps
+from cichlidanalysis.quality_control import gap_retracking
+from cichlidanalysis.tracking.multi_threshold import quality_score, multi_threshold_tracker
+from cichlidanalysis.tracking import multi_threshold
+from cichlidanalysis.tracking import offline_tracker
+from cichlidanalysis.tracking.candidates import candidates_file_name, load_candidates, resolve_track_file
+from cichlidanalysis.io.frame_store import build_frame_store, remove_frame_store
+from cichlidanalysis.io.frame_cache import FrameCacheCapture
+from cichlidanalysis.io.ffmpeg_capture import open_video, gray_frame
+from cichlidanalysis.tracking.blobs import largest_contour, largest_component, label_map_blobs, roi_label_map
+from cichlidanalysis.tracking.threshold_calibration import calibrate_threshold, calibration_file_name, \
+    load_calibration, calibrated_thresholds, calibrated_tracker
+
+
+def make_test_video(video_path, n_frames=30, width=80, height=60):
+    """ Writes a small video with a bright square moving one pixel per frame on a grey background """
+    writer = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*"MJPG"), 10, (width, height))
+    for frame_n in range(n_frames):
+        frame = np.full((height, width, 3), 100, dtype=np.uint8)
+        x = 10 + frame_n % (width - 30)
+        frame[20:30, x:x + 10] = 250
+        writer.write(frame)
+    writer.release()
+    background = np.full((height, width), 100, dtype=np.uint8)
+    return background
+
+
+@pytest.fixture
+def test_video(tmp_path):
+    video_path = os.path.join(str(tmp_path), "20210101-120000_000_roi-0.avi")
+    background = make_test_video(video_path)
+    background_path = os.path.join(str(tmp_path), "20210101-120000_000_per90_background.png")
+    cv2.imwrite(background_path, background)
+    return video_path, background_path
+
+
+def test_track_videos_parallel_journal(test_video):
+    video_path, background_path = test_video
+    rois = {'roi_0': (0, 0, 40, 60), 'roi_1': (40, 0, 40, 60), 'cam_ID': 'na'}
+    jobs = make_track_jobs([video_path], [background_path], rois, threshold=35, area_size=10)
+    assert len(jobs) == 2
+
+    journal_path = os.path.join(os.path.split(video_path)[0], "tracking_journal.txt")
+    tracked = track_videos_parallel(jobs, n_workers=1)
+    assert set(tracked) == set(job_key(job) for job in jobs)
+    assert len(glob.glob(video_path[0:-4] + "_tracks_*_roi-0.csv")) == 1
+    assert len(glob.glob(video_path[0:-4] + "_tracks_*_roi-1.csv")) == 1
+    # the finished batch removes its journal, so running it again tracks again
+    assert not os.path.isfile(journal_path)
+    assert len(track_videos_parallel(jobs, n_workers=1)) == 2
+
+    # resuming an interrupted batch doesn't retrack the finished jobs
+    with open(journal_path, "w") as file:
+        file.write(job_key(jobs[0]) + "\n")
+    assert track_videos_parallel(jobs, n_workers=1) == [job_key(jobs[1])]
+    assert not os.path.isfile(journal_path)
+
+    # the key changes with the background and the video folder
+    other_background = background_path[0:-4] + "_other.png"
+    cv2.imwrite(other_background, cv2.imread(background_path, 0) + 1)
+    assert job_key(jobs[0]) != job_key(make_track_jobs([video_path], [other_background], rois)[0])
+    other_video = os.path.join(os.path.split(video_path)[0], "other", os.path.split(video_path)[1])
+    assert job_key(jobs[0]) != job_key(dict(jobs[0], video_path=other_video))
+    assert job_key(jobs[0]) != job_key(dict(jobs[0], background_path=None))
+
+
+@pytest.mark.parametrize("seek", [True, False])
+def test_tracker_split_range(test_video, seek):
+    video_path, background_path = test_video
+    background = cv2.imread(background_path, 0)
+    tracker(video_path, background, {'roi_0': (0, 0, 80, 60)}, threshold=35, display=False, area_size=10,
+            split_range=[12, 20], seek=seek)
+    track = np.loadtxt(glob.glob(video_path[0:-4] + "_tracks_*_Range00012-00020_.csv")[0], delimiter=",")
+    assert (track[:, 0] == np.arange(12, 20)).all()
+    # the square starts at x = 10 + frame number and is 10 pixels wide
+    assert (np.abs(track[:, 1] - (np.arange(12, 20) + 14.5)) <= 1).all()
+
+    # Range files have no roi number, so several rois would write to the same file
+    with pytest.raises(ValueError):
+        tracker(video_path, background, {'roi_0': (0, 0, 40, 60), 'roi_1': (40, 0, 40, 60), 'cam_ID': 'na'},
+                threshold=35, display=False, area_size=10, split_range=[12, 20], seek=seek)
+
+
+def test_background_vid_split(test_video):
+    video_path, background_path = test_video
+    background = background_vid_split(video_path, 2, 10, [5, 25], display=False)
+    assert background.shape == (60, 80)
+    assert np.abs(background.astype(int) - 100).max() < 10
+
+
+def test_tracker_resume_from_checkpoint(test_video):
+    video_path, background_path = test_video
+    background = cv2.imread(background_path, 0)
+    rois = {'roi_0': (0, 0, 80, 60)}
+    tracker(video_path, background, rois, threshold=35, display=False, area_size=10, chunk_size=10)
+    filename = glob.glob(video_path[0:-4] + "_tracks_*_roi-0.csv")[0]
+    with open(filename) as file:
+        full_track = file.readlines()
+    assert len(full_track) == 30
+    assert not os.path.isfile(checkpoint_file_name(video_path, 35, 10, [0]))
+
+    # fake a crash on an earlier day after the first chunk, with half a chunk written after the checkpoint
+    os.remove(filename)
+    resumed_name = track_file_names(video_path, "20200101", 35, 10, [0])
+    with open(resumed_name[0], "w") as file:
+        file.writelines(full_track[0:15])
+    size = len("".join(full_track[0:10]).encode())
+    params = checkpoint_params(background, None, 0, 0, 25, 1, 0, "csv")
+    save_checkpoint(checkpoint_file_name(video_path, 35, 10, [0]), {"video_path": video_path,
+                                                                      "filenames": resumed_name, "next_frame": 10,
+                                                                      "file_sizes": {0: size}, "params": params})
+
+    tracker(video_path, background, rois, threshold=35, display=False, area_size=10, chunk_size=10, resume=True)
+    # the resumed track has today's date
+    assert not os.path.isfile(resumed_name[0])
+    with open(filename) as file:
+        assert file.readlines() == full_track
+
+    # a checkpoint made with another background isn't resumed
+    os.remove(filename)
+    with open(resumed_name[0], "w") as file:
+        file.writelines(full_track[0:15])
+    params = checkpoint_params(background + 1, None, 0, 0, 25, 1, 0, "csv")
+    save_checkpoint(checkpoint_file_name(video_path, 35, 10, [0]), {"video_path": video_path,
+                                                                      "filenames": resumed_name, "next_frame": 10,
+                                                                      "file_sizes": {0: size}, "params": params})
+    tracker(video_path, background, rois, threshold=35, display=False, area_size=10, chunk_size=10, resume=True)
+    with open(resumed_name[0]) as file:
+        assert len(file.readlines()) == 15
+    with open(filename) as file:
+        assert file.readlines() == full_track
+
+
+def test_tracker_resume_per_roi_jobs(test_video, monkeypatch, capsys):
+    # the per roi jobs of a batch track the same video at the same time, each needs its own checkpoint
+    video_path, background_path = test_video
+    background = cv2.imread(background_path, 0)
+    rois = {'roi_0': (0, 0, 39, 60), 'roi_1': (40, 0, 40, 60), 'cam_ID': 'na'}
+    for roi in [0, 1]:
+        tracker(video_path, background, dict(rois), threshold=35, display=False, area_size=10, roi_nums=[roi])
+    track_paths = [glob.glob(video_path[0:-4] + "_tracks_*_roi-{}.csv".format(roi))[0] for roi in [0, 1]]
+    tracks = [load_track(path)[1] for path in track_paths]
+
+    original_frames = offline_tracker.sequential_frames
+
+    def crashing_frames(*args, **kwargs):
+        for frame_id, gray, blobs in original_frames(*args, **kwargs):
+            if frame_id == 25:
+                raise RuntimeError("crash")
+            yield frame_id, gray, blobs
+
+    monkeypatch.setattr(offline_tracker, "sequential_frames", crashing_frames)
+    for roi in [0, 1]:
+        with pytest.raises(RuntimeError):
+            tracker(video_path, background, dict(rois), threshold=35, display=False, area_size=10, roi_nums=[roi],
+                    chunk_size=10)
+    assert all(os.path.isfile(checkpoint_file_name(video_path, 35, 10, [roi])) for roi in [0, 1])
+    monkeypatch.setattr(offline_tracker, "sequential_frames", original_frames)
+    capsys.readouterr()
+    for roi in [0, 1]:
+        tracker(video_path, background, dict(rois), threshold=35, display=False, area_size=10, roi_nums=[roi],
+                chunk_size=10, resume=True)
+    assert capsys.readouterr().out.count("resuming tracking from frame 20") == 2
+    assert all(np.array_equal(load_track(path)[1], track, equal_nan=True) for path, track in zip(track_paths, tracks))
+    assert not any(os.path.isfile(checkpoint_file_name(video_path, 35, 10, [roi])) for roi in [0, 1])
+
+
+def test_tracker_blob_backends_match(test_video):
+    video_path, background_path = test_video
+    background = cv2.imread(background_path, 0)
+    rois = {'roi_0': (0, 0, 39, 60), 'roi_1': (40, 0, 40, 60), 'cam_ID': 'na'}
+    tracks = dict()
+    for backend in ["contours", "components", "label_map"]:
+        tracker(video_path, background, dict(rois), threshold=35, display=False, area_size=10, blob_backend=backend)
+        tracks[backend] = [np.loadtxt(glob.glob(video_path[0:-4] + "_tracks_*_roi-{}.csv".format(roi))[0],
+                                      delimiter=",") for roi in [0, 1]]
+    for backend in ["components", "label_map"]:
+        for roi in [0, 1]:
+            assert np.array_equal(tracks[backend][roi], tracks["contours"][roi], equal_nan=True)
+
+
+def test_blob_backends_pick_same_blob():
+    # noisy masks have many blobs of equal area, each backend has to pick the same one as findContours
+    def points(contour):
+        return None if contour is None else np.sort(contour.reshape(-1, 2), axis=0).tolist()
+
+    rng = np.random.default_rng(1)
+    rois = {'roi_0': (5, 5, 20, 30), 'roi_1': (30, 5, 18, 30)}
+    for i in range(300):
+        frame_delta = (rng.random((40, 50)) * 255).astype(np.uint8)
+        if i % 2:
+            frame_delta = cv2.GaussianBlur(frame_delta, (3, 3), 0)
+        threshold = int(rng.integers(100, 250))
+        contour, _ = largest_contour(frame_delta, threshold)
+        assert points(largest_component(frame_delta, threshold)[0]) == points(contour)
+        blobs = label_map_blobs(frame_delta, threshold, roi_label_map(frame_delta.shape, rois, [0, 1]), rois, [0, 1])
+        for roi in [0, 1]:
+            x, y, w, h = rois['roi_' + str(roi)]
+            assert points(blobs[roi][0]) == points(largest_contour(frame_delta[y:y + h, x:x + w], threshold)[0])
+
+
+def test_tracker_threaded_matches_sequential(test_video):
+    video_path, background_path = test_video
+    background = cv2.imread(background_path, 0)
+    rois = {'roi_0': (0, 0, 80, 60)}
+    tracker(video_path, background, dict(rois), threshold=35, display=False, area_size=10)
+    filename = glob.glob(video_path[0:-4] + "_tracks_*_roi-0.csv")[0]
+    sequential = np.loadtxt(filename, delimiter=",")
+
+    stats = tracker(video_path, background, dict(rois), threshold=35, display=False, area_size=10, n_workers=2,
+                    queue_size=4, chunk_size=7)
+    assert stats["frames"] == 30
+    assert np.array_equal(np.loadtxt(filename, delimiter=","), sequential, equal_nan=True)
+
+
+def test_tracker_trk_format(test_video):
+    video_path, background_path = test_video
+    background = cv2.imread(background_path, 0)
+    rois = {'roi_0': (0, 0, 80, 60)}
+    tracker(video_path, background, dict(rois), threshold=35, display=False, area_size=10)
+    tracker(video_path, background, dict(rois), threshold=35, display=False, area_size=10, track_format="trk",
+            chunk_size=7)
+    _, track_csv = load_track(glob.glob(video_path[0:-4] + "_tracks_*_roi-0.csv")[0])
+    _, track_trk = load_track(glob.glob(video_path[0:-4] + "_tracks_*_roi-0.trk")[0])
+    assert not glob.glob(video_path[0:-4] + "*.part")
+    # areas are rounded in the binary format
+    track_csv[:, 3] = np.round(track_csv[:, 3])
+    assert np.array_equal(track_trk, track_csv, equal_nan=True)
+
+
+def test_tracker_search_window_matches_full(test_video):
+    video_path, background_path = test_video
+    background = cv2.imread(background_path, 0)
+    rois = {'roi_0': (0, 0, 80, 60)}
+    tracker(video_path, background, dict(rois), threshold=35, display=False, area_size=10)
+    filename = glob.glob(video_path[0:-4] + "_tracks_*_roi-0.csv")[0]
+    full = np.loadtxt(filename, delimiter=",")
+    tracker(video_path, background, dict(rois), threshold=35, display=False, area_size=10, search_window=12)
+    assert np.array_equal(np.loadtxt(filename, delimiter=","), full, equal_nan=True)
+
+
+def test_synthetic_video_tracking(tmp_path):
+    video_path = os.path.join(str(tmp_path), "20210101-120000_000_synthetic.mp4")
+    background, rois, positions = make_synthetic_video(video_path, n_frames=40, n_rois=2, width=160, height=120)
+    tracker(video_path, background, dict(rois), threshold=35, display=False, area_size=50)
+    for roi in range(2):
+        _, track = load_track(glob.glob(video_path[0:-4] + "_tracks_*_roi-{}.csv".format(roi))[0])
+        assert track.shape[0] == 40
+        assert np.nanmax(np.abs(track[:, 1:3] - positions[roi])) <= 2
+
+
+def test_tracker_motion_gate(tmp_path):
+    video_path = os.path.join(str(tmp_path), "20210101-120000_000_synthetic.mp4")
+    background, rois, _ = make_synthetic_video(video_path, n_frames=120, n_rois=2, width=160, height=120)
+    tracker(video_path, background, dict(rois), threshold=35, display=False, area_size=50)
+    filename = glob.glob(video_path[0:-4] + "_tracks_*_roi-0.csv")[0]
+    full = np.loadtxt(filename, delimiter=",")
+    tracker(video_path, background, dict(rois), threshold=35, display=False, area_size=50, motion_gate=10,
+            max_skip=5, chunk_size=50)
+    gated = np.loadtxt(filename, delimiter=",")
+    gated_frames = load_gated_frames(gated_file_name(filename))
+    assert len(gated_frames) > 0
+    # a frame is only gated after a fully tracked frame, and never more than max_skip in a row
+    assert 0 not in gated_frames
+    assert not any(set(range(frame_n, frame_n + 6)) <= set(gated_frames) for frame_n in gated_frames)
+    assert np.nanmax(np.abs(gated[:, 1:3] - full[:, 1:3])) <= 2
+
+    report = compare_motion_gate(video_path, background, rois, threshold=35, area_size=50, tolerance=10)
+    assert report["gated_fraction"] > 0
+    assert report["detection_mismatches"] == 0
+
+
+@pytest.mark.skipif(not ffmpeg_available(), reason="needs an ffmpeg binary")
+def test_ffmpeg_capture_crop_and_seek(test_video):
+    video_path, _ = test_video
+    cap = cv2.VideoCapture(video_path)
+    frames = []
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+
+    ffmpeg_cap = FFmpegCapture(video_path, crop=(10, 5, 40, 30))
+    assert ffmpeg_cap.get(cv2.CAP_PROP_FRAME_COUNT) == 30
+    ret, frame = ffmpeg_cap.read()
+    assert frame.shape == (30, 40)
+    assert np.abs(frame.astype(int) - frames[0][5:35, 10:50]).max() <= 2
+    ffmpeg_cap.set(cv2.CAP_PROP_POS_FRAMES, 17)
+    ret, frame = ffmpeg_cap.read()
+    assert np.abs(frame.astype(int) - frames[17][5:35, 10:50]).max() <= 2
+    ffmpeg_cap.release()
+    assert not ffmpeg_cap.isOpened()
+
+
+@pytest.mark.skipif(not ffmpeg_available(), reason="needs an ffmpeg binary")
+def test_tracker_ffmpeg_reader_matches_opencv(test_video):
+    video_path, background_path = test_video
+    background = cv2.imread(background_path, 0)
+    rois = {'roi_0': (4, 10, 36, 40), 'roi_1': (40, 10, 36, 40), 'cam_ID': 'na'}
+    # Range files have no roi number, so one roi at a time
+    for roi in [0, 1]:
+        tracker(video_path, background, dict(rois), threshold=35, display=False, area_size=10, split_range=[5, 25],
+                roi_nums=[roi])
+        filename = glob.glob(video_path[0:-4] + "_tracks_*_Range00005-00025_.csv")[0]
+        opencv = np.loadtxt(filename, delimiter=",")
+        tracker(video_path, background, dict(rois), threshold=35, display=False, area_size=10, split_range=[5, 25],
+                roi_nums=[roi], video_reader="ffmpeg")
+        assert np.array_equal(np.loadtxt(filename, delimiter=","), opencv, equal_nan=True)
+
+    opencv_background = background_vid_split(video_path, 2, 10, [0, 30], display=False)
+    ffmpeg_background = background_vid_split(video_path, 2, 10, [0, 30], display=False, video_reader="ffmpeg")
+    assert np.abs(ffmpeg_background.astype(int) - opencv_background).max() <= 2
+
+
+def test_tracker_downscale(tmp_path):
+    video_path = os.path.join(str(tmp_path), "20210101-120000_000_synthetic.mp4")
+    background, rois, _ = make_synthetic_video(video_path, n_frames=40, n_rois=2, width=162, height=122,
+                                               fish_length=30)
+    tracker(video_path, background, dict(rois), threshold=35, display=False, area_size=50)
+    filename = glob.glob(video_path[0:-4] + "_tracks_*_roi-1.csv")[0]
+    full = np.loadtxt(filename, delimiter=",")
+    tracker(video_path, background, dict(rois), threshold=35, display=False, area_size=50, downscale=2)
+    downscaled = np.loadtxt(filename, delimiter=",")
+    assert np.nanmax(np.abs(downscaled[:, 1:3] - full[:, 1:3])) <= 2
+    assert np.nanmax(np.abs(downscaled[:, 3] - full[:, 3]) / full[:, 3]) < 0.2
+
+    reports, best = compare_downscale(video_path, background, rois, threshold=35, area_size=50, factors=(2, 8))
+    assert reports[2]["p99_error"] <= 2
+    assert best >= 2
+
+
+def test_tracker_track_log(test_video, capsys):
+    video_path, background_path = test_video
+    background = cv2.imread(background_path, 0)
+    rois = {'roi_0': (0, 0, 40, 60), 'roi_1': (40, 0, 40, 60), 'cam_ID': 'na'}
+    track_log = new_track_log()
+    tracker(video_path, background, dict(rois), threshold=35, display=False, area_size=10, track_log=track_log)
+    _, track = load_track(glob.glob(video_path[0:-4] + "_tracks_*_roi-1.csv")[0])
+    missing = np.isnan(track[:, 1])
+
+    assert track_log["frames"] == {0: 30, 1: 30}
+    assert track_log["no_contour"].get(1, 0) + track_log["small_contour"].get(1, 0) == missing.sum()
+    # the square only enters roi 1 after the start, so the longest gap is at the start of the video
+    assert track_log["longest_gap"][1] == (int(np.argmin(missing)), 0)
+    # messages are rate limited
+    assert capsys.readouterr().out.count("no contour found for roi 1!") == 1
+
+
+@pytest.mark.parametrize("n_frames", [1, 2, 9, 40])
+def test_streaming_percentile_matches_numpy(n_frames):
+    rng = np.random.default_rng(0)
+    frames = rng.integers(0, 256, (n_frames, 12, 17), dtype=np.uint8)
+    estimator = new_percentile_estimator(max_stack=4)
+    for frame in frames:
+        add_frame(estimator, frame)
+    for percentile in [0, 10, 33.3, 50, 90, 100]:
+        expected = np.percentile(frames, percentile, axis=0).astype(np.uint8)
+        assert np.array_equal(estimator_percentile(estimator, percentile), expected)
+
+
+def test_sampled_frames(test_video):
+    video_path, _ = test_video
+    sampled = dict()
+    for sampling in ["grab", "seek", "stratified"]:
+        cap = cv2.VideoCapture(video_path)
+        sampled[sampling] = list(sampled_frames(cap, 7, start=3, end=29, sampling=sampling))
+        cap.release()
+    assert [frame_n for frame_n, _ in sampled["grab"]] == [7, 14, 21, 28]
+    assert [frame_n for frame_n, _ in sampled["seek"]] == [7, 14, 21, 28]
+    assert all(np.array_equal(grabbed, seeked) for (_, grabbed), (_, seeked) in zip(sampled["grab"], sampled["seek"]))
+    # one frame out of each block of 7 frames
+    assert [(frame_n - 3) // 7 for frame_n, _ in sampled["stratified"]] == [0, 1, 2, 3]
+
+
+class InaccurateSeekCapture:
+    """ Lands 3 frames early on every seek but reports the frame it was set to, like OpenCV does for some videos """
+
+    def __init__(self, video_path):
+        self.cap = cv2.VideoCapture(video_path)
+        self.requested = None
+
+    def set(self, prop, value):
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            self.requested = value
+            value = max(value - 3, 0)
+        return self.cap.set(prop, value)
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_POS_FRAMES and self.requested is not None:
+            return float(self.requested)
+        return self.cap.get(prop)
+
+    def read(self):
+        return self.cap.read()
+
+    def grab(self):
+        return self.cap.grab()
+
+    def release(self):
+        self.cap.release()
+
+
+def test_seek_checks_frame_timestamp(test_video, capsys):
+    video_path, _ = test_video
+    cap = cv2.VideoCapture(video_path)
+    frames = [cap.read()[1] for _ in range(30)]
+    cap.release()
+
+    for capture in [cv2.VideoCapture, InaccurateSeekCapture]:
+        cap = capture(video_path)
+        assert seek_to_frame(cap, 17) and np.array_equal(cap.read()[1], frames[17])
+        cap.release()
+        cap = capture(video_path)
+        sampled = list(sampled_frames(cap, 7, start=3, end=29, sampling="seek"))
+        cap.release()
+        assert [frame_n for frame_n, _ in sampled] == [7, 14, 21, 28]
+        assert all(np.array_equal(frame, gray_frame(frames[frame_n])) for frame_n, frame in sampled)
+    assert "seeking isn't frame accurate" in capsys.readouterr().out
+
+
+def test_background_vid_percentiles(test_video):
+    video_path, _ = test_video
+    backgrounds = background_vid_percentiles(video_path, 3, [10, 50, 90], display=False)
+    for percentile, background in zip([10, 50, 90], backgrounds):
+        assert np.array_equal(background, background_vid(video_path, 3, percentile, display=False))
+        assert os.path.isfile(video_path[0:-4] + "_per{}_background.png".format(percentile))
+
+
+def test_background_and_track_matches_two_passes(tmp_path):
+    video_path = os.path.join(str(tmp_path), "20210101-120000_000_synthetic.mp4")
+    _, rois, _ = make_synthetic_video(video_path, n_frames=60, n_rois=2, width=160, height=120)
+    background = background_vid(video_path, 10, 90, display=False)
+    tracker(video_path, background, dict(rois), threshold=35, display=False, area_size=50)
+    two_pass = [load_track(glob.glob(video_path[0:-4] + "_tracks_*_roi-{}.csv".format(roi))[0])[1] for roi in range(2)]
+    for path in glob.glob(video_path[0:-4] + "_tracks_*"):
+        os.remove(path)
+
+    fused_background = background_and_track(video_path, rois, nth_frame=10, percentile=90, threshold=35, area_size=50)
+    assert np.array_equal(fused_background, background)
+    for roi in range(2):
+        _, track = load_track(glob.glob(video_path[0:-4] + "_tracks_*_roi-{}.csv".format(roi))[0])
+        assert np.array_equal(track, two_pass[roi], equal_nan=True)
+
+
+def test_divided_retrack_matches_split_tracking(tmp_path):
+    video_path = os.path.join(str(tmp_path), "20210101-120000_000_synthetic.mp4")
+    # Range track files have no roi number in the name, so a single roi as in divide_tracking.divide_video
+    _, rois, _ = make_synthetic_video(video_path, n_frames=90, n_rois=1, width=160, height=120)
+    chunks = [[0, 30], [30, 60], [60, 90]]
+    split = dict()
+    for chunk in chunks:
+        background = background_vid_split(video_path, 5, 90, chunk, display=False)
+        tracker(video_path, background, dict(rois), threshold=35, display=False, area_size=50, split_range=chunk)
+        split[chunk[0]] = (background, [load_track(path)[1] for path in
+                                        sorted(glob.glob(video_path[0:-4] + "_tracks_*_Range{:05}-*".format(chunk[0])))])
+    for path in glob.glob(video_path[0:-4] + "_tracks_*"):
+        os.remove(path)
+
+    backgrounds = divided_retrack(video_path, rois, chunks, nth_frame=5, percentile=90, threshold=35, area_size=50)
+    for chunk, background in zip(chunks, backgrounds):
+        assert np.array_equal(background, split[chunk[0]][0])
+        tracks = [load_track(path)[1] for path in
+                  sorted(glob.glob(video_path[0:-4] + "_tracks_*_Range{:05}-*".format(chunk[0])))]
+        assert len(tracks) == len(split[chunk[0]][1])
+        for track, split_track in zip(tracks, split[chunk[0]][1]):
+            assert track.shape[0] == chunk[1] - chunk[0]
+            assert np.array_equal(track, split_track, equal_nan=True)
+
+
+def test_background_cache(test_video, capsys):
+    video_path, _ = test_video
+    background = get_background(video_path, 2, 90)
+    assert cached_background(video_path, 2, 90) is not None
+    assert cached_background(video_path, 2, 50) is None
+    capsys.readouterr()
+    assert np.array_equal(get_background(video_path, 2, 90, sampling="seek"), background)
+    assert "using cached background" in capsys.readouterr().out
+
+    split_background = get_background(video_path, 2, 90, [5, 25])
+    assert [record["frame_range"] for record in cached_background_records(video_path)] == [None, [5, 25]]
+    assert np.array_equal(cached_background(video_path, 2, 90, [5, 25]), split_background)
+
+    # a background made with other parameters over the same png isn't used
+    get_background(video_path, 2, 90, sampling="stratified")
+    assert cached_background(video_path, 2, 90) is None
+
+
+def test_tracker_background_bank(tmp_path):
+    video_path = os.path.join(str(tmp_path), "20210101-120000_000_synthetic.mp4")
+    _, rois, positions = make_synthetic_video(video_path, n_frames=90, width=160, height=120, drift=30.0)
+    # 0.05 min at 10 fps is a background every 30 frames
+    bank = build_background_bank(video_path, interval_min=0.05, nth_frame=5)
+    assert bank["frame_ranges"] == [[0, 30], [30, 60], [60, 90]]
+    assert get_background_bank(video_path, interval_min=0.05, nth_frame=5)["frame_ranges"] == bank["frame_ranges"]
+    assert len(glob.glob(video_path[0:-4] + "_*_backgrounds.npz")) == 1
+    # a bank with another sampling step or of changed video content isn't reused
+    assert get_background_bank(video_path, interval_min=0.05, nth_frame=10)["nth_frame"] == 10
+    assert len(glob.glob(video_path[0:-4] + "_*_backgrounds.npz")) == 2
+    with open(video_path, "ab") as file:
+        file.write(b"\0")
+    get_background_bank(video_path, interval_min=0.05, nth_frame=5)
+    assert len(glob.glob(video_path[0:-4] + "_*_backgrounds.npz")) == 3
+
+    tracker(video_path, None, dict(rois), threshold=35, display=False, area_size=50, background_bank=bank)
+    _, track = load_track(glob.glob(video_path[0:-4] + "_tracks_*_roi-0.csv")[0])
+    assert np.nanmedian(np.abs(track[:, 1:3] - positions[0])) <= 2
+    # each frame is tracked as if its part of the video was tracked with its own background
+    for frame_range, background in zip(bank["frame_ranges"], bank["backgrounds"]):
+        tracker(video_path, background, dict(rois), threshold=35, display=False, area_size=50,
+                split_range=frame_range)
+        _, part = load_track(glob.glob(video_path[0:-4] + "_tracks_*_Range{:05}-*".format(frame_range[0]))[0])
+        assert np.array_equal(track[frame_range[0]:frame_range[1]], part, equal_nan=True)
+
+
+def test_detect_scene_changes(tmp_path):
+    # textured scene with a small moving square, the camera is bumped 6 pixels at frame 120 and the lights dim at 240
+    video_path = os.path.join(str(tmp_path), "20210101-120000_000_roi-0.avi")
+    scene = cv2.GaussianBlur(np.random.default_rng(0).integers(0, 255, (140, 200)).astype(np.uint8), (9, 9), 3)
+    writer = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*"MJPG"), 10, (160, 120))
+    for frame_n in range(300):
+        offset = 6 if frame_n >= 120 else 0
+        frame = scene[10:130, 20 + offset:180 + offset].copy()
+        if frame_n >= 240:
+            frame = (frame * 0.6).astype(np.uint8)
+        x = 10 + frame_n % 120
+        frame[50:60, x:x + 10] = 250
+        writer.write(cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR))
+    writer.release()
+
+    changes = detect_scene_changes(video_path, nth_frame=20, scale=2)
+    assert [(change["before"], change["after"]) for change in changes] == [(100, 120), (220, 240)]
+    assert abs(changes[0]["shift"] - 6) < 1
+    assert change_split_ranges(changes, 300) == [[0, 120], [120, 240], [240, 300]]
+
+
+def test_retrack_gaps(tmp_path, monkeypatch):
+    video_path = os.path.join(str(tmp_path), "20210101-120000_000_synthetic.mp4")
+    background, rois, positions = make_synthetic_video(video_path, n_frames=200, width=160, height=120)
+    tracker(video_path, background, dict(rois), threshold=35, display=False, area_size=50)
+    track_path = glob.glob(video_path[0:-4] + "_tracks_*_roi-0.csv")[0]
+    _, track = load_track(track_path)
+
+    damaged = track.copy()
+    damaged[20:30, 1:4] = np.nan
+    damaged[100:110, 1:4] = -1
+    damaged[150, 1:3] = [500, 500]
+    np.savetxt(track_path, damaged, delimiter=",")
+
+    backgrounds = []
+    original_background = gap_retracking.local_background
+    monkeypatch.setattr(gap_retracking, "local_background",
+                        lambda *args: backgrounds.append(args[1]) or original_background(*args))
+    n_bad, fixed = retrack_gaps(video_path, track_path, rois, threshold=35, area_size=50, margin=5, nth_frame=10,
+                                background_margin=50)
+    assert n_bad == 23 and fixed == 23
+    # the first two gaps share a background, the third would make its window too long
+    assert backgrounds == [[15, 115], [144, 157]]
+    _, merged = load_track(track_path)
+    assert np.array_equal(merged[:, 0], track[:, 0])
+    assert np.nanmax(np.abs(merged[:, 1:3] - positions[0])) <= 2
+    # only the bad frames were changed and the original is kept
+    assert np.array_equal(merged[0:20], track[0:20])
+    assert np.array_equal(load_track(track_path[0:-4] + "_exclude.csv")[1], damaged, equal_nan=True)
+
+
+def test_multi_threshold_tracker(tmp_path):
+    video_path = os.path.join(str(tmp_path), "20210101-120000_000_synthetic.mp4")
+    background, rois, _ = make_synthetic_video(video_path, n_frames=40, n_rois=2, width=160, height=120)
+    summary = multi_threshold_tracker(video_path, background, dict(rois), [5, 35], area_size=50, display=False)
+    assert sorted(summary["rois"]) == [0, 1]
+    assert summary["best"] == {0: 35, 1: 35}
+    assert summary["rois"][0][5]["multiple"] > summary["rois"][0][35]["multiple"]
+    assert quality_score(summary["rois"][0][35]) > quality_score(summary["rois"][0][5])
+    assert len(glob.glob(video_path[0:-4] + "_tracks_*_thresholds.yaml")) == 1
+
+    # the track of each threshold is the same as from a tracking run with only that threshold
+    multi = load_track(glob.glob(video_path[0:-4] + "_tracks_*_Thresh_35_*_roi-1.csv")[0])[1]
+    os.remove(glob.glob(video_path[0:-4] + "_tracks_*_Thresh_35_*_roi-1.csv")[0])
+    tracker(video_path, background, dict(rois), threshold=35, display=False, area_size=50)
+    single = load_track(glob.glob(video_path[0:-4] + "_tracks_*_Thresh_35_*_roi-1.csv")[0])[1]
+    assert np.array_equal(multi, single, equal_nan=True)
+
+    # options which need the single threshold tracker are refused instead of ignored
+    for option in [{"blob_backend": "components"}, {"motion_gate": 2}, {"background_bank": {"backgrounds": []}},
+                   {"not_an_option": 1}]:
+        with pytest.raises(ValueError):
+            multi_threshold_tracker(video_path, background, dict(rois), [5, 35], area_size=50, **option)
+    with pytest.raises(ValueError):
+        multi_threshold_tracker(video_path, None, dict(rois), [5, 35], area_size=50)
+
+
+def test_multi_threshold_tracker_chunks_and_resume(tmp_path, monkeypatch, capsys):
+    video_path = os.path.join(str(tmp_path), "20210101-120000_000_synthetic.mp4")
+    background, rois, _ = make_synthetic_video(video_path, n_frames=40, n_rois=2, width=160, height=120)
+    summary = multi_threshold_tracker(video_path, background, dict(rois), [5, 35], area_size=50)
+    track_paths = sorted(glob.glob(video_path[0:-4] + "_tracks_*_roi-*.csv"))
+    tracks = [load_track(path)[1] for path in track_paths]
+
+    # written in chunks the tracks and the quality summary are the same
+    chunked = multi_threshold_tracker(video_path, background, dict(rois), [5, 35], area_size=50, chunk_size=7)
+    assert all(np.array_equal(load_track(path)[1], track, equal_nan=True) for path, track in zip(track_paths, tracks))
+    for roi in [0, 1]:
+        for threshold in [5, 35]:
+            for name, value in summary["rois"][roi][threshold].items():
+                assert np.isclose(chunked["rois"][roi][threshold][name], value, equal_nan=True)
+
+    # a run which crashes after 25 frames continues from its last checkpoint
+    original_frames = multi_threshold.sequential_frames
+
+    def crashing_frames(*args):
+        for frame_id, gray, blobs in original_frames(*args):
+            if frame_id == 25:
+                raise RuntimeError("crash")
+            yield frame_id, gray, blobs
+
+    monkeypatch.setattr(multi_threshold, "sequential_frames", crashing_frames)
+    with pytest.raises(RuntimeError):
+        multi_threshold_tracker(video_path, background, dict(rois), [5, 35], area_size=50, chunk_size=10)
+    monkeypatch.setattr(multi_threshold, "sequential_frames", original_frames)
+    resumed = multi_threshold_tracker(video_path, background, dict(rois), [5, 35], area_size=50, chunk_size=10,
+                                      resume=True)
+    assert "resuming tracking from frame 20" in capsys.readouterr().out
+    assert all(np.array_equal(load_track(path)[1], track, equal_nan=True) for path, track in zip(track_paths, tracks))
+    assert resumed["best"] == summary["best"]
+    assert np.isclose(resumed["rois"][0][5]["jumps"], summary["rois"][0][5]["jumps"])
+
+
+def test_tracker_candidates_resolve(tmp_path):
+    # bright square moving one pixel per frame, in frames 10-14 a larger bright patch (debris) appears elsewhere
+    video_path = os.path.join(str(tmp_path), "20210101-120000_000_roi-0.avi")
+    writer = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*"MJPG"), 10, (80, 60))
+    for frame_n in range(30):
+        frame = np.full((60, 80, 3), 100, dtype=np.uint8)
+        frame[20:30, 10 + frame_n:20 + frame_n] = 250
+        if 10 <= frame_n < 15:
+            frame[40:56, 60:76] = 250
+        writer.write(frame)
+    writer.release()
+    background = np.full((60, 80), 100, dtype=np.uint8)
+
+    tracker(video_path, background, {'roi_0': (0, 0, 80, 60)}, threshold=35, display=False, area_size=10,
+            candidates=3)
+    track_path = glob.glob(video_path[0:-4] + "_tracks_*_roi-0.csv")[0]
+    _, track = load_track(track_path)
+    assert (track[10:15, 1] > 60).all()
+    candidates = load_candidates(candidates_file_name(track_path))
+    assert set(candidates[candidates["frame"] == 12]["rank"]) == {0, 1}
+    assert (candidates[candidates["rank"] == 0]["x"] == track[:, 1]).all()
+
+    _, cleaned = load_track(resolve_track_file(track_path, area_size=10, max_speed=10))
+    assert np.array_equal(cleaned[:, 0], track[:, 0])
+    assert (np.abs(cleaned[:, 1] - (np.arange(30) + 14.5)) <= 1).all()
+
+
+def test_threshold_calibration(tmp_path, capsys):
+    video_path = os.path.join(str(tmp_path), "20210101-120000_000_synthetic.mp4")
+    background, rois, _ = make_synthetic_video(video_path, n_frames=40, n_rois=2, width=160, height=120)
+    calibration = calibrate_threshold(video_path, background, dict(rois), area_size=50, n_samples=20)
+    # low thresholds pick up the noise of the video, the chosen one is in the range without noise blobs
+    assert calibration["rois"][0][10]["score"] < calibration["rois"][0][calibration["best"][0]]["score"]
+    assert calibration["rois"][0][calibration["best"][0]]["noise"] == 0
+    assert load_calibration(video_path)["best"] == calibration["best"]
+
+    calibrated_tracker(video_path, background, dict(rois), area_size=50, display=False)
+    assert len(glob.glob(video_path[0:-4] + "_tracks_*_Thresh_{}_*_roi-0.csv".format(calibration["best"][0]))) == 1
+
+    # rois with different calibrated thresholds are each tracked with their own
+    calibration["best"] = {0: 25, 1: 45}
+    with open(calibration_file_name(video_path), "w") as file:
+        yaml.dump(calibration, file)
+    assert calibrated_tracker(video_path, background, dict(rois), area_size=50, display=False) == {0: 25, 1: 45}
+    assert len(glob.glob(video_path[0:-4] + "_tracks_*_Thresh_25_*_roi-0.csv")) == 1
+    assert len(glob.glob(video_path[0:-4] + "_tracks_*_Thresh_45_*_roi-1.csv")) == 1
+
+
+    # a batch with a job per roi calibrates the video once, both rois end up in the calibration file
+    os.remove(calibration_file_name(video_path))
+    background_path = video_path[0:-4] + "_per90_background.png"
+    cv2.imwrite(background_path, background)
+    jobs = make_track_jobs([video_path], [background_path], dict(rois), threshold="auto", area_size=50)
+    capsys.readouterr()
+    track_videos_parallel(jobs, n_workers=1)
+    assert capsys.readouterr().out.count("calibrating the threshold") == 1
+    assert sorted(load_calibration(video_path)["best"]) == [0, 1]
+
+    # a calibration made with another background isn't used
+    calibrated_thresholds(video_path, background + 1, dict(rois), [0], area_size=50)
+    assert "another background" in capsys.readouterr().out
+
+
+def test_frame_store(test_video):
+    video_path, background_path = test_video
+    background = cv2.imread(background_path, 0)
+    rois = {'roi_0': (4, 10, 36, 40), 'roi_1': (40, 10, 36, 40), 'cam_ID': 'na'}
+    tracker(video_path, background, dict(rois), threshold=35, display=False, area_size=10, split_range=[5, 25],
+            roi_nums=[0])
+    filename = glob.glob(video_path[0:-4] + "_tracks_*_Range00005-00025_.csv")[0]
+    opencv = np.loadtxt(filename, delimiter=",")
+    opencv_background = background_vid(video_path, 2, 90, display=False)
+
+    build_frame_store(video_path)
+    store = open_video(video_path, "store")
+    assert isinstance(store, FrameCacheCapture)
+    cap = cv2.VideoCapture(video_path)
+    cap.set(cv2.CAP_PROP_POS_FRAMES, 17)
+    store.set(cv2.CAP_PROP_POS_FRAMES, 17)
+    assert np.array_equal(store.read()[1], cv2.cvtColor(cap.read()[1], cv2.COLOR_BGR2GRAY))
+    cap.release()
+    tracker(video_path, background, dict(rois), threshold=35, display=False, area_size=10, split_range=[5, 25],
+            roi_nums=[0], video_reader="store")
+    assert np.array_equal(np.loadtxt(filename, delimiter=","), opencv, equal_nan=True)
+    assert np.array_equal(background_vid(video_path, 2, 90, display=False, video_reader="store"), opencv_background)
+
+    # a store cropped to roi_1 is only used for crops inside it
+    remove_frame_store(video_path)
+    build_frame_store(video_path, rois, roi_nums=[1])
+    assert open_video(video_path, "store", crop=(40, 10, 36, 40)).crop == (40, 10, 36, 40)
+    assert not isinstance(open_video(video_path, "store"), FrameCacheCapture)
+    tracker(video_path, background, dict(rois), threshold=35, display=False, area_size=10, roi_nums=[1])
+    filename = glob.glob(video_path[0:-4] + "_tracks_*_roi-1.csv")[0]
+    opencv = np.loadtxt(filename, delimiter=",")
+    tracker(video_path, background, dict(rois), threshold=35, display=False, area_size=10, roi_nums=[1],
+            video_reader="store")
+    assert np.array_equal(np.loadtxt(filename, delimiter=","), opencv, equal_nan=True)
+
+
+def test_frame_cache_capture():
+    frames = np.arange(5 * 2 * 3, dtype=np.uint8).reshape(5, 2, 3)
+    cap = FrameCacheCapture(frames, start=10)
+    # positions outside the cache are clamped, reading past the last frame fails but the capture stays opened
+    assert cap.set(cv2.CAP_PROP_POS_FRAMES, -3) and cap.get(cv2.CAP_PROP_POS_FRAMES) == 10
+    assert np.array_equal(cap.read()[1], frames[0])
+    cap.set(cv2.CAP_PROP_POS_FRAMES, 14)
+    assert np.array_equal(cap.read()[1], frames[4])
+    assert cap.isOpened() and cap.read() == (False, None) and not cap.grab()
+    cap.set(cv2.CAP_PROP_POS_FRAMES, 100)
+    assert cap.get(cv2.CAP_PROP_POS_FRAMES) == 15 and cap.isOpened()
+    cap.set(cv2.CAP_PROP_POS_FRAMES, 13)
+    assert cap.grab() and np.array_equal(cap.read()[1], frames[4])
+    cap.release()
+    assert not cap.isOpened() and cap.read() == (False, None)
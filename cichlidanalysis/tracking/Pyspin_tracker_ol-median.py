@@ -17,6 +17,7 @@ from tkinter.filedialog import askdirectory
 from tkinter import *
 
 from cichlidanalysis.io.meta import load_yaml
+from cichlidanalysis.tracking.track_log import new_track_log, log_roi_frame, print_track_summary
 
 # Allows a user to select a directory
 root = Tk()
@@ -198,6 +199,8 @@ for roi in range(0, len(rois) - 1):
 end_time = datetime.datetime.now() + datetime.timedelta(hours=params["tot_hours"])
 
 problem = 0
+# counts the frames without a fish per roi, reported every few seconds and summarised for each movie chunk
+track_log = new_track_log()
 # Start the loop
 while 1 + params["fps"] * params["tot_hours"] * 60 * 60 > frame_id:
     try:
@@ -284,15 +287,16 @@ while 1 + params["fps"] * params["tot_hours"] * 60 * 60 > frame_id:
                 cX.append(int(M["m10"] / M["m00"]))
                 cY.append(int(M["m01"] / M["m00"]))
                 data[roi].append((frame_timestamp, cX[roi], cY[roi], area))
+                log_roi_frame(track_log, roi, frame_id, n_blobs=len(contours))
             else:
-                # print("no large enough contour found for roi {}!".format(roi))
+                log_roi_frame(track_log, roi, frame_id, "small_contour", len(contours))
                 data[roi].append((frame_timestamp, np.nan, np.nan, np.nan))
                 contourOI_[-1] = False
                 contourOI.append(False)
                 cX.append(np.nan)
                 cY.append(np.nan)
         else:
-            print("no contour found for roi {}!".format(roi))
+            log_roi_frame(track_log, roi, frame_id, "no_contour", 0)
             data[roi].append((frame_timestamp, np.nan, np.nan, np.nan))
             contourOI_.append(False)
             contourOI.append(False)
@@ -345,6 +349,8 @@ while 1 + params["fps"] * params["tot_hours"] * 60 * 60 > frame_id:
     if frame_chunk == (params["filechunk"])*params["fps"]:
         frame_chunk = 0
         print("Saving a movie and data output")
+        print_track_summary(track_log, frame_id + 1)
+        track_log = new_track_log()
 
         for roi in range(0, len(rois) - 1):
             # saving out tracking data
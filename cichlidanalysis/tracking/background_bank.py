@@ -0,0 +1,138 @@
+# A background bank holds one background for every interval of a video (e.g. one per hour) so tracking can follow slow
+# changes of the scene (lighting, water level, sand) without splitting the video. The bank is made in one pass through
+# the video, each interval has its own streaming percentile estimator. The tracker (background_bank argument) uses the
+# background whose interval centre is nearest to each frame. Saved banks are keyed like the background cache (video
+# content hash, percentile, sampling step, sampling mode and video reader) plus the interval, so a changed video or
+# changed settings make a new bank instead of reusing a stale one.
+
+import os
+
+import cv2.cv2 as cv2
+import numpy as np
+
+from cichlidanalysis.io.ffmpeg_capture import open_video
+from cichlidanalysis.io.movies import sampled_frames
+from cichlidanalysis.tracking.background_cache import background_key, video_hash
+from cichlidanalysis.tracking.streaming_percentile import new_percentile_estimator, add_frame, estimator_percentile
+
+# an interval needs at least this many sampled frames for its own background, shorter ones are joined to the one before
+MIN_BANK_FRAMES = 5
+
+
+def bank_key(content_hash, interval_min, nth_frame, percentile, fps=None, sampling="auto", video_reader="opencv"):
+    """ Key of a saved bank, the background cache key of the whole video with the interval (and fps if given) added
+    >>> bank_key("ab", 60, 100, 90) == bank_key("ab", 60, 100, 90, sampling="seek")
+    True
+    >>> bank_key("ab", 60, 100, 90) == bank_key("ab", 60, 50, 90)
+    False
+    """
+    key = "{}_bank{}min".format(background_key(content_hash, None, percentile, nth_frame, sampling, video_reader),
+                                interval_min)
+    if fps is not None:
+        key = "{}_fps{}".format(key, fps)
+    return key
+
+
+def bank_file_name(video_path, key):
+    return "{}_{}_backgrounds.npz".format(video_path[0:-4], key)
+
+
+def build_background_bank(video_path, interval_min=60, nth_frame=100, percentile=90, fps=None, video_reader="opencv",
+                          sampling="auto", content_hash=None):
+    """ Makes a background from every nth_frame frame of each interval_min minutes of the video in one pass. fps
+    defaults to the fps of the video (10 if the video doesn't have it). An interval with less than MIN_BANK_FRAMES
+    sampled frames is joined to the interval before. The bank is saved next to the video under its bank_key,
+    content_hash (video_hash of the video) is computed if not given
+
+    :return: bank dict with "frame_ranges" ([start, end) of each background), "backgrounds", "percentile",
+    "nth_frame"
+    """
+    if content_hash is None:
+        content_hash = video_hash(video_path)
+    key = bank_key(content_hash, interval_min, nth_frame, percentile, fps, sampling, video_reader)
+    cap = open_video(video_path, video_reader)
+    if fps is None:
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        if not fps or fps <= 0:
+            fps = 10
+    interval = max(int(round(interval_min * 60 * fps)), 1)
+
+    frame_ranges, backgrounds = [], []
+    gathered_frames = new_percentile_estimator()
+    range_start = 0
+    last_frame = -1
+    for frame_n, gray in sampled_frames(cap, nth_frame, sampling=sampling):
+        if frame_n >= range_start + interval and gathered_frames["n"] >= MIN_BANK_FRAMES:
+            range_end = (frame_n // interval) * interval
+            frame_ranges.append([range_start, range_end])
+            backgrounds.append(estimator_percentile(gathered_frames, int(percentile)))
+            gathered_frames = new_percentile_estimator()
+            range_start = range_end
+        print("Frame {}".format(frame_n))
+        add_frame(gathered_frames, gray)
+        last_frame = frame_n
+    frame_count = max(int(cap.get(cv2.CAP_PROP_FRAME_COUNT)), last_frame + 1)
+    cap.release()
+
+    if gathered_frames["n"] >= MIN_BANK_FRAMES or not backgrounds:
+        if gathered_frames["n"] == 0:
+            raise ValueError("no frames could be read from {}".format(video_path))
+        frame_ranges.append([range_start, frame_count])
+        backgrounds.append(estimator_percentile(gathered_frames, int(percentile)))
+    else:
+        frame_ranges[-1][1] = frame_count
+
+    bank = {"frame_ranges": frame_ranges, "backgrounds": backgrounds, "percentile": int(percentile),
+            "nth_frame": int(nth_frame)}
+    save_background_bank(bank, bank_file_name(video_path, key))
+    return bank
+
+
+def save_background_bank(bank, bank_path):
+    np.savez_compressed(bank_path, frame_ranges=np.array(bank["frame_ranges"]),
+                        backgrounds=np.stack(bank["backgrounds"]), percentile=bank["percentile"],
+                        nth_frame=bank["nth_frame"])
+
+
+def load_background_bank(bank_path):
+    with np.load(bank_path) as data:
+        return {"frame_ranges": data["frame_ranges"].tolist(), "backgrounds": list(data["backgrounds"]),
+                "percentile": int(data["percentile"]), "nth_frame": int(data["nth_frame"])}
+
+
+def get_background_bank(video_path, interval_min=60, nth_frame=100, percentile=90, fps=None, video_reader="opencv",
+                        sampling="auto"):
+    """ Loads the saved bank of the video if there is one with the same video content, interval, percentile, step,
+    sampling and reader, otherwise builds it """
+    content_hash = video_hash(video_path)
+    bank_path = bank_file_name(video_path, bank_key(content_hash, interval_min, nth_frame, percentile, fps, sampling,
+                                                    video_reader))
+    if os.path.isfile(bank_path):
+        print("using saved background bank {}".format(bank_path))
+        return load_background_bank(bank_path)
+    return build_background_bank(video_path, interval_min, nth_frame, percentile, fps, video_reader, sampling,
+                                 content_hash)
+
+
+def nearest_background_index(frame_ranges, frame_ids):
+    """ Index of the background whose frame range centre is nearest to each frame
+    >>> nearest_background_index([[0, 100], [100, 200], [200, 250]], [0, 149, 151, 230]).tolist()
+    [0, 1, 1, 2]
+    """
+    centres = np.array([(start + end) / 2 for start, end in frame_ranges])
+    return np.searchsorted((centres[1:] + centres[:-1]) / 2, frame_ids, side="right")
+
+
+def banked_blob_finder(make_process_frame, backgrounds, frame_ranges):
+    """ Returns a function which takes a grayscale frame and its frame number and returns the blobs found with the
+    background nearest to the frame. make_process_frame(background) makes the blob finder for one background, they are
+    made when first needed"""
+    finders = dict()
+
+    def find_blobs_banked(gray, frame_id):
+        index = int(nearest_background_index(frame_ranges, frame_id))
+        if index not in finders:
+            finders[index] = make_process_frame(backgrounds[index])
+        return finders[index](gray)
+
+    return find_blobs_banked
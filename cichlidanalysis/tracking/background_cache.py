@@ -0,0 +1,134 @@
+# Cache of the backgrounds made from videos. Each background made through get_background (or stored with
+# store_background) gets a record in a background_cache folder next to the video, keyed by a hash of the video content,
+# the frame range, percentile, sampling step, sampling mode and video reader. The record says how the background was
+# made and where its png is, so asking again for the same background loads the png instead of decoding the video.
+# Records are one yaml file each, so parallel background jobs can add them at the same time.
+
+import datetime
+import glob
+import hashlib
+import os
+
+import cv2.cv2 as cv2
+import yaml
+
+from cichlidanalysis.tracking.backgrounds import background_vid
+from cichlidanalysis.quality_control.video_tools import background_vid_split
+
+CACHE_FOLDER = "background_cache"
+# the video hash covers the file size and blocks of this many bytes from the start, middle and end of the file
+HASH_BLOCK = 2 ** 20
+
+
+def video_hash(video_path):
+    """ sha1 of the size and the first, middle and last HASH_BLOCK bytes of the video file. Reading the whole of a
+    multi GB video would take longer than making most backgrounds, the sampled blocks change when the video is
+    re-encoded, cut or replaced"""
+    size = os.path.getsize(video_path)
+    sha = hashlib.sha1(str(size).encode())
+    with open(video_path, "rb") as file:
+        for offset in sorted({0, max(size // 2 - HASH_BLOCK // 2, 0), max(size - HASH_BLOCK, 0)}):
+            file.seek(offset)
+            sha.update(file.read(HASH_BLOCK))
+    return sha.hexdigest()
+
+
+def file_hash(path):
+    with open(path, "rb") as file:
+        return hashlib.sha1(file.read()).hexdigest()
+
+
+def background_key(content_hash, frame_range, percentile, nth_frame, sampling="auto", video_reader="opencv"):
+    """ Key of a background in the cache. "auto", "grab" and "seek" sampling take the same frames so share a key
+    >>> background_key("ab", None, 90, 200) == background_key("ab", None, 90, 200, "seek")
+    True
+    """
+    if frame_range is None:
+        range_name = "full"
+    else:
+        range_name = "{}-{}".format(int(frame_range[0]), int(frame_range[1]))
+    sampling = "stratified" if sampling == "stratified" else "regular"
+    return hashlib.sha1("{},{},{},{},{},{}".format(content_hash, range_name, int(percentile), int(nth_frame), sampling,
+                                                 video_reader).encode()).hexdigest()[0:16]
+
+
+def cache_record_name(video_path, key):
+    return os.path.join(os.path.split(os.path.abspath(video_path))[0], CACHE_FOLDER,
+                        "{}_{}.yaml".format(os.path.split(video_path)[1][0:-4], key))
+
+
+def cached_background(video_path, nth_frame, percentile, frame_range=None, sampling="auto", video_reader="opencv",
+                      content_hash=None):
+    """ Returns the cached background (grayscale) or None if there isn't one for these parameters """
+    if content_hash is None:
+        content_hash = video_hash(video_path)
+    record_path = cache_record_name(video_path, background_key(content_hash, frame_range, percentile, nth_frame,
+                                                               sampling, video_reader))
+    if not os.path.isfile(record_path):
+        return None
+    with open(record_path) as file:
+        record = yaml.load(file, Loader=yaml.FullLoader)
+    # the png can have been overwritten by a background made with other parameters
+    if record["video_hash"] != content_hash or not os.path.isfile(record["background_path"]) or \
+            file_hash(record["background_path"]) != record["background_hash"]:
+        return None
+    return cv2.imread(record["background_path"], 0)
+
+
+def store_background(video_path, background_path, nth_frame, percentile, frame_range=None, sampling="auto",
+                     video_reader="opencv", content_hash=None):
+    """ Adds a background which was saved at background_path to the cache """
+    if content_hash is None:
+        content_hash = video_hash(video_path)
+    record_path = cache_record_name(video_path, background_key(content_hash, frame_range, percentile, nth_frame,
+                                                               sampling, video_reader))
+    record = {"video_path": os.path.abspath(video_path), "video_hash": content_hash,
+              "background_path": os.path.abspath(background_path), "background_hash": file_hash(background_path),
+              "frame_range": None if frame_range is None else [int(frame_range[0]), int(frame_range[1])],
+              "percentile": int(percentile), "nth_frame": int(nth_frame), "sampling": sampling,
+              "video_reader": video_reader, "made": datetime.datetime.now().strftime("%Y%m%d-%H%M%S")}
+    os.makedirs(os.path.split(record_path)[0], exist_ok=True)
+    temp_path = record_path + ".tmp"
+    with open(temp_path, "w") as file:
+        yaml.dump(record, file)
+    os.replace(temp_path, record_path)
+
+
+def cached_background_records(video_path):
+    """ All cache records of the video (as dicts) whose background png is still the one which was cached, sorted by
+    frame range (full video backgrounds first)"""
+    records = []
+    for record_path in glob.glob(cache_record_name(video_path, "*")):
+        with open(record_path) as file:
+            record = yaml.load(file, Loader=yaml.FullLoader)
+        if record["video_path"] == os.path.abspath(video_path) and os.path.isfile(record["background_path"]) and \
+                file_hash(record["background_path"]) == record["background_hash"]:
+            records.append(record)
+    return sorted(records, key=lambda record: [-1] if record["frame_range"] is None else record["frame_range"])
+
+
+def get_background(video_path, nth_frame, percentile, frame_range=None, display=False, video_reader="opencv",
+                   sampling="auto"):
+    """ Returns the background of the video (or of frame_range [start, end) of it) from the cache, or makes it with
+    backgrounds.background_vid (video_tools.background_vid_split for a frame range) and adds it to the cache. Returns
+    [] if a frame range is too short to make a background, like background_vid_split"""
+    content_hash = video_hash(video_path)
+    background = cached_background(video_path, nth_frame, percentile, frame_range, sampling, video_reader,
+                                   content_hash)
+    if background is not None:
+        print("using cached background for {}".format(video_path))
+        return background
+
+    if frame_range is None:
+        background = background_vid(video_path, nth_frame, percentile, display, video_reader, sampling)
+        background_path = '{}_per{}_background.png'.format(video_path[0:-4], percentile)
+    else:
+        background = background_vid_split(video_path, nth_frame, percentile, frame_range, display=display,
+                                          video_reader=video_reader, sampling=sampling)
+        background_path = '{0}_per{1}_frame{2}-{3}_background.png'.format(video_path[0:-4], percentile,
+                                                                          str(frame_range[0]).zfill(5),
+                                                                          str(frame_range[1]).zfill(5))
+    if background is not None and len(background) > 0:
+        store_background(video_path, background_path, nth_frame, percentile, frame_range, sampling, video_reader,
+                         content_hash)
+    return background
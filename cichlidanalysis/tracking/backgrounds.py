@@ -1,55 +1,99 @@
 # This script holds functions for making a background image of a video
 
-import datetime
+import multiprocessing
 
-import numpy as np
 import cv2.cv2 as cv2
 import os
 import glob
 from tkinter.filedialog import askdirectory
 from tkinter import Tk
 
+from cichlidanalysis.io.ffmpeg_capture import open_video
+from cichlidanalysis.io.movies import sampled_frames
+from cichlidanalysis.tracking.streaming_percentile import new_percentile_estimator, add_frame, estimator_percentiles
 
-def background_vid(videofilepath, nth_frame, percentile):
-    """ (str, int, int, int)
-     This function will create a background image of the defined area"""
+
+def background_vid_percentiles(videofilepath, nth_frame, percentiles, display=True, video_reader="opencv",
+                               sampling="auto"):
+    """ (str, int, list, bool, str, str)
+     Same as background_vid but makes (and saves) one background for each of the percentiles from a single pass through
+     the video, returns a list of the backgrounds"""
     try:
-        cap = cv2.VideoCapture(videofilepath)
+        cap = open_video(videofilepath, video_reader)
     except:
         print("problem reading video file, check path")
         return
 
-    counter = 0
-    gatheredFramess = []
-    while (cap.isOpened()):
-        ret, frame = cap.read()
-        if frame is None:
-            break
-        if counter % nth_frame == 0:
-            print("Frame {}".format(counter))
-            image = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            # settings with Blur settings for the video loop
-            gatheredFramess.append(image)
-        counter += 1
-
-    background = np.percentile(gatheredFramess, int(percentile), axis=0).astype(dtype=np.uint8)
-    cv2.imshow('Calculated Background from {} percentile'.format(percentile), background)
-
-    # background = np.percentile(frameMedian, 90, axis=0).astype(dtype=np.uint8)
-    # cv2.imshow('Calculated background', background)
-
-    date = datetime.datetime.now().strftime("%Y%m%d")
-    vid_name = videofilepath[0:-4]
-    # vid_name = os.path.split(videofilepath)[1][0:-4]
-    # vid_folder_path = os.path.split(videofilepath)[0]
-    cv2.imwrite('{}_per{}_background.png'.format(vid_name, percentile), background)
+    gatheredFramess = new_percentile_estimator()
+    for counter, image in sampled_frames(cap, nth_frame, sampling=sampling):
+        print("Frame {}".format(counter))
+        add_frame(gatheredFramess, image)
+
+    backgrounds = estimator_percentiles(gatheredFramess, [int(percentile) for percentile in percentiles])
+    for percentile, background in zip(percentiles, backgrounds):
+        if display:
+            cv2.imshow('Calculated Background from {} percentile'.format(percentile), background)
+
+        # background = np.percentile(frameMedian, 90, axis=0).astype(dtype=np.uint8)
+        # cv2.imshow('Calculated background', background)
+
+        vid_name = videofilepath[0:-4]
+        # vid_name = os.path.split(videofilepath)[1][0:-4]
+        # vid_folder_path = os.path.split(videofilepath)[0]
+        cv2.imwrite('{}_per{}_background.png'.format(vid_name, percentile), background)
 
     cap.release()
-    cv2.destroyAllWindows()
-    return background
+    if display:
+        cv2.destroyAllWindows()
+    return backgrounds
+
+
+def background_vid(videofilepath, nth_frame, percentile, display=True, video_reader="opencv", sampling="auto"):
+    """ (str, int, int, int, bool, str, str)
+     This function will create a background image of the defined area. video_reader "ffmpeg" decodes straight to
+     grayscale with an ffmpeg pipe (see io/ffmpeg_capture.py). The sampled frames are kept in a streaming percentile
+     estimator so memory doesn't grow without limit for long videos. Only the sampled frames are retrieved, sampling
+     "seek" jumps straight to them, "stratified" takes a random frame out of every nth_frame frames (see
+     io.movies.sampled_frames)"""
+    backgrounds = background_vid_percentiles(videofilepath, nth_frame, [percentile], display, video_reader, sampling)
+    if backgrounds is None:
+        return
+    return backgrounds[0]
+
+
+def _background_vid_job(job):
+    """ Worker for backgrounds_parallel, builds (and saves) one background without display, unless it's in the
+    background cache (see tracking/background_cache.py). Returns the video path so
+    the (potentially large) background image isn't sent back to the main process"""
+    # imported here as background_cache builds on this module
+    from cichlidanalysis.tracking.background_cache import get_background
+
+    videofilepath, nth_frame, percentile = job
+    get_background(videofilepath, nth_frame, percentile, display=False)
+    return videofilepath
+
+
+def backgrounds_parallel(video_paths, nth_frame, percentile, n_workers=None):
+    """ Builds the background of each video in a pool of processes. Longest videos are started first so that short
+    videos fill in the gaps at the end. n_workers defaults to the number of cpus, n_workers=1 runs in this process"""
+    if n_workers is None:
+        n_workers = os.cpu_count()
+
+    video_paths = sorted(video_paths, key=os.path.getsize, reverse=True)
+    jobs = [(video_path, nth_frame, percentile) for video_path in video_paths]
+
+    if n_workers == 1 or len(jobs) < 2:
+        for job in jobs:
+            _background_vid_job(job)
+        return
+
+    # spawn instead of fork as OpenCV's thread pool doesn't survive being forked
+    with multiprocessing.get_context("spawn").Pool(min(n_workers, len(jobs))) as pool:
+        for done_path in pool.imap_unordered(_background_vid_job, jobs, chunksize=1):
+            print("background made for {}".format(done_path))
 
 
-def update_background(percentile):
+def update_background(percentile, n_workers=None):
     # Allows a user to select top directory
     root = Tk()
     root.withdraw()
@@ -61,5 +105,4 @@ def update_background(percentile):
     files = glob.glob("*.mp4")
     files.sort()
 
-    for video in files:
-        background_vid(os.path.join(rootdir, video), 200, percentile)
+    backgrounds_parallel([os.path.join(rootdir, video) for video in files], 200, percentile, n_workers=n_workers)
@@ -0,0 +1,212 @@
+# Runs offline tracking of many videos (and rois) in a pool of processes. Each (video, roi) is one job, jobs are
+# started longest video first so that the short videos fill in at the end. A journal file is kept in the video folder
+# so that an interrupted batch can be restarted and will skip the jobs which were already finished. The journal only
+# lives as long as one batch: it is removed once every job of the batch is finished, so running the batch again
+# retracks the videos.
+
+import os
+import multiprocessing
+
+import cv2.cv2 as cv2
+
+from cichlidanalysis.tracking.offline_tracker import tracker
+from cichlidanalysis.tracking.fused_tracking import background_and_track
+from cichlidanalysis.tracking.background_bank import get_background_bank
+from cichlidanalysis.tracking.background_cache import file_hash
+from cichlidanalysis.tracking.threshold_calibration import calibrated_thresholds, calibrated_tracker
+
+JOURNAL_NAME = "tracking_journal.txt"
+
+
+def make_track_jobs(video_paths, background_paths, rois, threshold=35, area_size=100, background_crop=None,
+                    split_rois=True, track_format="csv", nth_frame=200, percentile=90, bank_interval=0):
+    """ Makes the list of tracking jobs for the videos, background_paths must be in the same order as video_paths.
+    background_crop is a (x, y, w, h) roi used to crop the background if it was made from the full camera image. With
+    split_rois each roi of a video is its own job, otherwise all rois of a video are tracked together (one decode).
+    With background_paths=None the background of each video is remade (from every nth_frame frame at percentile)
+    right before it is tracked (see tracking/fused_tracking.py), all rois of a video are then one job. With
+    bank_interval > 0 (minutes) each video is tracked with a bank of backgrounds made from it, one every bank_interval
+    minutes (see tracking/background_bank.py), background_paths are then not used.
+
+    :param video_paths: list of video paths
+    :param background_paths: list of background image paths, one per video
+    :param rois: roi dictionary as loaded from the roi_file.yaml
+    :param threshold: tracking threshold, "auto" for the calibrated threshold of each roi (see
+        tracking/threshold_calibration.py)
+    :param area_size: minimum contour area
+    :param background_crop: (x, y, w, h) or None
+    :param split_rois: make a job for each roi
+    :param track_format: "csv" or "trk" (compressed binary)
+    :param nth_frame: frame step for remade backgrounds
+    :param percentile: percentile for remade backgrounds
+    :param bank_interval: minutes between the backgrounds of a background bank, 0 for no bank
+    :return: list of job dictionaries
+    """
+    if background_paths is None:
+        background_paths = [None] * len(video_paths)
+        split_rois = False
+    if len(video_paths) != len(background_paths):
+        raise ValueError("need one background path per video path")
+
+    roi_nums = [int(key.split("_")[1]) for key in rois if key.startswith("roi_")]
+    roi_nums.sort()
+    if split_rois:
+        roi_groups = [[roi] for roi in roi_nums]
+    else:
+        roi_groups = [roi_nums]
+
+    jobs = []
+    for video_path, background_path in zip(video_paths, background_paths):
+        for roi_group in roi_groups:
+            jobs.append({"video_path": video_path, "background_path": background_path,
+                         "background_crop": background_crop, "rois": rois, "roi_nums": roi_group,
+                         "threshold": threshold, "area_size": area_size, "track_format": track_format,
+                         "nth_frame": nth_frame, "percentile": percentile, "bank_interval": bank_interval})
+    return jobs
+
+
+def job_key(job):
+    """ Unique name of a job which is used in the journal: the full video path, rois, threshold, area and where the
+    background comes from (a bank, remade while tracking or the hash of the background file and its crop)
+    >>> job_key({"video_path": "/a/b_001_roi-0.mp4", "roi_nums": [0, 1], "threshold": 35, "area_size": 100,
+    ...          "background_path": None, "nth_frame": 200, "percentile": 90})
+    '/a/b_001_roi-0.mp4,0-1,35,100,fused-200-90'
+    """
+    if job.get("bank_interval", 0) > 0:
+        background = "bank-{}-{}-{}".format(job["bank_interval"], job["nth_frame"], job["percentile"])
+    elif job["background_path"] is None:
+        background = "fused-{}-{}".format(job["nth_frame"], job["percentile"])
+    else:
+        background = file_hash(job["background_path"])[0:16]
+        if job.get("background_crop") is not None:
+            background += "-crop-" + "-".join([str(int(i)) for i in job["background_crop"]])
+    return "{},{},{},{},{}".format(os.path.abspath(job["video_path"]), "-".join([str(i) for i in job["roi_nums"]]),
+                                   job["threshold"], job["area_size"], background)
+
+
+def load_journal(journal_path):
+    """ Returns the set of job keys which have finished """
+    if not os.path.isfile(journal_path):
+        return set()
+    with open(journal_path) as file:
+        return set(line.rstrip("\n") for line in file if line.strip())
+
+
+def add_to_journal(journal_path, key):
+    """ Appends a finished job to the journal, flushed straight away so it survives the batch being killed """
+    with open(journal_path, "a") as file:
+        file.write(key + "\n")
+        file.flush()
+        os.fsync(file.fileno())
+
+
+def order_jobs(jobs):
+    """ Longest processing time first: sorts jobs by the number of frames in the video (descending), which balances
+    the pool when there is a mix of long and short videos"""
+    n_frames = dict()
+    for job in jobs:
+        if job["video_path"] not in n_frames:
+            cap = cv2.VideoCapture(job["video_path"])
+            n_frames[job["video_path"]] = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            cap.release()
+    return sorted(jobs, key=lambda job: n_frames[job["video_path"]], reverse=True)
+
+
+def _job_background(job):
+    """ (background, background bank) a job is tracked with: the bank of jobs with a bank interval, otherwise the
+    background loaded from the background path (and cropped) """
+    if job.get("bank_interval", 0) > 0:
+        return None, get_background_bank(job["video_path"], job["bank_interval"], job["nth_frame"], job["percentile"])
+    background = cv2.imread(job["background_path"], 0)
+    crop = job["background_crop"]
+    if crop is not None:
+        background = background[crop[1]:crop[1] + crop[3], crop[0]:crop[0] + crop[2]]
+    return background, None
+
+
+def calibrate_jobs(jobs):
+    """ Calibrates the threshold of the rois of all jobs with threshold "auto" once per video and background before
+    the jobs run, so that the jobs of the rois of a video don't each calibrate and write the calibration file at the
+    same time. Jobs which remake the background while tracking are one job per video and calibrate themselves"""
+    groups = dict()
+    for job in jobs:
+        if job["threshold"] == "auto" and (job["background_path"] is not None or job.get("bank_interval", 0) > 0):
+            key = job_key(dict(job, roi_nums=[]))
+            groups.setdefault(key, (job, set()))[1].update(job["roi_nums"])
+    for job, roi_nums in groups.values():
+        background, bank = _job_background(job)
+        if bank is not None:
+            # the tracker calibrates with the first background of a bank
+            background = bank["backgrounds"][0]
+        rois = dict(job["rois"])
+        if len(rois) == 1:
+            rois['cam'] = 'unknown'
+        calibrated_thresholds(job["video_path"], background, rois, sorted(roi_nums), job["area_size"])
+
+
+def _run_track_job(job):
+    """ Worker which loads (and crops) the background and tracks the video for the rois of the job. A job which was
+    interrupted part way through continues from its last checkpoint. Jobs without a background path remake the
+    background while tracking, jobs with a bank interval use a background bank"""
+    if job["background_path"] is None and job.get("bank_interval", 0) <= 0:
+        background_and_track(job["video_path"], job["rois"], job["nth_frame"], job["percentile"], job["threshold"],
+                             job["area_size"], job["roi_nums"], resume=True, track_format=job["track_format"])
+        return job_key(job)
+
+    background, bank = _job_background(job)
+    if job["threshold"] == "auto":
+        calibrated_tracker(job["video_path"], background, dict(job["rois"]), area_size=job["area_size"],
+                           roi_nums=job["roi_nums"], background_bank=bank, display=False, resume=True,
+                           track_format=job["track_format"])
+    else:
+        tracker(job["video_path"], background, dict(job["rois"]), threshold=job["threshold"], display=False,
+                area_size=job["area_size"], roi_nums=job["roi_nums"], resume=True, track_format=job["track_format"],
+                background_bank=bank)
+    return job_key(job)
+
+
+def track_videos_parallel(jobs, n_workers=None, journal_path=None):
+    """ Tracks all jobs in a pool of processes. Jobs already in the journal (from an interrupted run of the same batch)
+    are skipped, the journal is removed once all jobs are finished. The journal defaults to tracking_journal.txt in the
+    folder of the first video. n_workers defaults to the number of cpus, n_workers=1 runs
+    the jobs one after another in this process.
+
+    :param jobs: list of jobs from make_track_jobs
+    :param n_workers: number of processes
+    :param journal_path: path of the journal file
+    :return: list of job keys which were tracked in this run
+    """
+    if not jobs:
+        return []
+
+    if journal_path is None:
+        journal_path = os.path.join(os.path.split(jobs[0]["video_path"])[0], JOURNAL_NAME)
+    if n_workers is None:
+        n_workers = os.cpu_count()
+
+    keys = [job_key(job) for job in jobs]
+    finished = load_journal(journal_path)
+    to_do = [job for job, key in zip(jobs, keys) if key not in finished]
+    if len(to_do) < len(jobs):
+        print("resuming batch, skipping {} finished jobs".format(len(jobs) - len(to_do)))
+    to_do = order_jobs(to_do)
+    calibrate_jobs(to_do)
+
+    tracked = []
+    if n_workers == 1 or len(to_do) < 2:
+        for job in to_do:
+            tracked.append(_run_track_job(job))
+            add_to_journal(journal_path, tracked[-1])
+    else:
+        # spawn instead of fork as OpenCV's thread pool doesn't survive being forked
+        with multiprocessing.get_context("spawn").Pool(min(n_workers, len(to_do))) as pool:
+            for key in pool.imap_unordered(_run_track_job, to_do, chunksize=1):
+                print("finished tracking job {}".format(key))
+                tracked.append(key)
+                add_to_journal(journal_path, key)
+
+    if set(keys) <= finished | set(tracked):
+        # the batch is done, a new run of it should track again
+        os.remove(journal_path)
+    print("Batch tracking finished, {} jobs tracked".format(len(tracked)))
+    return tracked
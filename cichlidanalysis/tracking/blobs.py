@@ -0,0 +1,194 @@
+# Blob detection backends for the offline tracker. Each backend finds the largest blob of a thresholded background
+# subtracted image and returns its contour (in roi coordinates) so the tracker can calculate the same area and
+# centroid whichever backend is used:
+# "contours": findContours over the roi and the largest contour by contourArea (original method)
+# "components": connectedComponentsWithStats over the roi, then contours only of the components which can still be the
+# largest (visited by bounding box size, which bounds the contour area)
+# "label_map": one connectedComponentsWithStats over all rois of the frame, components are assigned to rois with a
+# precomputed roi label map
+# "contours" is the default and the fastest on the masks of a normal threshold, where there are only a few blobs:
+# connectedComponentsWithStats alone takes about 10x as long as findContours on such a mask, so "components" and
+# "label_map" run at about 0.15x its frames/sec. They only pay off on noisy masks (low thresholds or noisy videos) with
+# hundreds of noise blobs, where each contour costs findContours more than a row of the stats table (about 2.5x faster).
+# compare_backends and benchmarks/run_benchmarks.py report both cases.
+
+import time
+
+import cv2.cv2 as cv2
+import numpy as np
+
+BLOB_BACKENDS = ("contours", "components", "label_map")
+
+
+def largest_contour(frame_delta, threshold):
+    """ Original method: finds all external contours of the thresholded image and returns the largest (by contour area)
+    and the number of contours found. Returns (None, 0) if there is no contour"""
+    image_thresholded = cv2.threshold(frame_delta, threshold, 255, cv2.THRESH_TOZERO)[1]
+    (contours, _) = cv2.findContours(image_thresholded, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if len(contours) == 0:
+        return None, 0
+    return max(contours, key=cv2.contourArea), len(contours)
+
+
+def largest_contours(frame_delta, threshold, k):
+    """ The k largest (by contour area, largest first) external contours of the thresholded image and the number of
+    contours found. The first is the contour largest_contour returns"""
+    image_thresholded = cv2.threshold(frame_delta, threshold, 255, cv2.THRESH_TOZERO)[1]
+    (contours, _) = cv2.findContours(image_thresholded, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    areas = [cv2.contourArea(contour) for contour in contours]
+    # stable sort, so equal areas keep the order max() in largest_contour picks from
+    order = sorted(range(len(contours)), key=lambda i: -areas[i])
+    return [contours[i] for i in order[0:k]], len(contours)
+
+
+def component_contour(labels, stats, component):
+    """ Contour of one labelled component, only the bounding box of the component is searched. Returned in the
+    coordinates of the labels image"""
+    x, y, w, h = stats[component, :4]
+    mask = (labels[y:y + h, x:x + w] == component).astype(np.uint8)
+    # pad so that components touching the edge of the crop are traced the same as in the full image
+    mask = cv2.copyMakeBorder(mask, 1, 1, 1, 1, cv2.BORDER_CONSTANT, value=0)
+    (contours, _) = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=(int(x) - 1,
+                                                                                                 int(y) - 1))
+    return max(contours, key=cv2.contourArea)
+
+
+def pick_component(labels, stats, components, offset=(0, 0)):
+    """ From the given component labels, returns the contour (shifted by -offset) with the largest contour area, which
+    is the blob largest_contour picks. Pixel count doesn't rank blobs by contour area (thin or hollow blobs), so the
+    components are visited by descending (w - 1) * (h - 1) of their bounding box, an upper bound of the contour area as
+    the contour runs through pixel centres, until the bound is below the best contour area found. Of equal areas the
+    component whose first pixel is last in raster order is picked, as findContours lists contours in reverse raster
+    order and max() keeps the first (labels are in the order of 2x2 blocks, so can't be used for this)"""
+    bounds = (stats[components, cv2.CC_STAT_WIDTH] - 1) * (stats[components, cv2.CC_STAT_HEIGHT] - 1)
+    contour, best = None, None
+    for i in np.argsort(-bounds, kind="stable"):
+        if best is not None and bounds[i] < best[0]:
+            break
+        component = components[i]
+        candidate = component_contour(labels, stats, component)
+        x, y, w = stats[component, cv2.CC_STAT_LEFT], stats[component, cv2.CC_STAT_TOP], stats[component,
+                                                                                             cv2.CC_STAT_WIDTH]
+        first_x = x + np.argmax(labels[y, x:x + w] == component)
+        key = (cv2.contourArea(candidate), y, first_x)
+        if best is None or key > best:
+            contour, best = candidate, key
+    if offset != (0, 0):
+        contour = contour - np.array(offset, dtype=contour.dtype)
+    return contour
+
+
+def largest_component(frame_delta, threshold):
+    """ Connected components version of largest_contour, returns the contour of the largest blob and the number of
+    blobs. Noise blobs only cost a row in the stats table instead of a contour each, so this is only faster than
+    largest_contour on noisy masks (see the top of this file)"""
+    mask = cv2.threshold(frame_delta, threshold, 255, cv2.THRESH_BINARY)[1]
+    n_labels, labels, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    if n_labels < 2:
+        return None, 0
+    return pick_component(labels, stats, np.arange(1, n_labels)), n_labels - 1
+
+
+def roi_label_map(shape, rois, roi_nums):
+    """ Makes an image of the frame shape where each pixel has the (roi number + 1) of the roi it is in, 0 outside of
+    the rois. Returns None if rois overlap or touch, as then blobs can't be assigned to one roi"""
+    label_map = np.zeros(shape[0:2], dtype=np.int32)
+    for roi in roi_nums:
+        x, y, w, h = rois["roi_" + str(roi)]
+        # include a 1 pixel border when checking, so touching rois are also found
+        if label_map[max(y - 1, 0):y + h + 1, max(x - 1, 0):x + w + 1].any():
+            return None
+        label_map[y:y + h, x:x + w] = roi + 1
+    return label_map
+
+
+def label_map_blobs(frame_delta_full, threshold, label_map, rois, roi_nums):
+    """ Labels the thresholded full frame once and returns a dictionary of roi: (contour, number of blobs), contours
+    are in the coordinates of each roi. Like largest_component only faster than the contours backend on noisy masks"""
+    mask = cv2.threshold(frame_delta_full, threshold, 255, cv2.THRESH_BINARY)[1]
+    mask[label_map == 0] = 0
+    n_labels, labels, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+
+    # the bounding box of a component is inside the roi rectangle, so its corner gives the roi
+    component_rois = label_map[stats[1:, cv2.CC_STAT_TOP], stats[1:, cv2.CC_STAT_LEFT]] - 1
+    blobs = dict()
+    for roi in roi_nums:
+        components = np.where(component_rois == roi)[0] + 1
+        if len(components) == 0:
+            blobs[roi] = (None, 0)
+        else:
+            curr_roi = rois["roi_" + str(roi)]
+            blobs[roi] = (pick_component(labels, stats, components, offset=(curr_roi[0], curr_roi[1])),
+                          len(components))
+    return blobs
+
+
+def find_blobs(frame_delta_full, threshold, rois, roi_nums, blob_backend="contours", label_map=None):
+    """ Finds the largest blob of each roi with the chosen backend, returns a dictionary of roi: (contour, number of
+    blobs). The contour is None if there is no blob"""
+    if blob_backend == "label_map":
+        return label_map_blobs(frame_delta_full, threshold, label_map, rois, roi_nums)
+
+    find_blob = largest_component if blob_backend == "components" else largest_contour
+    blobs = dict()
+    for roi in roi_nums:
+        # for the frame define an ROI and crop image
+        curr_roi = rois["roi_" + str(roi)]
+        frame_delta = frame_delta_full[curr_roi[1]:curr_roi[1] + curr_roi[3], curr_roi[0]:curr_roi[0] + curr_roi[2]]
+        blobs[roi] = find_blob(frame_delta, threshold)
+    return blobs
+
+
+def contour_centroid(contour):
+    """ Centroid of the convex hull of the contour, as used by the tracker """
+    moments = cv2.moments(cv2.convexHull(contour))
+    return int(moments["m10"] / moments["m00"]), int(moments["m01"] / moments["m00"])
+
+
+def compare_backends(video_path, background_full, rois, threshold=35, area_size=100, n_frames=1000,
+                     noisy_threshold=10):
+    """ Runs each backend on the same frames of the video and prints the frames/sec of the blob detection (decoding
+    is done once beforehand and not timed) and whether the blobs found are the same as with the contours backend.
+    This is done for clean masks (threshold) and for noisy masks (noisy_threshold, low enough to let the pixel noise
+    of the video through), as the fastest backend isn't the same for both.
+
+    :return: dictionary of "clean"/"noisy": backend: frames/sec
+    """
+    roi_nums = [int(key.split("_")[1]) for key in rois if key.startswith("roi_")]
+    cap = cv2.VideoCapture(video_path)
+    deltas = []
+    while len(deltas) < n_frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        deltas.append(cv2.absdiff(background_full, cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)))
+    cap.release()
+
+    label_map = roi_label_map(deltas[0].shape, rois, roi_nums)
+    if label_map is None:
+        print("rois touch, can't use the label_map backend")
+    regimes = dict()
+    for regime, regime_threshold in [("clean", threshold), ("noisy", noisy_threshold)]:
+        results = dict()
+        fps = dict()
+        for backend in BLOB_BACKENDS:
+            if backend == "label_map" and label_map is None:
+                continue
+            results[backend] = []
+            t0 = time.perf_counter()
+            for frame_delta in deltas:
+                blobs = find_blobs(frame_delta, regime_threshold, rois, roi_nums, backend, label_map)
+                for roi in roi_nums:
+                    contour, _ = blobs[roi]
+                    if contour is not None and cv2.contourArea(contour) > area_size:
+                        results[backend].append((cv2.contourArea(contour),) + contour_centroid(contour))
+                    else:
+                        results[backend].append((np.nan, np.nan, np.nan))
+            fps[backend] = len(deltas) / (time.perf_counter() - t0)
+
+        for backend in fps:
+            same = np.allclose(results[backend], results["contours"], equal_nan=True)
+            print("{} masks (threshold {}) {}: {:.1f} frames/sec ({:.2f}x), same blobs as contours: {}".format(
+                regime, regime_threshold, backend, fps[backend], fps[backend] / fps["contours"], same))
+        regimes[regime] = fps
+    return regimes
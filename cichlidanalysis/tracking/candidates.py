@@ -0,0 +1,115 @@
+# Candidate blobs: with tracker(candidates=k) the k largest blobs of each roi and frame are saved in a side file next to
+# the track, so when a reflection or debris was bigger than the fish the track can be fixed without decoding the video
+# again. The side file is raw records of CANDIDATE_DTYPE (frame, rank by area, centroid, area and bounding box in roi
+# coordinates). resolve_candidates picks the most plausible candidate of each frame from the previous position, a speed
+# limit and the area of the fish, resolve_track_file saves the result as the "_cleaned" version of the track (which is
+# loaded instead of the track, see io.tracks.get_latest_tracks).
+
+import os
+
+import cv2.cv2 as cv2
+import numpy as np
+
+from cichlidanalysis.io.tracks import read_track, save_track
+from cichlidanalysis.tracking.blobs import largest_contours, contour_centroid
+
+CANDIDATE_DTYPE = np.dtype([("frame", "<i4"), ("rank", "<i1"), ("x", "<i2"), ("y", "<i2"), ("area", "<i4"),
+                            ("bx", "<i2"), ("by", "<i2"), ("bw", "<i2"), ("bh", "<i2")])
+
+
+def candidates_file_name(track_path):
+    return track_path[0:-4] + "_candidates.bin"
+
+
+def candidate_records(frame_id, contours):
+    """ Records of the contours (largest first) of one roi and frame """
+    records = np.zeros(len(contours), dtype=CANDIDATE_DTYPE)
+    for rank, contour in enumerate(contours):
+        cx, cy = contour_centroid(contour)
+        bx, by, bw, bh = cv2.boundingRect(contour)
+        records[rank] = (frame_id, rank, cx, cy, int(round(cv2.contourArea(contour))), bx, by, bw, bh)
+    return records
+
+
+def append_candidates(candidates_path, records):
+    """ Appends a list of candidate record arrays to the side file, returns the size of the file afterwards """
+    with open(candidates_path, "ab") as file:
+        if records:
+            np.concatenate(records).tofile(file)
+    return os.path.getsize(candidates_path)
+
+
+def load_candidates(candidates_path):
+    return np.fromfile(candidates_path, dtype=CANDIDATE_DTYPE)
+
+
+def candidate_blob_finder(background_full, threshold, rois, roi_nums, k):
+    """ Returns a function which takes a grayscale frame and returns the dictionary of roi: (contour, number of blobs)
+    of blobs.find_blobs (with the "contours" backend) with an extra key "candidates" holding the k largest contours
+    of each roi """
+    def find_blobs_candidates(gray):
+        frame_delta_full = cv2.absdiff(background_full, gray)
+        blobs = {"candidates": dict()}
+        for roi in roi_nums:
+            x, y, w, h = rois["roi_" + str(roi)]
+            contours, n_blobs = largest_contours(frame_delta_full[y:y + h, x:x + w], threshold, k)
+            blobs[roi] = (contours[0] if contours else None, n_blobs)
+            blobs["candidates"][roi] = contours
+        return blobs
+
+    return find_blobs_candidates
+
+
+def resolve_candidates(candidates, n_frames, first_frame=0, area_size=0, max_speed=50, area_weight=1.0):
+    """ Picks one candidate per frame. Candidates smaller than area_size are ignored. The first pick is the largest
+    candidate, after that the candidate with the lowest cost: distance to the last picked position / max_speed plus
+    area_weight * the relative difference to the median area of the recent picks. Candidates further away than
+    max_speed per frame since the last pick aren't used, unless none are close, then the largest is taken (the fish
+    was lost).
+
+    :return: track rows (frame #, x, y, area) for frames first_frame to first_frame + n_frames, NaN where there is no
+    candidate
+    """
+    track = np.full([n_frames, 4], np.nan)
+    track[:, 0] = np.arange(first_frame, first_frame + n_frames)
+    candidates = candidates[candidates["area"] > area_size]
+    candidates = candidates[np.argsort(candidates["frame"], kind="stable")]
+    starts = np.searchsorted(candidates["frame"], track[:, 0], side="left")
+    ends = np.searchsorted(candidates["frame"], track[:, 0], side="right")
+
+    last_position, last_frame = None, None
+    recent_areas = []
+    for row in range(n_frames):
+        frame_candidates = candidates[starts[row]:ends[row]]
+        if len(frame_candidates) == 0:
+            continue
+        pick = np.argmax(frame_candidates["area"])
+        if last_position is not None:
+            distance = np.hypot(frame_candidates["x"].astype(float) - last_position[0],
+                                frame_candidates["y"].astype(float) - last_position[1])
+            reachable = distance <= max_speed * (track[row, 0] - last_frame)
+            if reachable.any():
+                ref_area = np.median(recent_areas)
+                cost = distance / max_speed + area_weight * np.abs(frame_candidates["area"] - ref_area) / ref_area
+                cost[~reachable] = np.inf
+                pick = np.argmin(cost)
+        chosen = frame_candidates[pick]
+        track[row, 1:4] = chosen["x"], chosen["y"], chosen["area"]
+        last_position, last_frame = (float(chosen["x"]), float(chosen["y"])), track[row, 0]
+        recent_areas = (recent_areas + [chosen["area"]])[-25:]
+    return track
+
+
+def resolve_track_file(track_path, area_size=0, max_speed=50, area_weight=1.0, first_frame=0):
+    """ Resolves the candidates of a track (rows are frames from first_frame, e.g. the start of a Range track) and
+    saves the track with the picked positions as {track}_cleaned (the first column of the track is kept). Returns the
+    cleaned track path """
+    track = read_track(track_path)
+    resolved = resolve_candidates(load_candidates(candidates_file_name(track_path)), track.shape[0], first_frame,
+                                  area_size, max_speed, area_weight)
+    resolved[:, 0] = track[:, 0]
+    changed = np.sum(~np.isclose(resolved[:, 1:3], track[:, 1:3], equal_nan=True).all(axis=1))
+    print("resolving candidates changed {} of {} frames".format(changed, track.shape[0]))
+    cleaned_path = track_path[0:-4] + "_cleaned" + track_path[-4:]
+    save_track(cleaned_path, resolved)
+    return cleaned_path
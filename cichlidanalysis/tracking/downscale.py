@@ -0,0 +1,134 @@
+# Resolution scaled tracking. The background and each frame are block averaged by a downscale factor before the
+# background subtraction, so thresholding and the blob search only see 1/factor^2 of the pixels. The contours found are
+# mapped back to full resolution roi coordinates, so the tracker calculates the centroid and area in full resolution
+# pixels as usual. compare_downscale reports how far the positions move from full resolution tracking for each factor.
+
+import time
+
+import cv2.cv2 as cv2
+import numpy as np
+
+from cichlidanalysis.tracking.blobs import find_blobs, contour_centroid
+
+
+def downsample(gray, factor):
+    """ Block average downsampling. Halving is done in steps as OpenCV's area resize is several times faster for a
+    factor of 2 than for larger factors"""
+    while factor > 1 and factor % 2 == 0:
+        gray = cv2.resize(gray, (gray.shape[1] // 2, gray.shape[0] // 2), interpolation=cv2.INTER_AREA)
+        factor //= 2
+    if factor == 1:
+        return gray
+    return cv2.resize(gray, (gray.shape[1] // factor, gray.shape[0] // factor), interpolation=cv2.INTER_AREA)
+
+
+def scale_rois(rois, factor):
+    """ Copy of the rois dictionary in the coordinates of a frame downsampled by factor
+    >>> scale_rois({'roi_0': (10, 5, 21, 40), 'cam_ID': 'a'}, 4)
+    {'roi_0': (2, 1, 5, 10), 'cam_ID': 'a'}
+    """
+    scaled = dict()
+    for key, value in rois.items():
+        if key.startswith("roi_"):
+            scaled[key] = (value[0] // factor, value[1] // factor, value[2] // factor, value[3] // factor)
+        else:
+            scaled[key] = value
+    return scaled
+
+
+def upscale_contour(contour, factor, full_roi, scaled_roi):
+    """ Maps a contour from the downsampled roi to the full resolution roi. Each downsampled pixel covers factor x
+    factor pixels, the contour goes through the middle of them. Returned as float32 (which contourArea and moments
+    accept) so the middle of an even block isn't rounded"""
+    offset = np.array([scaled_roi[0] * factor - full_roi[0] + (factor - 1) / 2,
+                       scaled_roi[1] * factor - full_roi[1] + (factor - 1) / 2], dtype=np.float32)
+    return contour.astype(np.float32) * factor + offset
+
+
+def downscaled_blob_finder(process_frame, factor, rois, roi_nums):
+    """ Wraps a blob finder which was set up with the downsampled background and scale_rois(rois, factor). Returns a
+    function which takes a full resolution grayscale frame and returns the blobs with the contours in full resolution
+    roi coordinates"""
+    scaled_rois = scale_rois(rois, factor)
+
+    def find_blobs_downscaled(gray):
+        blobs = process_frame(downsample(gray, factor))
+        for roi in roi_nums:
+            contour, n_blobs = blobs[roi]
+            if contour is not None:
+                blobs[roi] = (upscale_contour(contour, factor, rois["roi_" + str(roi)],
+                                              scaled_rois["roi_" + str(roi)]), n_blobs)
+        return blobs
+
+    return find_blobs_downscaled
+
+
+def _tracked(blobs, roi_nums, area_size):
+    tracked = []
+    for roi in roi_nums:
+        contour, _ = blobs[roi]
+        area = cv2.contourArea(contour) if contour is not None else 0
+        if area > area_size:
+            tracked.append(contour_centroid(contour) + (area,))
+        else:
+            tracked.append((np.nan, np.nan, np.nan))
+    return tracked
+
+
+def compare_downscale(video_path, background_full, rois, threshold=35, area_size=100, factors=(2, 3, 4, 6, 8),
+                      tolerance=2.0, n_frames=1000):
+    """ Tracks the same frames of the video at full resolution and downscaled by each factor (decoding is done once
+    beforehand and not timed) and prints the speed up, position error, area error and missed detections. Recommends the
+    largest factor whose 99th percentile position error is within tolerance pixels.
+
+    :return: (dictionary of factor: report dictionary, recommended factor)
+    """
+    roi_nums = [int(key.split("_")[1]) for key in rois if key.startswith("roi_")]
+    cap = cv2.VideoCapture(video_path)
+    frames = []
+    while len(frames) < n_frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+    cap.release()
+
+    t0 = time.perf_counter()
+    full = [_tracked(find_blobs(cv2.absdiff(background_full, gray), threshold, rois, roi_nums), roi_nums, area_size)
+            for gray in frames]
+    full_s = time.perf_counter() - t0
+    full = np.array(full, dtype=float)
+
+    reports = dict()
+    best = 1
+    for factor in factors:
+        scaled_background = downsample(background_full, factor)
+        scaled_rois = scale_rois(rois, factor)
+
+        def process_frame(gray):
+            return find_blobs(cv2.absdiff(scaled_background, gray), threshold, scaled_rois, roi_nums)
+        find_blobs_downscaled = downscaled_blob_finder(process_frame, factor, rois, roi_nums)
+
+        t0 = time.perf_counter()
+        scaled = [_tracked(find_blobs_downscaled(gray), roi_nums, area_size) for gray in frames]
+        scaled_s = time.perf_counter() - t0
+        scaled = np.array(scaled, dtype=float)
+
+        error = np.sqrt(((full[:, :, 0:2] - scaled[:, :, 0:2]) ** 2).sum(axis=2))
+        both = np.isfinite(error)
+        reports[factor] = {"speed_up": full_s / scaled_s,
+                           "mean_error": float(error[both].mean()) if both.any() else np.nan,
+                           "p99_error": float(np.percentile(error[both], 99)) if both.any() else np.nan,
+                           "area_error": float(np.mean(np.abs(scaled[:, :, 2] - full[:, :, 2])[both] /
+                                                       full[:, :, 2][both])) if both.any() else np.nan,
+                           "detection_mismatches": int((np.isnan(full[:, :, 0]) != np.isnan(scaled[:, :, 0])).sum())}
+        print("factor {}: {:.2f}x faster, position error mean {:.2f} 99th percentile {:.2f} pixels, area error {:.0%}, "
+              "{} roi frames where only one found the fish".format(factor, reports[factor]["speed_up"],
+                                                                    reports[factor]["mean_error"],
+                                                                    reports[factor]["p99_error"],
+                                                                    reports[factor]["area_error"],
+                                                                    reports[factor]["detection_mismatches"]))
+        if reports[factor]["p99_error"] <= tolerance and reports[factor]["detection_mismatches"] == 0:
+            best = max(best, factor)
+    print("largest factor with the position error within {} pixels: {}".format(tolerance, best))
+    return reports, best
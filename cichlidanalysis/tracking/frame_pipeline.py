@@ -0,0 +1,156 @@
+# Frame sources for the offline tracker. read_gray_frames decodes and processes frames one after another,
+# threaded_frames runs a decoder thread which fills a bounded queue and one or more worker threads which process the
+# frames (OpenCV releases the GIL while decoding and thresholding so these overlap). Results always come out in frame
+# order. With pass_frame_id=True process_frame is called with the frame number as well (process_frame(gray, frame #)).
+# The pipeline keeps counters so you can see whether decoding or processing is the bottleneck:
+# decode_stalls: times the decoder found the queue full (waiting for processing)
+# worker_stalls: times a worker found the queue empty (waiting for decoding)
+
+import queue
+import threading
+
+import cv2.cv2 as cv2
+
+# how long blocked threads wait before checking if the pipeline has been stopped
+POLL_S = 0.1
+
+
+def read_gray_frames(video, start_frame, end_frame):
+    """ Generator of (frame #, grayscale frame) from an opened video (already at start_frame) until end_frame (not
+    included) or the end of the video. Releases the video at the end"""
+    frame_id = start_frame
+    while video.isOpened():
+        if frame_id >= end_frame:
+            print("reached end of split range")
+            video.release()
+            break
+        ret, frame = video.read()
+        if not ret:
+            print("reached end of video")
+            video.release()
+            break
+        if frame.ndim == 3:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        yield frame_id, frame
+        frame_id += 1
+
+
+def _process(process_frame, gray, frame_id, pass_frame_id):
+    if pass_frame_id:
+        return process_frame(gray, frame_id)
+    return process_frame(gray)
+
+
+def sequential_frames(video, start_frame, end_frame, process_frame, pass_frame_id=False):
+    """ Generator of (frame #, grayscale frame, process_frame(grayscale frame)), decoding and processing in turn """
+    for frame_id, gray in read_gray_frames(video, start_frame, end_frame):
+        yield frame_id, gray, _process(process_frame, gray, frame_id, pass_frame_id)
+
+
+def new_pipeline_stats():
+    return {"frames": 0, "decode_stalls": 0, "worker_stalls": 0, "queue_depth_sum": 0, "queue_depth_max": 0}
+
+
+def print_pipeline_stats(stats, queue_size):
+    """ Summary of the counters of threaded_frames, with a hint about which stage is the bottleneck """
+    if stats["frames"] == 0:
+        return
+    mean_depth = stats["queue_depth_sum"] / stats["frames"]
+    print("pipeline: {} frames, mean queue depth {:.1f}/{} (max {}), decoder stalled {} times, workers stalled {} "
+          "times".format(stats["frames"], mean_depth, queue_size, stats["queue_depth_max"], stats["decode_stalls"],
+                         stats["worker_stalls"]))
+    if stats["decode_stalls"] > stats["worker_stalls"]:
+        print("processing is the bottleneck, more workers could help")
+    elif stats["worker_stalls"] > stats["decode_stalls"]:
+        print("decoding is the bottleneck")
+
+
+def _put(q, item, stop, stall_key=None, stats=None):
+    """ Puts an item on a bounded queue, counting a stall if it was full. Returns False if the pipeline stopped """
+    if stall_key is not None and q.full():
+        stats[stall_key] += 1
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=POLL_S)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _decoder(video, start_frame, end_frame, frame_queue, n_workers, stats, stop):
+    try:
+        for frame_id, gray in read_gray_frames(video, start_frame, end_frame):
+            depth = frame_queue.qsize()
+            stats["queue_depth_sum"] += depth
+            stats["queue_depth_max"] = max(stats["queue_depth_max"], depth)
+            if not _put(frame_queue, (frame_id, gray), stop, "decode_stalls", stats):
+                return
+            stats["frames"] += 1
+    finally:
+        # one end marker per worker
+        for _ in range(n_workers):
+            _put(frame_queue, None, stop)
+
+
+def _worker(frame_queue, result_queue, process_frame, stats, stop, pass_frame_id):
+    while not stop.is_set():
+        if frame_queue.empty():
+            stats["worker_stalls"] += 1
+        try:
+            item = frame_queue.get(timeout=POLL_S)
+        except queue.Empty:
+            continue
+        if item is None:
+            break
+        frame_id, gray = item
+        try:
+            result_queue.put((frame_id, gray, _process(process_frame, gray, frame_id, pass_frame_id)))
+        except Exception as error:
+            result_queue.put((frame_id, None, error))
+            break
+    result_queue.put(None)
+
+
+def threaded_frames(video, start_frame, end_frame, process_frame, n_workers=1, queue_size=32, stats=None,
+                    pass_frame_id=False):
+    """ Same output as sequential_frames, but decoding runs in its own thread feeding a queue of queue_size frames
+    which n_workers threads process. Results are put back into frame order. Pass a dict from new_pipeline_stats() as
+    stats to get the counters"""
+    if stats is None:
+        stats = new_pipeline_stats()
+    frame_queue = queue.Queue(maxsize=queue_size)
+    result_queue = queue.Queue()
+    stop = threading.Event()
+
+    threads = [threading.Thread(target=_decoder, args=(video, start_frame, end_frame, frame_queue, n_workers, stats,
+                                                       stop), daemon=True)]
+    for _ in range(n_workers):
+        threads.append(threading.Thread(target=_worker, args=(frame_queue, result_queue, process_frame, stats, stop,
+                                                                      pass_frame_id),
+                                        daemon=True))
+    for thread in threads:
+        thread.start()
+
+    # results arrive out of order from multiple workers, hold them until it's their turn
+    pending = dict()
+    next_frame = start_frame
+    workers_running = n_workers
+    try:
+        while workers_running > 0:
+            item = result_queue.get()
+            if item is None:
+                workers_running -= 1
+                continue
+            if isinstance(item[2], Exception):
+                raise item[2]
+            pending[item[0]] = item
+            while next_frame in pending:
+                yield pending.pop(next_frame)
+                next_frame += 1
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+        if video.isOpened():
+            video.release()
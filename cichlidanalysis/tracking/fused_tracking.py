@@ -0,0 +1,52 @@
+# Background making and tracking of a video in one call, with only one full decode. The background is made from the
+# sampled frames alone (seeking straight to them, see io.movies.sampled_frames, or taken from the background cache, see
+# tracking/background_cache.py) and the video is then tracked with it in one sequential read. So remaking the
+# background and retracking a video costs about one decode instead of two, without caching the decoded frames on disk
+# (which would take frames x height x width bytes per video, for every worker of a batch at the same time).
+# divided_retrack does the same chunk by chunk, making one background per chunk (like
+# quality_control.video_tools.background_vid_split) and one Range track file per chunk.
+
+from cichlidanalysis.tracking.offline_tracker import tracker
+from cichlidanalysis.tracking.background_cache import get_background
+from cichlidanalysis.tracking.threshold_calibration import calibrated_tracker
+
+
+def background_and_track(video_path, rois, nth_frame=200, percentile=90, threshold=35, area_size=100, roi_nums=None,
+                         sampling="auto", **tracker_kwargs):
+    """ Makes the background of the video from every nth_frame frame (saved and cached like
+    background_cache.get_background does) and tracks the video with it. threshold "auto" tracks each roi with its
+    calibrated threshold (see tracking/threshold_calibration.py). Other keyword arguments are passed to the tracker.
+
+    :return: the background
+    """
+    background = get_background(video_path, nth_frame, percentile, sampling=sampling)
+    if threshold == "auto":
+        calibrated_tracker(video_path, background, rois, area_size=area_size, roi_nums=roi_nums, display=False,
+                           **tracker_kwargs)
+    else:
+        tracker(video_path, background, dict(rois), threshold=threshold, display=False, area_size=area_size,
+                roi_nums=roi_nums, **tracker_kwargs)
+    return background
+
+
+def divided_retrack(video_path, rois, chunks, nth_frame=100, percentile=90, threshold=35, area_size=100,
+                    roi_nums=None, sampling="auto", **tracker_kwargs):
+    """ For each [start, end) range in chunks makes a background from every nth_frame frame of the range (saved and
+    cached like background_cache.get_background does) and tracks the range with it (saved as a Range track file like
+    tracker with split_range). Chunks with less than 5 sampled frames aren't tracked. Other keyword arguments are
+    passed to the tracker.
+
+    :return: list with the background of each chunk ([] for chunks which weren't tracked)
+    """
+    backgrounds = []
+    for start, end in chunks:
+        start, end = int(start), int(end)
+        background = get_background(video_path, nth_frame, percentile, [start, end], sampling=sampling)
+        if background is None or len(background) == 0:
+            print("not tracking range {}-{}".format(start, end))
+            backgrounds.append([])
+            continue
+        tracker(video_path, background, dict(rois), threshold=threshold, display=False, area_size=area_size,
+                split_range=[start, end], roi_nums=roi_nums, **tracker_kwargs)
+        backgrounds.append(background)
+    return backgrounds
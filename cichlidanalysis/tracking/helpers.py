@@ -7,7 +7,7 @@ import numpy as np
 from tkinter.filedialog import askdirectory
 from tkinter import Tk
 
-from cichlidanalysis.io.tracks import load_track, remove_tags
+from cichlidanalysis.io.tracks import load_track, remove_tags, save_track, glob_tracks
 
 
 def threshold_select(video_path, median_full, rois):
@@ -105,14 +105,14 @@ def threshold_select(video_path, median_full, rois):
 
 
 def exclude_tag_csv(orig_csv_path_i):
-    # check if old path exists
+    # check if old path exists (works for csv and trk tracks)
     if os.path.isfile(orig_csv_path_i):
-        if orig_csv_path_i[-12:] == "_exclude.csv":
+        if orig_csv_path_i[-12:-4] == "_exclude":
             print("there's already a exclude tag on this file: {}".format(orig_csv_path_i))
             return
         else:
             # make new path name
-            tagged_path = orig_csv_path_i[0:-4] + "_exclude.csv"
+            tagged_path = orig_csv_path_i[0:-4] + "_exclude" + orig_csv_path_i[-4:]
 
             # check if it already exists
             if os.path.isfile(tagged_path):
@@ -135,7 +135,7 @@ def copy_timestamps(orig_csv_path_i, new_csv_path_i):
 
         # save over
         os.makedirs(os.path.dirname(new_csv_path_i), exist_ok=True)
-        np.savetxt(new_csv_path_i, track_single_retracked, delimiter=",")
+        save_track(new_csv_path_i, track_single_retracked, timestamps=True)
     else:
         print("Timestamps already copied")
 
@@ -173,12 +173,12 @@ def correct_tags(retracking_date, vid_directory):
     video_files.sort()
 
     # find all csvs
-    all_files = glob.glob("*.csv")
+    all_files = glob_tracks("*")
     all_files.sort()
     all_files = remove_tags(all_files, remove=["meta.csv", "als.csv"])
 
     # find csvs with retracking date (which are the recent ones)
-    new_files = glob.glob("*_{}_*.csv".format(retracking_date))
+    new_files = glob_tracks("*_{}_*".format(retracking_date))
     new_files.sort()
 
     if len(new_files) == 0:
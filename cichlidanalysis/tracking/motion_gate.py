@@ -0,0 +1,135 @@
+# Motion gated tracking. Each frame is downsampled (averaging blocks of pixels, which also averages out the pixel
+# noise) and for each roi the change score is the largest difference to the downsampled roi of the last frame which
+# was fully tracked. If the score is below the tolerance nothing has moved, the blob of the last tracked frame is reused
+# and the frame is recorded as gated. The full thresholding and contour search only runs when there is motion or when
+# max_skip frames in a row have been gated (so slow changes like lighting drift are still picked up).
+
+import os
+import time
+
+import cv2.cv2 as cv2
+import numpy as np
+
+from cichlidanalysis.tracking.blobs import largest_contour, largest_component, find_blobs, contour_centroid
+from cichlidanalysis.tracking.downscale import downsample
+
+
+def gated_file_name(track_path):
+    """ Side file of a track which lists the frame numbers which were gated (one per line) """
+    return track_path[0:-4] + "_gated.txt"
+
+
+def append_gated_frames(gated_path, frames):
+    """ Appends frame numbers to the gated frames file, returns the size of the file afterwards """
+    with open(gated_path, "a") as file:
+        for frame_id in frames:
+            file.write("{}\n".format(int(frame_id)))
+    return os.path.getsize(gated_path)
+
+
+def load_gated_frames(gated_path):
+    return np.loadtxt(gated_path, dtype=int, ndmin=1)
+
+
+def small_roi(small, curr_roi, factor):
+    """ The part of the downsampled frame covering the roi """
+    x, y, w, h = curr_roi
+    return small[y // factor:(y + h) // factor, x // factor:(x + w) // factor]
+
+
+def new_gate_stats():
+    return {"gated": 0, "full": 0}
+
+
+def motion_gated_blob_finder(background_full, threshold, rois, roi_nums, tolerance=10, max_skip=25, factor=4,
+                             blob_backend="contours", stats=None):
+    """ Returns a function which takes a grayscale frame and returns the dictionary of roi: (contour, number of blobs)
+    of blobs.find_blobs with an extra key "gated" holding the rois which reused the last blob. Frames must be given in
+    order. stats (from new_gate_stats()) counts the gated and fully tracked roi frames"""
+    find_blob = largest_component if blob_backend in ["components", "label_map"] else largest_contour
+    if stats is None:
+        stats = new_gate_stats()
+    reference = dict()
+    last_blob = dict()
+    n_skipped = {roi: 0 for roi in roi_nums}
+
+    def find_blobs_gated(gray):
+        small = downsample(gray, factor)
+        blobs = {"gated": []}
+        for roi in roi_nums:
+            curr_roi = rois["roi_" + str(roi)]
+            small_gray = small_roi(small, curr_roi, factor)
+            if roi in reference and n_skipped[roi] < max_skip and \
+                    cv2.absdiff(small_gray, reference[roi]).max() <= tolerance:
+                blobs[roi] = last_blob[roi]
+                blobs["gated"].append(roi)
+                n_skipped[roi] += 1
+                stats["gated"] += 1
+                continue
+
+            x, y, w, h = curr_roi
+            blobs[roi] = find_blob(cv2.absdiff(background_full[y:y + h, x:x + w], gray[y:y + h, x:x + w]), threshold)
+            reference[roi] = small_gray.copy()
+            last_blob[roi] = blobs[roi]
+            n_skipped[roi] = 0
+            stats["full"] += 1
+        return blobs
+
+    return find_blobs_gated
+
+
+def _positions(blobs, roi_nums, area_size):
+    positions = []
+    for roi in roi_nums:
+        contour, _ = blobs[roi]
+        if contour is not None and cv2.contourArea(contour) > area_size:
+            positions.append(contour_centroid(contour))
+        else:
+            positions.append((np.nan, np.nan))
+    return positions
+
+
+def compare_motion_gate(video_path, background_full, rois, threshold=35, area_size=100, tolerance=10, max_skip=25,
+                        factor=4, n_frames=1000):
+    """ Accuracy report of motion gating: runs full tracking and motion gated tracking on the same frames of the video
+    (decoding is done once beforehand and not timed) and prints the fraction of gated roi frames, the speed up and how
+    far the gated positions are from the full tracking ones.
+
+    :return: dictionary with the gated fraction, speed up, mean and max position error (pixels) and the number of
+    roi frames where only one of the two found the fish
+    """
+    roi_nums = [int(key.split("_")[1]) for key in rois if key.startswith("roi_")]
+    cap = cv2.VideoCapture(video_path)
+    frames = []
+    while len(frames) < n_frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+    cap.release()
+
+    t0 = time.perf_counter()
+    full = [_positions(find_blobs(cv2.absdiff(background_full, gray), threshold, rois, roi_nums), roi_nums, area_size)
+            for gray in frames]
+    full_s = time.perf_counter() - t0
+
+    stats = new_gate_stats()
+    find_blobs_gated = motion_gated_blob_finder(background_full, threshold, rois, roi_nums, tolerance, max_skip,
+                                                factor, stats=stats)
+    t0 = time.perf_counter()
+    gated = [_positions(find_blobs_gated(gray), roi_nums, area_size) for gray in frames]
+    gated_s = time.perf_counter() - t0
+
+    full = np.array(full, dtype=float)
+    gated = np.array(gated, dtype=float)
+    error = np.sqrt(((full - gated) ** 2).sum(axis=2))
+    report = {"gated_fraction": stats["gated"] / max(stats["gated"] + stats["full"], 1),
+              "speed_up": full_s / gated_s,
+              "mean_error": float(np.nanmean(error)) if np.isfinite(error).any() else np.nan,
+              "max_error": float(np.nanmax(error)) if np.isfinite(error).any() else np.nan,
+              "detection_mismatches": int((np.isnan(full[:, :, 0]) != np.isnan(gated[:, :, 0])).sum())}
+    print("motion gate (tolerance {}, max skip {}, factor {}): {:.0%} of roi frames gated, {:.2f}x faster, position "
+          "error mean {:.2f} max {:.2f} pixels, {} roi frames where only one found the fish".format(
+            tolerance, max_skip, factor, report["gated_fraction"], report["speed_up"], report["mean_error"],
+            report["max_error"], report["detection_mismatches"]))
+    return report
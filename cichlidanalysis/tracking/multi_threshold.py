@@ -0,0 +1,193 @@
+# Tracking with several thresholds from one decode. Each frame is background subtracted once and the largest blob of
+# each roi is found for every threshold, giving one track file per threshold (named like the tracker names them). A
+# quality summary per threshold and roi shows which threshold to keep:
+# found: fraction of frames with a blob larger than area_size
+# multiple: fraction of frames with more than one blob (noise or reflections)
+# area_cv: coefficient of variation of the blob area (the fish should stay about the same size)
+# jumps: fraction of frames where the position jumps further than the jump threshold
+
+import datetime
+
+import cv2.cv2 as cv2
+import numpy as np
+import yaml
+
+from cichlidanalysis.io.movies import seek_to_frame
+from cichlidanalysis.tracking.blobs import largest_contour, contour_centroid
+from cichlidanalysis.tracking.frame_pipeline import sequential_frames
+from cichlidanalysis.tracking.offline_tracker import track_file_names, checkpoint_file_name, checkpoint_params, \
+    open_cropped_video, start_track_files, save_track_chunks, finish_track_files
+
+# position jumps (pixels per frame) counted in the summary, same as processing.remove_high_spd_xy
+JUMP_THRESHOLD = 200
+# tracker options multi_threshold_tracker accepts, only with these values (the full contour search of each roi)
+SUPPORTED_DEFAULTS = {"display": False, "blob_backend": "contours", "n_workers": 0, "search_window": 0,
+                      "motion_gate": 0, "downscale": 1, "candidates": 0, "background_bank": None}
+
+
+def multi_threshold_blobs(background_full, thresholds, rois, roi_nums):
+    """ Returns a function which takes a grayscale frame and returns a dictionary of (roi, threshold): (contour,
+    number of blobs), the frame is background subtracted once """
+    def find_blobs_thresholds(gray):
+        frame_delta_full = cv2.absdiff(background_full, gray)
+        blobs = dict()
+        for roi in roi_nums:
+            x, y, w, h = rois["roi_" + str(roi)]
+            frame_delta = frame_delta_full[y:y + h, x:x + w]
+            for threshold in thresholds:
+                blobs[(roi, threshold)] = largest_contour(frame_delta, threshold)
+        return blobs
+
+    return find_blobs_thresholds
+
+
+def new_quality_stats():
+    """ Running sums for the quality summary of a track, which is built chunk by chunk """
+    return {"frames": 0, "found": 0, "multiple": 0, "area_sum": 0.0, "area_sq_sum": 0.0, "jumps": 0,
+            "last_x": float("nan"), "last_y": float("nan")}
+
+
+def add_quality_chunk(stats, track, n_blobs, jump_threshold=JUMP_THRESHOLD):
+    """ Adds the rows of a chunk of a track (frame #, x, y, area) and the number of blobs found in each frame to the
+    running sums, jumps from the last row of the previous chunk are counted """
+    found = ~np.isnan(track[:, 1])
+    areas = track[found, 3]
+    x = np.concatenate([[stats["last_x"]], track[:, 1]])
+    y = np.concatenate([[stats["last_y"]], track[:, 2]])
+    stats["frames"] += int(track.shape[0])
+    stats["found"] += int(found.sum())
+    stats["multiple"] += int(np.sum(np.asarray(n_blobs) > 1))
+    stats["area_sum"] += float(areas.sum())
+    stats["area_sq_sum"] += float(np.sum(areas ** 2))
+    stats["jumps"] += int(np.sum(np.hypot(np.diff(x), np.diff(y)) > jump_threshold))
+    if track.shape[0] > 0:
+        stats["last_x"], stats["last_y"] = float(track[-1, 1]), float(track[-1, 2])
+    return stats
+
+
+def stats_quality(stats):
+    """ Quality summary from the running sums (see track_quality) """
+    n_frames = max(stats["frames"], 1)
+    area_cv = float("nan")
+    if stats["found"] > 1:
+        mean = stats["area_sum"] / stats["found"]
+        area_cv = float(np.sqrt(max(stats["area_sq_sum"] / stats["found"] - mean ** 2, 0)) / mean)
+    return {"frames": int(stats["frames"]), "found": float(stats["found"] / n_frames),
+            "multiple": float(stats["multiple"] / n_frames), "area_cv": area_cv,
+            "jumps": float(stats["jumps"] / n_frames)}
+
+
+def track_quality(track, n_blobs, jump_threshold=JUMP_THRESHOLD):
+    """ Quality summary of a track (rows of frame #, x, y, area) and the number of blobs found in each frame """
+    return stats_quality(add_quality_chunk(new_quality_stats(), track, n_blobs, jump_threshold))
+
+
+def quality_score(quality):
+    """ Single number to rank thresholds by, higher is better: frames found minus frames with several blobs and jumps,
+    with a small penalty for an unstable area
+    >>> quality_score({"found": 0.9, "multiple": 0.1, "area_cv": 0.2, "jumps": 0.0})
+    0.78
+    """
+    area_cv = quality["area_cv"] if not np.isnan(quality["area_cv"]) else 1
+    return round(quality["found"] - quality["multiple"] - quality["jumps"] - 0.1 * area_cv, 6)
+
+
+def print_threshold_summary(summary):
+    """ Table of the quality summary of each roi and threshold, marking the best threshold of each roi """
+    for roi in sorted(summary["rois"]):
+        best = summary["best"][roi]
+        for threshold in sorted(summary["rois"][roi]):
+            quality = summary["rois"][roi][threshold]
+            print("roi {} threshold {}: found {:.1%}, multiple blobs {:.1%}, area cv {:.2f}, jumps {:.1%}{}".format(
+                roi, threshold, quality["found"], quality["multiple"], quality["area_cv"], quality["jumps"],
+                " <- best" if threshold == best else ""))
+
+
+def multi_threshold_tracker(video_path, background_full, rois, thresholds, area_size=0, split_range=False,
+                            roi_nums=None, seek=True, chunk_size=3000, resume=False, track_format="csv",
+                            video_reader="opencv", video=None, **tracker_options):
+    """ Tracks the video for every threshold in thresholds from one decode, saving one track file per threshold and
+    roi and a quality summary next to them ({video}_tracks_{date}_Area_{area_size}_thresholds.yaml). The track files,
+    chunks, checkpoint (which also holds the running quality sums) and resuming work like offline_tracker.tracker and
+    the parameters are the same, tracker options which aren't supported raise a ValueError.
+
+    :return: summary dict with "rois" (roi: threshold: quality, see track_quality) and "best" (roi: best threshold)
+    """
+    unsupported = sorted(option for option, value in tracker_options.items()
+                         if option not in SUPPORTED_DEFAULTS or value != SUPPORTED_DEFAULTS[option])
+    if unsupported:
+        raise ValueError("multi-threshold tracking doesn't support the tracker options {}".format(unsupported))
+    if background_full is None:
+        raise ValueError("multi-threshold tracking needs a background (background banks aren't supported)")
+
+    print("tracking {} with thresholds {}".format(video_path, thresholds))
+    rois = dict(rois)
+    if len(rois) == 1:
+        rois['cam'] = 'unknown'
+    if roi_nums is None:
+        roi_nums = list(range(0, len(rois) - 1))
+    thresholds = [int(threshold) for threshold in thresholds]
+    date = datetime.datetime.now().strftime("%Y%m%d")
+    # the tracks are keyed by (roi, threshold) in the checkpoint
+    filenames = dict()
+    for threshold in thresholds:
+        for roi, filename in track_file_names(video_path, date, threshold, area_size, roi_nums, split_range,
+                                              track_format).items():
+            filenames[(roi, threshold)] = filename
+    params = dict(checkpoint_params(background_full, None, 0, 0, 0, 1, 0, track_format), thresholds=thresholds)
+    checkpoint_path = checkpoint_file_name(video_path, "-".join([str(threshold) for threshold in thresholds]),
+                                           area_size, roi_nums, split_range)
+
+    video, rois, (background_full, ) = open_cropped_video(video_path, rois, roi_nums, [background_full],
+                                                          video_reader, video)
+    if split_range is False:
+        split_range = [0, int(video.get(cv2.CAP_PROP_FRAME_COUNT)) + 1]
+    checkpoint = start_track_files(video_path, checkpoint_path, filenames, params, split_range[0], resume)
+    if "stats" not in checkpoint:
+        checkpoint["stats"] = {key: new_quality_stats() for key in filenames}
+    stats = checkpoint["stats"]
+
+    # preallocated chunk of each roi and threshold, written out when full
+    data = {key: np.full([chunk_size, 4], np.nan) for key in filenames}
+    n_blobs = {key: np.zeros(chunk_size, dtype=int) for key in filenames}
+    row = 0
+
+    def add_chunks_quality(n_rows):
+        for key, chunk in data.items():
+            add_quality_chunk(stats[key], chunk[0:n_rows], n_blobs[key][0:n_rows])
+
+    frame_id = checkpoint["next_frame"]
+    if not seek_to_frame(video, frame_id, exact=not seek):
+        print("video is shorter than the start of the split range")
+        video.release()
+    process_frame = multi_threshold_blobs(background_full, thresholds, rois, roi_nums)
+    for frame_id, gray, blobs in sequential_frames(video, frame_id, split_range[1], process_frame):
+        for key, (contour, n) in blobs.items():
+            data[key][row] = (frame_id, np.nan, np.nan, np.nan)
+            n_blobs[key][row] = n
+            if contour is not None:
+                area = cv2.contourArea(contour)
+                if area > area_size:
+                    cx, cy = contour_centroid(contour)
+                    data[key][row, 1:4] = cx, cy, area
+        row += 1
+        if row == chunk_size:
+            add_chunks_quality(row)
+            save_track_chunks(checkpoint_path, checkpoint, data, row, frame_id + 1)
+            row = 0
+        if frame_id % 500 == 0:
+            print("Frame {}".format(frame_id))
+
+    add_chunks_quality(row)
+    finish_track_files(checkpoint_path, checkpoint, data, row)
+    summary = {"thresholds": thresholds, "area_size": area_size, "rois": {roi: dict() for roi in roi_nums},
+               "best": dict()}
+    for roi in roi_nums:
+        for threshold in thresholds:
+            summary["rois"][roi][threshold] = stats_quality(stats[(roi, threshold)])
+        summary["best"][roi] = max(thresholds, key=lambda threshold: quality_score(summary["rois"][roi][threshold]))
+
+    with open("{}_tracks_{}_Area_{}_thresholds.yaml".format(video_path[0:-4], date, area_size), "w") as file:
+        yaml.dump(summary, file)
+    print_threshold_summary(summary)
+    return summary
@@ -5,94 +5,428 @@
 ##########
 
 import datetime
+import hashlib
 import os
 import time
 
 import cv2.cv2 as cv2
 import numpy as np
+import yaml
 
+from cichlidanalysis.io.movies import seek_to_frame
+from cichlidanalysis.io.ffmpeg_capture import open_video, rois_bounding_box, crop_rois
+from cichlidanalysis.io.tracks import append_track_chunk, finish_track, track_write_path
+from cichlidanalysis.tracking.blobs import BLOB_BACKENDS, roi_label_map, find_blobs, contour_centroid
+from cichlidanalysis.tracking.predictive import predictive_blob_finder, new_window_stats
+from cichlidanalysis.tracking.motion_gate import motion_gated_blob_finder, new_gate_stats, gated_file_name, \
+    append_gated_frames
+from cichlidanalysis.tracking.downscale import downsample, scale_rois, downscaled_blob_finder
+from cichlidanalysis.tracking.track_log import new_track_log, log_roi_frame, print_track_summary
+from cichlidanalysis.tracking.background_bank import nearest_background_index, banked_blob_finder
+from cichlidanalysis.tracking.candidates import candidate_blob_finder, candidates_file_name, candidate_records, \
+    append_candidates
+from cichlidanalysis.tracking.frame_pipeline import sequential_frames, threaded_frames, new_pipeline_stats, \
+    print_pipeline_stats
 
-def tracker(video_path, background_full, rois, threshold=5, display=True, area_size=0, split_range=False):
-    """ Function that takes a video path, a background file, rois, threshold and display switch. This then uses
-    background subtraction and centroid tracking to find the XZ coordinates of the largest contour. Saves out a csv file
-     with frame #, X, Y, contour area"""
 
+def track_file_names(video_path, date, threshold, area_size, roi_nums, split_range=False, track_format="csv"):
+    """ Returns a dictionary with the track file name (csv or trk) for each roi. Range files (split_range given) don't
+    have the roi number in the name, so only one roi can be tracked with a split_range"""
+    if split_range is not False and len(roi_nums) > 1:
+        raise ValueError("Range track files have no roi number in the name, track one roi at a time with a "
+                         "split_range (got rois {})".format(roi_nums))
+    filenames = dict()
+    for roi in roi_nums:
+        if split_range is False:
+            filenames[roi] = video_path[0:-4] + "_tracks_{}_Thresh_{}_Area_{}_roi-{}.{}".format(date, threshold,
+                                                                                                area_size, roi,
+                                                                                                track_format)
+        else:
+            range_s = str(split_range[0]).zfill(5)
+            range_e = str(split_range[1]).zfill(5)
+            filenames[roi] = video_path[0:-4] + "_tracks_{}_Thresh_{}_Area_{}_Range{}-{}_.{}".format(date, threshold,
+                                                                                                     area_size,
+                                                                                                     range_s, range_e,
+                                                                                                     track_format)
+    return filenames
+
+
+def checkpoint_file_name(video_path, threshold, area_size, roi_nums, split_range=False):
+    """ Name of the checkpoint record of a tracking run, it has no date so a run can be resumed on another day. It has
+    the roi numbers like the track files, so runs tracking other rois of the same video (e.g. the per roi jobs of
+    batch_tracking) each have their own checkpoint"""
+    rois = "-".join(str(roi) for roi in roi_nums)
+    if split_range is False:
+        return video_path[0:-4] + "_tracks_Thresh_{}_Area_{}_roi-{}_checkpoint.yaml".format(threshold, area_size, rois)
+    return video_path[0:-4] + "_tracks_Thresh_{}_Area_{}_Range{}-{}_roi-{}_checkpoint.yaml".format(
+        threshold, area_size, str(split_range[0]).zfill(5), str(split_range[1]).zfill(5), rois)
+
+
+def checkpoint_params(background_full, background_bank, search_window, motion_gate, max_skip, downscale, candidates,
+                      track_format):
+    """ What a tracking run has to match to be resumed from a checkpoint: a hash of the background (or of the
+    backgrounds and frames of the bank) and the tracking options which change the track files """
+    sha = hashlib.sha1()
+    if background_bank is not None:
+        sha.update(np.ascontiguousarray(background_bank["frame_ranges"]).tobytes())
+        for background in background_bank["backgrounds"]:
+            sha.update(np.ascontiguousarray(background).tobytes())
+    else:
+        sha.update(np.ascontiguousarray(background_full).tobytes())
+    return {"background": sha.hexdigest()[0:16], "search_window": int(search_window), "motion_gate": float(motion_gate),
+            "max_skip": int(max_skip), "downscale": int(downscale), "candidates": int(candidates),
+            "track_format": track_format}
+
+
+def load_checkpoint(checkpoint_path):
+    """ Loads a checkpoint record, returns an empty dict if there isn't one """
+    if not os.path.isfile(checkpoint_path):
+        return {}
+    with open(checkpoint_path) as file:
+        return yaml.load(file, Loader=yaml.FullLoader)
+
+
+def save_checkpoint(checkpoint_path, checkpoint):
+    """ Writes the checkpoint record to a temporary file and then replaces the old record, so a crash while saving
+    doesn't leave a broken checkpoint"""
+    temp_path = checkpoint_path + ".tmp"
+    with open(temp_path, "w") as file:
+        yaml.dump(checkpoint, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, checkpoint_path)
+
+
+def move_track_files(old, new):
+    """ Renames a track which is being written (see io.tracks.track_write_path) and its gated frames and candidates
+    side files """
+    paths = [(track_write_path(old), track_write_path(new)), (gated_file_name(old), gated_file_name(new)),
+             (candidates_file_name(old), candidates_file_name(new))]
+    for old_path, new_path in paths:
+        if os.path.isfile(old_path):
+            os.replace(old_path, new_path)
+
+
+def flush_track_chunk(filename, chunk):
+    """ Appends a chunk of the track (rows of frame #, X, Y, contour area) to the track file and returns the size of
+    the file afterwards (which is what's stored in the checkpoint)"""
+    try:
+        append_track_chunk(filename, chunk)
+    except OSError:
+        print("issue with saving,trying again")
+        time.sleep(2)
+        append_track_chunk(filename, chunk)
+    return os.path.getsize(track_write_path(filename))
+
+
+def start_track_files(video_path, checkpoint_path, filenames, params, start_frame, resume=False, side_files=None):
+    """ Starts the track files of a tracking run of video_path, filenames is a dict of key (the roi, or (roi,
+    threshold) for tracking/multi_threshold.py): track file name. With resume and a checkpoint at checkpoint_path for
+    the same keys, track files and params, the files are renamed to today's names and cut back to the sizes in the
+    checkpoint, otherwise empty files are started. side_files is a dict of the checkpoint entry holding the sizes of a
+    side file of each track: function naming the side file (e.g. "gated_sizes": motion_gate.gated_file_name)
+
+    :return: checkpoint record, tracking continues from its "next_frame"
+    """
+    if side_files is None:
+        side_files = dict()
+    checkpoint = load_checkpoint(checkpoint_path) if resume else {}
+    if checkpoint and (sorted(checkpoint["file_sizes"]) != sorted(filenames) or
+                       not all(os.path.isfile(track_write_path(checkpoint["filenames"][key])) for key in filenames)):
+        print("checkpoint doesn't match the rois or track files, not resuming")
+        checkpoint = {}
+    if checkpoint and checkpoint.get("params") != params:
+        print("checkpoint was made with another background or other tracking options ({} instead of {}), not "
+              "resuming".format(checkpoint.get("params"), params))
+        checkpoint = {}
+
+    if checkpoint:
+        # cut off anything written after the last checkpoint and continue from the next frame
+        print("resuming tracking from frame {}".format(checkpoint["next_frame"]))
+        if checkpoint["filenames"] != filenames:
+            # started on another day, the files get today's date so they are counted as the new tracks
+            print("renaming the resumed track files to today's date")
+            for key in filenames:
+                move_track_files(checkpoint["filenames"][key], filenames[key])
+            checkpoint["filenames"] = filenames
+        for key in filenames:
+            os.truncate(track_write_path(filenames[key]), checkpoint["file_sizes"][key])
+            for sizes, side_file_name in side_files.items():
+                side_path = side_file_name(filenames[key])
+                if os.path.isfile(side_path):
+                    os.truncate(side_path, checkpoint.get(sizes, {}).get(key, 0))
+                else:
+                    open(side_path, "w").close()
+        return checkpoint
+
+    for key in filenames:
+        os.makedirs(os.path.dirname(os.path.abspath(filenames[key])), exist_ok=True)
+        open(track_write_path(filenames[key]), "w").close()
+        for side_file_name in side_files.values():
+            open(side_file_name(filenames[key]), "w").close()
+    checkpoint = {"video_path": video_path, "filenames": filenames, "next_frame": start_frame,
+                  "file_sizes": {key: 0 for key in filenames}, "params": params}
+    for sizes in side_files:
+        checkpoint[sizes] = {key: 0 for key in filenames}
+    return checkpoint
+
+
+def save_track_chunks(checkpoint_path, checkpoint, chunks, n_rows, next_frame):
+    """ Appends the first n_rows of the chunk of each track (chunks is a dict of key: chunk, keyed like the filenames
+    of the checkpoint) and saves the checkpoint to continue from next_frame """
+    for key, chunk in chunks.items():
+        checkpoint["file_sizes"][key] = flush_track_chunk(checkpoint["filenames"][key], chunk[0:n_rows])
+    checkpoint["next_frame"] = next_frame
+    save_checkpoint(checkpoint_path, checkpoint)
+
+
+def finish_track_files(checkpoint_path, checkpoint, chunks, n_rows):
+    """ Appends the first n_rows of the last chunk of each track, finishes the track files and removes the checkpoint
+    """
+    for key, chunk in chunks.items():
+        flush_track_chunk(checkpoint["filenames"][key], chunk[0:n_rows])
+        finish_track(checkpoint["filenames"][key])
+    if os.path.isfile(checkpoint_path):
+        os.remove(checkpoint_path)
+
+
+def open_cropped_video(video_path, rois, roi_nums, backgrounds, video_reader="opencv", video=None):
+    """ Opens the video (unless an opened video is given) and moves the rois and the backgrounds into the coordinates
+    of its frames, which only cover the bounding box of the rois with a cropping reader (see io/ffmpeg_capture.py)
+
+    :return: video, rois, backgrounds
+    """
+    if video is None:
+        video = open_video(video_path, video_reader, crop=rois_bounding_box(rois, roi_nums))
+    crop = getattr(video, "crop", None)
+    if crop is not None:
+        backgrounds = [background[crop[1]:crop[1] + crop[3], crop[0]:crop[0] + crop[2]] for background in
+                       backgrounds]
+        rois = crop_rois(rois, crop)
+    return video, rois, backgrounds
+
+
+def tracker(video_path, background_full, rois, threshold=5, display=True, area_size=0, split_range=False,
+            roi_nums=None, seek=True, chunk_size=3000, resume=False, blob_backend="contours", n_workers=0,
+            queue_size=32, track_format="csv", search_window=0, motion_gate=0, max_skip=25,
+            video_reader="opencv", downscale=1, track_log=None, video=None, background_bank=None, candidates=0):
+    """ Tracks the largest blob of each roi by background subtraction and saves a track file per roi with frame #, X,
+    Y, contour area. The track is written every chunk_size frames together with a checkpoint, so an interrupted run
+    can be resumed. To track with several thresholds from one decode see tracking/multi_threshold.py, to track with
+    calibrated thresholds see tracking/threshold_calibration.calibrated_tracker.
+
+    :param video_path: video to track, with video given only used to name the track files
+    :param background_full: grayscale background of the full frame, not used with a background_bank
+    :param rois: roi dictionary as loaded from the roi_file.yaml
+    :param threshold: tracking threshold
+    :param display: show the thresholded frames while tracking
+    :param area_size: minimum contour area
+    :param split_range: [start, end) to only track part of the video (one roi at a time), False for all of it
+    :param roi_nums: rois to track, default all
+    :param seek: jump to the start of split_range, False grabs frames up to it (if seeking isn't frame accurate)
+    :param chunk_size: frames between writes of the track and the checkpoint
+    :param resume: continue an interrupted run from its checkpoint (made with the same background and options), the
+        resumed files are renamed to today's date
+    :param blob_backend: "contours", "components" or "label_map" (see tracking/blobs.py), all give the same track but
+        the others are only faster on noisy masks
+    :param n_workers: > 0 decodes in its own thread feeding n_workers tracking threads (see tracking/frame_pipeline.py)
+    :param queue_size: frames queued between the decoding and tracking threads
+    :param track_format: "csv" or "trk" (compressed binary, see io/tracks.py)
+    :param search_window: > 0 first searches +-search_window pixels around the predicted position (see
+        tracking/predictive.py)
+    :param motion_gate: > 0 keeps the last position of a roi while its image changes by no more than motion_gate grey
+        levels, listing the gated frames in a _gated.txt file (see tracking/motion_gate.py)
+    :param max_skip: most frames in a row the motion gate keeps a position
+    :param video_reader: "opencv", "ffmpeg" (cropped grayscale pipe, see io/ffmpeg_capture.py) or "store" (the
+        decoded-frame store, see io/frame_store.py), the tracks are the same
+    :param downscale: > 1 block averages the background and frames by that factor (see tracking/downscale.py)
+    :param track_log: dict from tracking.track_log.new_track_log() to get the counters of frames without a fish
+    :param video: already opened video to read the frames from (e.g. an io.frame_cache.FrameCacheCapture)
+    :param background_bank: bank from tracking.background_bank.get_background_bank, each frame is tracked with the
+        background nearest in time
+    :param candidates: k > 0 saves the k largest blobs of each roi and frame in a _candidates.bin file (see
+        tracking/candidates.py), not with motion_gate, search_window or downscale
+    :return: pipeline counters (see tracking/frame_pipeline.py)
+    """
     print("tracking {}".format(video_path))
 
     # As camera is often excluded, check here and buffer if not included
     if len(rois) == 1:
         rois['cam'] = 'unknown'
 
+    if roi_nums is None:
+        roi_nums = list(range(0, len(rois) - 1))
+    # checked before anything is opened
+    track_file_names(video_path, "", threshold, area_size, roi_nums, split_range, track_format)
+
+    params = checkpoint_params(background_full, background_bank, search_window, motion_gate, max_skip, downscale,
+                               candidates, track_format)
+
     # load video
-    video = cv2.VideoCapture(video_path)
+    backgrounds = list(background_bank["backgrounds"]) if background_bank is not None else [background_full]
+    video, rois, backgrounds = open_cropped_video(video_path, rois, roi_nums, backgrounds, video_reader, video)
+    background_full = backgrounds[0]
+    if background_bank is None:
+        backgrounds = None
 
     if display:
         # create display window
         cv2.namedWindow("Live thresholded")
         cv2.namedWindow("Live")
 
-    # as there can be multiple rois the writer, data and moviename are kept in lists
-    data = list()
-    frame_id = 0
-    for roi in np.arange(0, len(rois) - 1):
-        data.append(list())
+    # the blob search runs on the (possibly downscaled) track_background and track_rois
+    track_background, track_rois = background_full, rois
+    if downscale > 1:
+        track_background, track_rois = downsample(background_full, downscale), scale_rois(rois, downscale)
+
+    if blob_backend not in BLOB_BACKENDS:
+        raise ValueError("blob_backend must be one of {}".format(BLOB_BACKENDS))
+    label_map = None
+    if blob_backend == "label_map":
+        label_map = roi_label_map(track_background.shape, track_rois, roi_nums)
+        if label_map is None:
+            print("rois touch or overlap, using the components blob backend instead of label_map")
+            blob_backend = "components"
+
+    if display and n_workers > 0:
+        print("display only works without worker threads, tracking with n_workers=0")
+        n_workers = 0
+    if candidates and (motion_gate or search_window or downscale > 1):
+        print("candidates need the full contour search, tracking without motion gating, search window and downscale")
+        motion_gate, search_window, downscale = 0, 0, 1
+        track_background, track_rois = background_full, rois
+    if motion_gate and search_window:
+        print("motion gating and the search window can't be combined, tracking without the search window")
+        search_window = 0
+    if (search_window or motion_gate) and n_workers > 1:
+        print("the search window and motion gating need frames in order, tracking with n_workers=1")
+        n_workers = 1
+
+    # as there can be multiple rois the data is kept in a dictionary with the roi number as key, each roi has a
+    # preallocated chunk which is written out when full
+    data = dict()
+    for roi in roi_nums:
+        data[roi] = np.full([chunk_size, 4], np.nan)
+    row = 0
+    gated_frames = {roi: [] for roi in roi_nums}
+    candidate_rows = {roi: [] for roi in roi_nums}
+
+    date = datetime.datetime.now().strftime("%Y%m%d")
+    filenames = track_file_names(video_path, date, threshold, area_size, roi_nums, split_range, track_format)
+    checkpoint_path = checkpoint_file_name(video_path, threshold, area_size, roi_nums, split_range)
 
     if split_range is False:
         total = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
         split_range = [0, total + 1]
-        split_name = False
+
+    side_files = dict()
+    if motion_gate:
+        side_files["gated_sizes"] = gated_file_name
+    if candidates:
+        side_files["candidate_sizes"] = candidates_file_name
+    checkpoint = start_track_files(video_path, checkpoint_path, filenames, params, split_range[0], resume, side_files)
+    start_frame = checkpoint["next_frame"]
+
+    frame_id = 0
+    if seek_to_frame(video, start_frame, exact=not seek):
+        frame_id = start_frame
     else:
-        split_name = True
-
-    while video.isOpened():
-        ret, frame = video.read()
-        if not ret:
-            print("reached end of video")
-            video.release()
-            break
-        if frame_id in np.arange(split_range[0], split_range[1]):
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            frameDelta_full = cv2.absdiff(background_full, gray)
+        print("video is shorter than the start of the split range")
+        video.release()
+
+    window_stats = new_window_stats()
+    gate_stats = new_gate_stats()
 
+    def make_process_frame(background):
+        """ blob finder using the (full resolution, cropped) background """
+        finder_background = downsample(background, downscale) if downscale > 1 else background
+        if candidates:
+            finder = candidate_blob_finder(finder_background, threshold, track_rois, roi_nums, candidates)
+        elif motion_gate:
+            finder = motion_gated_blob_finder(finder_background, threshold, track_rois, roi_nums, motion_gate,
+                                              max_skip, blob_backend=blob_backend, stats=gate_stats)
+        elif search_window:
+            finder = predictive_blob_finder(finder_background, threshold, area_size / downscale ** 2, track_rois,
+                                            roi_nums, max(search_window // downscale, 1), blob_backend, window_stats)
+        else:
+            def finder(gray):
+                return find_blobs(cv2.absdiff(finder_background, gray), threshold, track_rois, roi_nums,
+                                  blob_backend, label_map)
+        if downscale > 1:
+            finder = downscaled_blob_finder(finder, downscale, rois, roi_nums)
+        return finder
+
+    if backgrounds is None:
+        process_frame = make_process_frame(background_full)
+    else:
+        # the stateful finders (motion gate, search window) start again when the background changes
+        process_frame = banked_blob_finder(make_process_frame, backgrounds, background_bank["frame_ranges"])
+        print("tracking with a bank of {} backgrounds".format(len(backgrounds)))
+
+    if track_log is None:
+        track_log = new_track_log()
+
+    pipeline_stats = new_pipeline_stats()
+    if n_workers > 0:
+        frames = threaded_frames(video, frame_id, split_range[1], process_frame, n_workers, queue_size,
+                                 pipeline_stats, pass_frame_id=backgrounds is not None)
+    else:
+        frames = sequential_frames(video, frame_id, split_range[1], process_frame,
+                                   pass_frame_id=backgrounds is not None)
+
+    for frame_id, gray, blobs in frames:
+        if split_range[0] <= frame_id < split_range[1]:
             # tracking
-            cx = list()
-            cy = list()
-            contourOI = list()
-            contourOI_ = list()
-            for roi in range(0, len(rois) - 1):
-                # for the frame define an ROI and crop image
-                curr_roi = rois["roi_" + str(roi)]
-                frameDelta = frameDelta_full[curr_roi[1]:curr_roi[1] + curr_roi[3],
-                             curr_roi[0]:curr_roi[0] + curr_roi[2]]
-                image_thresholded = cv2.threshold(frameDelta, threshold, 255, cv2.THRESH_TOZERO)[1]
-                (contours, _) = cv2.findContours(image_thresholded, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-                if len(contours) > 0:
-                    contourOI_.append(max(contours, key=cv2.contourArea))
+            cx = dict()
+            cy = dict()
+            contourOI_ = dict()
+            for roi in blobs.get("gated", []):
+                gated_frames[roi].append(frame_id)
+            for roi, contours in blobs.get("candidates", {}).items():
+                candidate_rows[roi].append(candidate_records(frame_id, contours))
+            for roi in roi_nums:
+                contour, n_blobs = blobs[roi]
+                if contour is not None:
+                    contourOI_[roi] = contour
                     area = cv2.contourArea(contourOI_[roi])
                     if area > area_size:
-                        contourOI.append(cv2.convexHull(contourOI_[roi]))
-                        M = cv2.moments(contourOI[roi])
-                        cx.append(int(M["m10"] / M["m00"]))
-                        cy.append(int(M["m01"] / M["m00"]))
-                        data[roi].append((frame_id, cx[roi], cy[roi], area))
+                        cx[roi], cy[roi] = contour_centroid(contourOI_[roi])
+                        data[roi][row] = (frame_id, cx[roi], cy[roi], area)
+                        log_roi_frame(track_log, roi, frame_id, n_blobs=n_blobs)
                     else:
-                        print("no large enough contour found for roi {}!".format(roi))
-                        data[roi].append((frame_id, np.nan, np.nan, np.nan))
-                        contourOI_[-1] = False
-                        contourOI.append(False)
-                        cx.append(np.nan)
-                        cy.append(np.nan)
+                        log_roi_frame(track_log, roi, frame_id, "small_contour", n_blobs)
+                        data[roi][row] = (frame_id, np.nan, np.nan, np.nan)
+                        contourOI_[roi] = False
+                        cx[roi] = np.nan
+                        cy[roi] = np.nan
                 else:
-                    print("no contour found for roi {}!".format(roi))
-                    data[roi].append((frame_id, np.nan, np.nan, np.nan))
-                    contourOI_.append(False)
-                    contourOI.append(False)
-                    cx.append(np.nan)
-                    cy.append(np.nan)
+                    log_roi_frame(track_log, roi, frame_id, "no_contour", n_blobs)
+                    data[roi][row] = (frame_id, np.nan, np.nan, np.nan)
+                    contourOI_[roi] = False
+                    cx[roi] = np.nan
+                    cy[roi] = np.nan
+
+            row += 1
+            if row == chunk_size:
+                for roi in roi_nums:
+                    if motion_gate:
+                        checkpoint["gated_sizes"][roi] = append_gated_frames(gated_file_name(filenames[roi]),
+                                                                             gated_frames[roi])
+                        gated_frames[roi] = []
+                    if candidates:
+                        checkpoint["candidate_sizes"][roi] = append_candidates(candidates_file_name(filenames[roi]),
+                                                                               candidate_rows[roi])
+                        candidate_rows[roi] = []
+                save_track_chunks(checkpoint_path, checkpoint, data, row, frame_id + 1)
+                row = 0
 
             if frame_id % 500 == 0:
                 print("Frame {}".format(frame_id))
             if display:
+                if backgrounds is not None:
+                    background_full = backgrounds[int(nearest_background_index(background_bank["frame_ranges"],
+                                                                               frame_id))]
+                frameDelta_full = cv2.absdiff(background_full, gray)
                 full_image_thresholded = (cv2.threshold(frameDelta_full, threshold, 255, cv2.THRESH_TOZERO)[1])
                 # Live display of full resolution and ROIs
                 cv2.putText(full_image_thresholded, "Framenum: {}".format(frame_id), (30,
@@ -100,7 +434,7 @@ def tracker(video_path, background_full, rois, threshold=5, display=True, area_s
                                                                                       30), cv2.FONT_HERSHEY_SIMPLEX,
                             fontScale=0.5, color=255)
 
-                for roi in range(0, len(rois) - 1):
+                for roi in roi_nums:
                     if np.all(contourOI_[roi] != False):
                         curr_roi = rois["roi_" + str(roi)]
                         # add in contours
@@ -117,37 +451,28 @@ def tracker(video_path, background_full, rois, threshold=5, display=True, area_s
                 cv2.waitKey(1)
 
                 if cv2.waitKey(1) & 0xFF == ord('q'):
+                    video.release()
                     break
 
-        frame_id += 1
-
-    # saving data
+    # saving the last chunk of data
     print("Saving data output")
-    date = datetime.datetime.now().strftime("%Y%m%d")
+    for roi in roi_nums:
+        if motion_gate:
+            append_gated_frames(gated_file_name(filenames[roi]), gated_frames[roi])
+        if candidates:
+            append_candidates(candidates_file_name(filenames[roi]), candidate_rows[roi])
+    finish_track_files(checkpoint_path, checkpoint, data, row)
 
-    for roi in range(0, len(rois) - 1):
-        datanp = np.array(data[roi])
-        if split_name is False:
-            filename = video_path[0:-4] + "_tracks_{}_Thresh_{}_Area_{}_roi-{}.csv".format(date, threshold, area_size,
-                                                                                           roi)
-        else:
-            range_s = str(split_range[0]).zfill(5)
-            range_e = str(split_range[1]).zfill(5)
-            filename = video_path[0:-4] + "_tracks_{}_Thresh_{}_Area_{}_Range{}-{}_.csv".format(date, threshold,
-                                                                                                area_size, range_s,
-                                                                                                range_e)
-        os.makedirs(os.path.dirname(filename), exist_ok=True)
-        try:
-            # os.path.isdir(os.path.dirname(filename))
-            np.savetxt(filename, datanp, delimiter=",")
-        except:
-            print("issue with saving,trying again")
-            time.sleep(2)
-            os.path.isdir(os.path.dirname(filename))
-            try:
-                np.savetxt(filename, datanp, delimiter=",")
-            except:
-                print('trying to save after 2s failed')
+    print_track_summary(track_log, frame_id + 1)
+    if n_workers > 0:
+        print_pipeline_stats(pipeline_stats, queue_size)
+    if search_window:
+        print("search window: {} roi frames found in the window, {} full roi searches".format(window_stats["window"],
+                                                                                           window_stats["full"]))
+    if motion_gate:
+        print("motion gate: {} roi frames gated, {} fully tracked".format(gate_stats["gated"], gate_stats["full"]))
 
     print("Tracking finished on video cleaning up")
-    cv2.destroyAllWindows()
+    if display:
+        cv2.destroyAllWindows()
+    return pipeline_stats
@@ -0,0 +1,94 @@
+# Predictive search window tracking. The next position of the fish is predicted from its last two centroids (constant
+# velocity) and only a window around the prediction is background subtracted and searched. If no blob is found in the
+# window, the blob is too small or it touches the edge of the window (so it may be cut off) the whole roi is searched.
+
+import cv2.cv2 as cv2
+import numpy as np
+
+from cichlidanalysis.tracking.blobs import largest_contour, largest_component, contour_centroid
+
+
+def predict_position(history):
+    """ Constant velocity prediction from the last (up to) two centroids
+    >>> predict_position([(10, 20)])
+    (10, 20)
+    >>> predict_position([(10, 20), (13, 18)])
+    (16, 16)
+    """
+    if len(history) == 1:
+        return history[-1]
+    return 2 * history[-1][0] - history[-2][0], 2 * history[-1][1] - history[-2][1]
+
+
+def window_bounds(prediction, half_window, roi_width, roi_height):
+    """ (x0, y0, x1, y1) of the search window around the prediction, clipped to the roi
+    >>> window_bounds((10, 50), 20, 100, 60)
+    (0, 30, 31, 60)
+    """
+    x0 = int(min(max(prediction[0] - half_window, 0), roi_width))
+    y0 = int(min(max(prediction[1] - half_window, 0), roi_height))
+    x1 = int(min(max(prediction[0] + half_window + 1, 0), roi_width))
+    y1 = int(min(max(prediction[1] + half_window + 1, 0), roi_height))
+    return x0, y0, x1, y1
+
+
+def confident_in_window(contour, area_size, bounds, roi_width, roi_height):
+    """ A blob found in the window is only used if it is large enough and doesn't touch an edge of the window which
+    is inside the roi (if it does the fish probably continues outside of the window)"""
+    if cv2.contourArea(contour) <= area_size:
+        return False
+    x0, y0, x1, y1 = bounds
+    bx, by, bw, bh = cv2.boundingRect(contour)
+    if (bx == 0 and x0 > 0) or (by == 0 and y0 > 0):
+        return False
+    if (bx + bw == x1 - x0 and x1 < roi_width) or (by + bh == y1 - y0 and y1 < roi_height):
+        return False
+    return True
+
+
+def new_window_stats():
+    return {"window": 0, "full": 0}
+
+
+def predictive_blob_finder(background_full, threshold, area_size, rois, roi_nums, half_window,
+                           blob_backend="contours", stats=None):
+    """ Returns a function which takes a grayscale frame and returns the same dictionary of roi: (contour, number of
+    blobs) as blobs.find_blobs, but searches in a window around the predicted position first. As it keeps the recent
+    centroids of each roi, frames must be given in order. stats (from new_window_stats()) counts the frames which were
+    found in the window and the frames where the full roi was searched"""
+    find_blob = largest_component if blob_backend in ["components", "label_map"] else largest_contour
+    if stats is None:
+        stats = new_window_stats()
+    history = {roi: [] for roi in roi_nums}
+
+    def find_blobs_predictive(gray):
+        blobs = dict()
+        for roi in roi_nums:
+            x, y, w, h = rois["roi_" + str(roi)]
+            contour = None
+            bounds = window_bounds(predict_position(history[roi]), half_window, w, h) if history[roi] else None
+            # predictions far outside of the roi give an empty window
+            if bounds is not None and bounds[2] - bounds[0] > 1 and bounds[3] - bounds[1] > 1:
+                x0, y0, x1, y1 = bounds
+                window_delta = cv2.absdiff(background_full[y + y0:y + y1, x + x0:x + x1],
+                                           gray[y + y0:y + y1, x + x0:x + x1])
+                contour, n_blobs = find_blob(window_delta, threshold)
+                if contour is not None and confident_in_window(contour, area_size, bounds, w, h):
+                    contour = contour + np.array([x0, y0], dtype=contour.dtype)
+                    stats["window"] += 1
+                else:
+                    contour = None
+
+            if contour is None:
+                frame_delta = cv2.absdiff(background_full[y:y + h, x:x + w], gray[y:y + h, x:x + w])
+                contour, n_blobs = find_blob(frame_delta, threshold)
+                stats["full"] += 1
+
+            if contour is not None and cv2.contourArea(contour) > area_size:
+                history[roi] = (history[roi] + [contour_centroid(contour)])[-2:]
+            else:
+                history[roi] = []
+            blobs[roi] = (contour, n_blobs)
+        return blobs
+
+    return find_blobs_predictive
@@ -13,9 +13,10 @@ from tkinter import Tk
 import cv2.cv2 as cv2
 
 from cichlidanalysis.tracking.rois import define_roi_still
-from cichlidanalysis.tracking.offline_tracker import tracker
+from cichlidanalysis.tracking.batch_tracking import make_track_jobs, track_videos_parallel
 from cichlidanalysis.tracking.helpers import correct_tags
-from cichlidanalysis.tracking.backgrounds import background_vid, update_background
+from cichlidanalysis.tracking.backgrounds import update_background
+from cichlidanalysis.tracking.background_cache import get_background
 from cichlidanalysis.io.meta import extract_meta, load_yaml
 from cichlidanalysis.io.tracks import remove_tags, get_file_paths_from_nums
 from cichlidanalysis.io.movies import get_movie_paths
@@ -34,7 +35,7 @@ if __name__ == '__main__':
         percentile = 90
         if background_update_files == 'a':
             # percentile = input("Run with which percentile? 90 is default")
-            update_background(percentile)
+            update_background(percentile, n_workers=os.cpu_count())
 
         elif background_update_files == 'n':
             root = Tk()
@@ -45,13 +46,40 @@ if __name__ == '__main__':
             root.destroy()
 
             # percentile = input("Run with which percentile? 90 is default")
-            background_vid(video_file_back, 200, percentile)
+            get_background(video_file_back, 200, percentile, display=True)
 
     track_videos = 'm'
     while track_videos not in {'y', 'n'}:
         track_videos = input("Track videos? y/n: \n")
 
     if track_videos == 'y':
+        n_workers = ''
+        while not n_workers.isdigit() or int(n_workers) < 1:
+            n_workers = input("How many videos to track in parallel? (1 = one after another, max {}): \n".format(
+                os.cpu_count()))
+        n_workers = int(n_workers)
+
+        # remakes the background of each video from its sampled frames right before tracking it
+        fused = 'm'
+        while fused not in {'y', 'n'}:
+            fused = input("Remake the backgrounds while tracking (one decode per video)? y/n: \n")
+
+        # a background every bank_interval minutes follows slow changes of the scene within a video
+        bank_interval = ''
+        while not bank_interval.isdigit() or 60 % max(int(bank_interval), 1) != 0:
+            bank_interval = input("Track with a new background every ... min (60 needs to be divisible by it, 0 for "
+                                  "one background per video)?: \n")
+        bank_interval = int(bank_interval)
+        if bank_interval > 0:
+            # the bank is made from the video, no background files are needed
+            fused = 'y'
+
+        # the threshold of each video and roi is calibrated from sampled frames (see tracking/threshold_calibration.py)
+        calibrate = 'm'
+        while calibrate not in {'y', 'n'}:
+            calibrate = input("Calibrate the threshold of each video automatically (y) or track with 35 (n)?: \n")
+        threshold = "auto" if calibrate == 'y' else 35
+
         track_all = 'm'
         while track_all not in {'y', 'n', 's'}:
             track_all = input("Track all videos (y)? one video (n) or select videos (s): \n")
@@ -165,48 +193,57 @@ if __name__ == '__main__':
                 define_roi_still(background_crop, vid_dir)
                 vid_rois = load_yaml(vid_dir, "roi_file")
 
+            video_paths, background_paths = [], []
             for idx, val in enumerate(video_files):
+                if fused == 'y':
+                    video_paths.append(os.path.join(vid_dir, val))
+                    continue
                 movie_n = val.split("_")[1]
                 background_of_movie = [i for i in backgrounds if i.split("_")[1] == movie_n]
                 if not background_of_movie:
                     print("didn't find background, stopping tracking")
                     break
                 print("tracking with background {}".format(background_of_movie))
-                background_full = cv2.imread(background_of_movie[0], 0)
-                if new_bgd:
-                    background_crop = background_full
-                else:
-                    background_crop = background_full[curr_roi[1]:curr_roi[1] + curr_roi[3], curr_roi[0]:curr_roi[0] +
-                                                                                                         curr_roi[2]]
-                tracker(os.path.join(vid_dir, val), background_crop, vid_rois, threshold=35, display=False,
-                        area_size=100)
+                video_paths.append(os.path.join(vid_dir, val))
+                background_paths.append(os.path.abspath(background_of_movie[0]))
+
+            jobs = make_track_jobs(video_paths, None if fused == 'y' else background_paths, vid_rois,
+                                   threshold=threshold, area_size=100, background_crop=None if new_bgd else curr_roi,
+                                   bank_interval=bank_interval)
+            track_videos_parallel(jobs, n_workers=n_workers)
 
         else:
             vid_rois = load_yaml(cam_dir, "roi_file")
             width_trim, height_trim = vid_rois['roi_{}'.format(fish_data['roi'][-1])][2:4]
             rois = {'roi_0': (0, 0, width_trim, height_trim)}
 
+            video_paths, background_paths = [], []
             for idx, val in enumerate(video_files):
+                if fused == 'y':
+                    video_paths.append(os.path.join(vid_dir, val))
+                    continue
                 movie_n = val.split("_")[1]
                 background_of_movie = [i for i in backgrounds if (i.split('/')[-1]).split("_")[1] == movie_n]
                 print("tracking with background {}".format(background_of_movie[0]))
-                background = cv2.imread(background_of_movie[0], 0)
-
-                # check if using an old background (need to crop) or new
-                if new_bgd:
-                    background_crop = background
-                else:
-                    curr_roi_n = vid_dir.split("_")[-3][1]
-                    curr_roi = vid_rois['roi_{}'.format(curr_roi_n)]
-                    background_crop = background[curr_roi[1]:curr_roi[1] + curr_roi[3], curr_roi[0]:curr_roi[0] +
-                                                                                                 curr_roi[2]]
-                    # extremely rarely the background needs to be padded, this hack can be used
-                    # Used for:
-                    # FISH20211103_c5_r1_Lepidiolamprologus-elongatus_su, FISH20211006_c3_r0_Neolamprologus-brevis_su
-                    # import numpy as np
-                    # background_crop = np.vstack([background_crop, np.zeros([1, curr_roi[2]], dtype='uint8')])
-
-                tracker(os.path.join(vid_dir, val), background_crop, rois, threshold=35, display=False, area_size=100)
+                video_paths.append(os.path.join(vid_dir, val))
+                background_paths.append(os.path.abspath(background_of_movie[0]))
+
+            # check if using an old background (need to crop) or new
+            if new_bgd:
+                background_crop = None
+            else:
+                curr_roi_n = vid_dir.split("_")[-3][1]
+                background_crop = vid_rois['roi_{}'.format(curr_roi_n)]
+                # extremely rarely the background needs to be padded, this hack can be used (in _run_track_job)
+                # Used for:
+                # FISH20211103_c5_r1_Lepidiolamprologus-elongatus_su, FISH20211006_c3_r0_Neolamprologus-brevis_su
+                # import numpy as np
+                # background_crop = np.vstack([background_crop, np.zeros([1, curr_roi[2]], dtype='uint8')])
+
+            jobs = make_track_jobs(video_paths, None if fused == 'y' else background_paths, rois,
+                                   threshold=threshold, area_size=100, background_crop=background_crop,
+                                   bank_interval=bank_interval)
+            track_videos_parallel(jobs, n_workers=n_workers)
 
         # find cases where a movie has multiple csv files, add exclude tag to the ones from not today (date in file
         # names) and replace timestamps.
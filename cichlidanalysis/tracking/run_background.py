@@ -6,9 +6,10 @@
 import datetime
 
 import cv2
-import numpy as np
 import PySpin
 
+from cichlidanalysis.tracking.streaming_percentile import new_percentile_estimator, add_frame, estimator_percentile
+
 
 def background(cam_ID, length, nth_frame, width_trim, height_trim, path, percentile):
     """ (str, int, int, int, str, int)
@@ -48,14 +49,14 @@ def background(cam_ID, length, nth_frame, width_trim, height_trim, path, percent
     height = image_result.GetHeight()
 
     # settings with Blur settings for the video loop
-    gathered_frames = []
+    gathered_frames = new_percentile_estimator()
     for counter in range(length):
         image = cam.GetNextImage().GetData().reshape((height, width))[0:height_trim, 0:width_trim]
         if counter % nth_frame == 0:
             print("Frame {}".format(counter))
-            gathered_frames.append(image)
+            add_frame(gathered_frames, image)
 
-    background = np.percentile(gathered_frames, percentile, axis=0).astype(dtype=np.uint8)
+    background = estimator_percentile(gathered_frames, percentile)
     cv2.imshow('Calculated Background', background)
 
     # background = np.percentile(frameMedian, 90, axis=0).astype(dtype=np.uint8)
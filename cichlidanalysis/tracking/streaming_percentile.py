@@ -0,0 +1,91 @@
+# Streaming per pixel percentiles of uint8 frames in bounded memory, for making backgrounds of long videos. Frames are
+# kept as they are (1 byte per pixel per frame) until there are as many as a per pixel histogram costs (256 uint16
+# counts = 512 bytes per pixel), after that they are counted in the histograms. So memory stops growing at about 512
+# bytes per pixel however many frames are added, instead of growing with every sampled frame. Percentiles are exact:
+# the same as np.percentile(frames, percentile, axis=0).astype(np.uint8).
+
+import numpy as np
+
+# number of frames kept before switching to histograms (where the histograms use the same memory)
+MAX_STACK = 512
+# pixels per block when calculating percentiles from the histograms, limits the memory of the cumulative sums
+BLOCK_PIXELS = 2 ** 16
+
+
+def new_percentile_estimator(max_stack=MAX_STACK):
+    return {"frames": [], "hist": None, "n": 0, "shape": None, "max_stack": max_stack}
+
+
+def _to_histogram(estimator):
+    n_pixels = int(np.prod(estimator["shape"]))
+    estimator["hist"] = np.zeros((n_pixels, 256), dtype=np.uint16)
+    # offset of the histogram of each pixel in the flattened histograms
+    estimator["offsets"] = np.arange(n_pixels, dtype=np.int64) * 256
+    frames = estimator["frames"]
+    estimator["frames"] = []
+    for frame in frames:
+        _count_frame(estimator, frame)
+
+
+def _count_frame(estimator, frame):
+    hist = estimator["hist"]
+    if hist.dtype == np.uint16 and estimator["n"] >= np.iinfo(np.uint16).max:
+        estimator["hist"] = hist = hist.astype(np.uint32)
+    # each pixel has its own histogram so there are no repeated indices
+    hist.reshape(-1)[estimator["offsets"] + frame.ravel()] += 1
+
+
+def add_frame(estimator, frame):
+    """ Adds a uint8 grayscale frame (all frames must have the same shape) """
+    frame = np.asarray(frame, dtype=np.uint8)
+    if estimator["shape"] is None:
+        estimator["shape"] = frame.shape
+    elif frame.shape != estimator["shape"]:
+        raise ValueError("frame shape {} doesn't match {}".format(frame.shape, estimator["shape"]))
+
+    if estimator["hist"] is None:
+        estimator["frames"].append(frame.copy())
+        if len(estimator["frames"]) > estimator["max_stack"]:
+            _to_histogram(estimator)
+    else:
+        _count_frame(estimator, frame)
+    estimator["n"] += 1
+
+
+def _lerp(a, b, t):
+    """ Linear interpolation as numpy does it for percentiles (so rounding is identical) """
+    diff = b - a
+    return np.where(t >= 0.5, b - diff * (1 - t), a + diff * t)
+
+
+def _order_statistic(cumulative, k):
+    """ Value of the k-th smallest (from 0) sample of each pixel from the cumulative histogram counts """
+    return np.argmax(cumulative > k, axis=1).astype(np.float64)
+
+
+def estimator_percentiles(estimator, percentiles):
+    """ List of the percentile images (uint8) of the frames added so far, one for each of percentiles. The histograms
+    are summed up once for all percentiles"""
+    if estimator["n"] == 0:
+        raise ValueError("no frames added")
+    if estimator["hist"] is None:
+        return list(np.percentile(estimator["frames"], percentiles, axis=0).astype(dtype=np.uint8))
+
+    n = estimator["n"]
+    hist = estimator["hist"]
+    results = [np.empty(hist.shape[0], dtype=np.uint8) for _ in percentiles]
+    for start in range(0, hist.shape[0], BLOCK_PIXELS):
+        cumulative = np.cumsum(hist[start:start + BLOCK_PIXELS], axis=1, dtype=np.uint32)
+        for result, percentile in zip(results, percentiles):
+            rank = np.true_divide(percentile, 100) * (n - 1)
+            lower = int(np.floor(rank))
+            upper = min(lower + 1, n - 1)
+            low = _order_statistic(cumulative, lower)
+            high = _order_statistic(cumulative, upper) if upper != lower else low
+            result[start:start + BLOCK_PIXELS] = _lerp(low, high, rank - lower).astype(np.uint8)
+    return [result.reshape(estimator["shape"]) for result in results]
+
+
+def estimator_percentile(estimator, percentile):
+    """ The percentile image (uint8) of the frames added so far """
+    return estimator_percentiles(estimator, [percentile])[0]
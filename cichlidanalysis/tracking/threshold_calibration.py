@@ -0,0 +1,193 @@
+# Headless threshold calibration, instead of finding the threshold of each video by hand with
+# helpers.threshold_select. Frames are sampled across the video, background subtracted and thresholded with each
+# threshold of a range, and each threshold is scored per roi by:
+# single: fraction of sampled frames with exactly one blob larger than area_size (the fish and nothing else)
+# area_cv: coefficient of variation of the area of the largest blob (the fish should stay about the same size)
+# noise: mean number of blobs per frame which are too small to be the fish
+# The best threshold of each roi is saved in {video}_threshold_calibration.yaml next to the video, which
+# calibrated_tracker reads to track each roi with its threshold (and calibrates first if it isn't there). The file is
+# tied to a hash of the background it was made with, rois calibrated later with the same background are merged into it.
+
+import hashlib
+import os
+
+import cv2.cv2 as cv2
+import numpy as np
+import yaml
+
+from cichlidanalysis.io.ffmpeg_capture import open_video, rois_bounding_box, crop_rois
+from cichlidanalysis.io.movies import sampled_frames
+from cichlidanalysis.tracking.offline_tracker import tracker
+
+CALIBRATION_THRESHOLDS = list(range(10, 85, 5))
+# thresholds scoring within this of the best score are counted as equally good
+SCORE_TOLERANCE = 0.02
+
+
+def calibration_file_name(video_path):
+    return video_path[0:-4] + "_threshold_calibration.yaml"
+
+
+def background_hash(background_full):
+    return hashlib.sha1(np.ascontiguousarray(background_full).tobytes()).hexdigest()[0:16]
+
+
+def blob_areas(frame_delta, threshold):
+    """ Areas of all external contours of the thresholded image """
+    image_thresholded = cv2.threshold(frame_delta, threshold, 255, cv2.THRESH_TOZERO)[1]
+    (contours, _) = cv2.findContours(image_thresholded, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    return np.array([cv2.contourArea(contour) for contour in contours])
+
+
+def calibration_stats(frame_areas, area_size):
+    """ Calibration statistics of one roi and threshold from the blob areas of each sampled frame """
+    n_frames = max(len(frame_areas), 1)
+    n_fish_sized = np.array([np.sum(areas > area_size) for areas in frame_areas])
+    largest = np.array([areas.max() for areas in frame_areas if np.any(areas > area_size)])
+    return {"frames": len(frame_areas), "single": float(np.sum(n_fish_sized == 1) / n_frames),
+            "area_cv": float(np.std(largest) / np.mean(largest)) if len(largest) > 1 else float("nan"),
+            "noise": float(sum(np.sum(areas <= area_size) for areas in frame_areas) / n_frames)}
+
+
+def calibration_score(stats):
+    """ Single number to rank thresholds by, higher is better: the single blob rate with small penalties for an
+    unstable area and for noise blobs (at most 10 per frame are counted)
+    >>> calibration_score({"single": 0.9, "area_cv": 0.2, "noise": 3.0})
+    0.85
+    """
+    area_cv = stats["area_cv"] if not np.isnan(stats["area_cv"]) else 1
+    return round(stats["single"] - 0.1 * area_cv - 0.01 * min(stats["noise"], 10), 6)
+
+
+def best_threshold(scores, tolerance=SCORE_TOLERANCE):
+    """ The middle one of the thresholds which score within tolerance of the best score, so that the threshold isn't
+    right at the edge where noise or losing the fish starts
+    >>> best_threshold({10: 0.2, 15: 0.95, 20: 0.96, 25: 0.95, 30: 0.5})
+    20
+    """
+    top = max(scores.values())
+    good = sorted(threshold for threshold, score in scores.items() if score >= top - tolerance)
+    return good[len(good) // 2]
+
+
+def calibrate_threshold(video_path, background_full, rois, thresholds=None, area_size=100, roi_nums=None,
+                        n_samples=200, video_reader="opencv", sampling="stratified"):
+    """ Samples about n_samples frames across the video, scores each threshold for each roi (see calibration_score)
+    and saves the scores and the best threshold of each roi in {video}_threshold_calibration.yaml. Rois which are
+    already in the file for the same background, thresholds and area_size are kept.
+
+    :return: calibration dict with "rois" (roi: threshold: stats and score) and "best" (roi: best threshold)
+    """
+    if thresholds is None:
+        thresholds = CALIBRATION_THRESHOLDS
+    thresholds = [int(threshold) for threshold in thresholds]
+    rois = dict(rois)
+    if len(rois) == 1:
+        rois['cam'] = 'unknown'
+    if roi_nums is None:
+        roi_nums = list(range(0, len(rois) - 1))
+    calibration = {"thresholds": thresholds, "area_size": area_size, "background": background_hash(background_full),
+                   "rois": dict(), "best": dict()}
+    if background_full.ndim == 3:
+        background_full = cv2.cvtColor(background_full, cv2.COLOR_BGR2GRAY)
+
+    video = open_video(video_path, video_reader, crop=rois_bounding_box(rois, roi_nums))
+    crop = getattr(video, "crop", None)
+    if crop is not None:
+        background_full = background_full[crop[1]:crop[1] + crop[3], crop[0]:crop[0] + crop[2]]
+        rois = crop_rois(rois, crop)
+    n_frames = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+    nth_frame = max(n_frames // n_samples, 1)
+
+    frame_areas = {(roi, threshold): [] for roi in roi_nums for threshold in thresholds}
+    for _, gray in sampled_frames(video, nth_frame, sampling=sampling):
+        frame_delta_full = cv2.absdiff(background_full, gray)
+        for roi in roi_nums:
+            x, y, w, h = rois["roi_" + str(roi)]
+            for threshold in thresholds:
+                frame_areas[(roi, threshold)].append(blob_areas(frame_delta_full[y:y + h, x:x + w], threshold))
+    video.release()
+
+    existing = load_calibration(video_path)
+    if existing and all(existing.get(key) == calibration[key] for key in ["thresholds", "area_size", "background"]):
+        calibration["rois"], calibration["best"] = existing["rois"], existing["best"]
+    for roi in roi_nums:
+        calibration["rois"][roi] = dict()
+    for (roi, threshold), areas in frame_areas.items():
+        stats = calibration_stats(areas, area_size)
+        calibration["rois"][roi][threshold] = dict(stats, score=calibration_score(stats))
+    for roi in roi_nums:
+        calibration["best"][roi] = best_threshold({threshold: stats["score"] for threshold, stats in
+                                                   calibration["rois"][roi].items()})
+
+    # written to a temporary file first, so a tracker reading it never sees half a file
+    temp_path = calibration_file_name(video_path) + ".tmp"
+    with open(temp_path, "w") as file:
+        yaml.dump(calibration, file)
+    os.replace(temp_path, calibration_file_name(video_path))
+    print_calibration(calibration)
+    return calibration
+
+
+def print_calibration(calibration):
+    """ Table of the calibration statistics of each roi and threshold, marking the chosen threshold of each roi """
+    for roi in sorted(calibration["rois"]):
+        best = calibration["best"][roi]
+        for threshold in sorted(calibration["rois"][roi]):
+            stats = calibration["rois"][roi][threshold]
+            print("roi {} threshold {}: single blob {:.1%}, area cv {:.2f}, noise blobs {:.1f}, score {:.3f}{}".format(
+                roi, threshold, stats["single"], stats["area_cv"], stats["noise"], stats["score"],
+                " <- chosen" if threshold == best else ""))
+
+
+def load_calibration(video_path):
+    """ Loads the calibration of a video, {} if it wasn't calibrated """
+    if not os.path.isfile(calibration_file_name(video_path)):
+        return {}
+    with open(calibration_file_name(video_path)) as file:
+        return yaml.load(file, Loader=yaml.FullLoader)
+
+
+def calibrated_thresholds(video_path, background_full, rois, roi_nums, area_size=100, video_reader="opencv"):
+    """ Best threshold of each roi in roi_nums from the calibration file of the video, calibrates the rois which have
+    no calibration for this background and area_size yet
+
+    :return: dict of roi: threshold
+    """
+    calibration = load_calibration(video_path)
+    if calibration and (calibration["area_size"] != area_size or
+                        calibration.get("background") != background_hash(background_full)):
+        print("the threshold calibration of {} was made with another background or area size".format(video_path))
+        calibration = {}
+    missing = [roi for roi in roi_nums if roi not in calibration.get("best", {})]
+    if missing:
+        print("calibrating the threshold of rois {} of {}".format(missing, video_path))
+        calibration = calibrate_threshold(video_path, background_full, rois, area_size=area_size, roi_nums=missing,
+                                          video_reader=video_reader)
+    return {roi: calibration["best"][roi] for roi in roi_nums}
+
+
+def calibrated_tracker(video_path, background_full, rois, area_size=100, roi_nums=None, video_reader="opencv",
+                       background_bank=None, **tracker_kwargs):
+    """ Tracks each roi with its calibrated threshold (see calibrated_thresholds, with a background bank its first
+    background is used for the calibration). Rois with the same threshold are tracked together, so the video is
+    decoded once per threshold. Other keyword arguments are passed to offline_tracker.tracker, except an opened video
+    as it can only be read once.
+
+    :return: dict of roi: threshold
+    """
+    if "video" in tracker_kwargs:
+        raise ValueError("calibrated tracking opens the video for each threshold, it can't be given an opened video")
+    rois = dict(rois)
+    if len(rois) == 1:
+        rois['cam'] = 'unknown'
+    if roi_nums is None:
+        roi_nums = list(range(0, len(rois) - 1))
+    calibration_background = background_full if background_bank is None else background_bank["backgrounds"][0]
+    roi_thresholds = calibrated_thresholds(video_path, calibration_background, rois, roi_nums, area_size, video_reader)
+    for threshold in sorted(set(roi_thresholds.values())):
+        print("tracking with the calibrated threshold {}".format(threshold))
+        tracker(video_path, background_full, dict(rois), threshold=threshold, area_size=area_size,
+                roi_nums=[roi for roi in roi_nums if roi_thresholds[roi] == threshold], video_reader=video_reader,
+                background_bank=background_bank, **tracker_kwargs)
+    return roi_thresholds
@@ -0,0 +1,76 @@
+# Counters and rate limited messages for tracking events. Printing a message for every frame without a fish floods the
+# terminal and slows tracking down, so each event is counted per roi and a message is printed at most once every
+# interval_s seconds per event and roi (saying how many were not printed). At the end of a video print_track_summary
+# gives the frames with no contour, too small contours and multiple contours, and the longest gap, for each roi.
+
+import time
+
+EVENT_MESSAGES = {"no_contour": "no contour found for roi {}!",
+                  "small_contour": "no large enough contour found for roi {}!"}
+
+
+def new_track_log(interval_s=10.0):
+    """ Dictionary keeping the event counters. Counters are dictionaries of roi: count, the gaps are runs of frames
+    where the fish wasn't found"""
+    return {"interval_s": interval_s, "frames": {}, "no_contour": {}, "small_contour": {}, "multiple_contours": {},
+            "gap_start": {}, "longest_gap": {}, "last_print": {}, "not_printed": {}}
+
+
+def _count(counter, roi):
+    counter[roi] = counter.get(roi, 0) + 1
+
+
+def log_message(track_log, key, message):
+    """ Prints the message unless one with the same key was printed less than interval_s ago, in which case it is
+    only counted """
+    now = time.monotonic()
+    if now - track_log["last_print"].get(key, -track_log["interval_s"]) < track_log["interval_s"]:
+        _count(track_log["not_printed"], key)
+        return
+    not_printed = track_log["not_printed"].pop(key, 0)
+    if not_printed:
+        message += " ({} more since the last message)".format(not_printed)
+    print(message)
+    track_log["last_print"][key] = now
+
+
+def _end_gap(track_log, roi, frame_id):
+    start = track_log["gap_start"].pop(roi, None)
+    if start is None:
+        return
+    length = frame_id - start
+    if length > track_log["longest_gap"].get(roi, (0, None))[0]:
+        track_log["longest_gap"][roi] = (length, start)
+
+
+def log_roi_frame(track_log, roi, frame_id, event=None, n_blobs=1):
+    """ Records the result of one roi in one frame. event is None when the fish was found, otherwise "no_contour" or
+    "small_contour". n_blobs is the number of blobs found in the roi """
+    _count(track_log["frames"], roi)
+    if n_blobs > 1:
+        _count(track_log["multiple_contours"], roi)
+    if event is None:
+        _end_gap(track_log, roi, frame_id)
+        return
+    _count(track_log[event], roi)
+    track_log["gap_start"].setdefault(roi, frame_id)
+    log_message(track_log, (event, roi), EVENT_MESSAGES[event].format(roi))
+
+
+def print_track_summary(track_log, last_frame=None):
+    """ Summary of the events of each roi. Gaps still open are closed at last_frame (the frame after the last tracked
+    frame)"""
+    for roi in sorted(track_log["frames"]):
+        if last_frame is not None:
+            _end_gap(track_log, roi, last_frame)
+        n_frames = track_log["frames"][roi]
+        no_contour = track_log["no_contour"].get(roi, 0)
+        small_contour = track_log["small_contour"].get(roi, 0)
+        summary = "roi {}: {} frames, no contour in {} ({:.1%}), too small contour in {} ({:.1%}), multiple contours " \
+                  "in {} ({:.1%})".format(roi, n_frames, no_contour, no_contour / n_frames, small_contour,
+                                          small_contour / n_frames, track_log["multiple_contours"].get(roi, 0),
+                                          track_log["multiple_contours"].get(roi, 0) / n_frames)
+        if roi in track_log["longest_gap"]:
+            length, start = track_log["longest_gap"][roi]
+            summary += ", longest gap {} frames from frame {}".format(length, start)
+        print(summary)